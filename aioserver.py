@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import asyncio, email.parser, logging
+from http import HTTPStatus
+from http.client import HTTPMessage
+from email.utils import formatdate
+from httputils import ResponseMixin, CHUNK_SIZE
+
+"""
+Minimal asyncio HTTP/1.1 server
+Every connection is a coroutine, so thousands of clients waiting for their write concern cost
+no OS threads. Handlers expose the same methods as KeepAliveRequestHandler
+(read_body / send_body / send_chunked / send_text / send_entries) and may define do_GET / do_POST
+either as plain methods or as coroutines.
+The module also has a minimal keep-alive client, used where many small requests run on one event loop.
+"""
+MAX_HEADERS = 100
+
+async def iterate(chunks):
+    for chunk in chunks:
+        yield chunk
+
+# header lines up to the empty line
+async def read_headers(reader):
+    header_lines = []
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        header_lines.append(line)
+        if len(header_lines) > MAX_HEADERS:
+            raise ValueError("Too many headers")
+    return email.parser.BytesParser(_class=HTTPMessage).parsebytes(b''.join(header_lines))
+
+class AsyncRequestHandler(ResponseMixin):
+    # value of the Server header
+    server_name = None
+
+    # constructor
+    def __init__(self, writer, client_address, command, path, request_version, headers, body):
+        self.writer = writer
+        self.client_address = client_address
+        self.command = command
+        self.path = path
+        self.request_version = request_version
+        self.headers = headers
+        self.body = body
+        # chunks of the streamed response, written by the server once the handler returns
+        self.stream = None
+
+    def address_string(self):
+        return self.client_address[0]
+
+    # the body is read by the server before the handler is called
+    def read_body(self):
+        return self.body
+
+    def write_head(self, code, content_type, headers):
+        lines = [f'HTTP/1.1 {code} {HTTPStatus(code).phrase}', f'Server: {self.server_name}', f'Date: {formatdate(usegmt=True)}', f'Content-Type: {content_type}']
+        lines += [f'{key}: {value}' for key, value in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    # send the complete response
+    def send_body(self, code, body, content_type='text/plain; charset=utf-8', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        # a 304 answer has no body, its Content-Length would be the one of the full answer
+        self.write_head(code, content_type, dict(headers or {}, **({'Content-Length': str(len(body))} if code != 304 else {})))
+        self.writer.write(body)
+
+    # the chunks are written by the server with flow control
+    def send_chunked(self, code, chunks, content_type, headers=None):
+        self.write_head(code, content_type, dict(headers or {}, **{'Transfer-Encoding': 'chunked'}))
+        self.stream = chunks
+
+    # the chunks come from a generator or, for the responses waiting on events, from an async generator
+    async def write_stream(self):
+        buffer = []
+        buffer_size = 0
+        chunks = self.stream if hasattr(self.stream, '__aiter__') else iterate(self.stream)
+        async for chunk in chunks:
+            buffer.append(chunk)
+            buffer_size += len(chunk)
+            # an empty chunk asks for what has been produced so far to be sent right away
+            if buffer_size >= CHUNK_SIZE or (not chunk and buffer_size):
+                data = b''.join(buffer)
+                self.writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+                await self.writer.drain()
+                buffer = []
+                buffer_size = 0
+        if buffer:
+            data = b''.join(buffer)
+            self.writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.writer.write(b'0\r\n\r\n')
+
+
+class AsyncHTTPServer():
+
+    # constructor
+    def __init__(self, port, handler_class, idle_timeout=None, backlog=1024):
+        self.port = port
+        self.handler_class = handler_class
+        self.idle_timeout = idle_timeout
+        self.backlog = backlog
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self.handle_connection, port=self.port, backlog=self.backlog)
+        async with server:
+            await server.serve_forever()
+
+    # read the request line and the headers, None when the client has closed the connection
+    async def read_head(self, reader):
+        request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        if not request_line:
+            return None
+        headers = await read_headers(reader)
+        return request_line.decode('latin-1').split(), headers
+
+    async def handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    head = await self.read_head(reader)
+                except (asyncio.TimeoutError, ConnectionError):
+                    break
+                if head is None:
+                    break
+                words, headers = head
+                if len(words) != 3:
+                    break
+                command, path, request_version = words
+                if headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                    handler = self.handler_class(writer, client_address, command, path, request_version, headers, b'')
+                    handler.send_text(411, "Chunked request bodies are not supported, send Content-Length")
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(int(headers.get('Content-Length') or 0))
+                handler = self.handler_class(writer, client_address, command, path, request_version, headers, body)
+                method = getattr(handler, 'do_' + command, None)
+                if method is None:
+                    handler.send_text(501, f"Unsupported method ({command})")
+                else:
+                    result = method()
+                    if asyncio.iscoroutine(result):
+                        await result
+                    if handler.stream is not None:
+                        await handler.write_stream()
+                await writer.drain()
+                connection = headers.get('Connection', '').lower()
+                if connection == 'close' or (request_version == 'HTTP/1.0' and connection != 'keep-alive'):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logging.error(f'[HTTP] Exception: {e}')
+        finally:
+            writer.close()
+
+
+class AsyncHTTPConnection():
+    """
+    One keep-alive connection to a server, requests are sent one at a time.
+    The connection is opened on the first request and reopened after any error.
+    Only Content-Length bodies are supported
+    """
+
+    # constructor
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    # returns the status code, the headers and the body, the timeout covers the whole request
+    async def request(self, method, path, headers=None, body=b'', timeout=None):
+        try:
+            return await asyncio.wait_for(self.exchange(method, path, headers or {}, body), timeout)
+        except BaseException:
+            self.close()
+            raise
+
+    async def exchange(self, method, path, headers, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', f'Content-Length: {len(body)}']
+        lines += [f'{key}: {value}' for key, value in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server")
+        status = int(status_line.split()[1])
+        response_headers = await read_headers(self.reader)
+        response_body = await self.reader.readexactly(int(response_headers.get('Content-Length') or 0))
+        if response_headers.get('Connection', '').lower() == 'close':
+            self.close()
+        return status, response_headers, response_body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+import sys, os, json, time, re, random, shutil, argparse, tempfile, threading, subprocess, http.client
+from datetime import datetime
+
+"""
+Replication benchmark
+Starts a Master and N Secondaries on local ports, drives an append workload against the Master and
+reports throughput, append latency per write concern and replication lag of every Secondary.
+Results are saved as JSON, --compare checks them against a previous run.
+"""
+script_path = os.path.dirname(os.path.realpath(__file__))
+MSG_ID_RE = re.compile(r'msg_id = (\d+)')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replicated log benchmark")
+    parser.add_argument("--secondaries", type=int, default=2, help="number of Secondaries")
+    parser.add_argument("--messages", type=int, default=10000, help="number of appended messages")
+    parser.add_argument("--msg-size", type=int, default=100, help="message size in bytes")
+    parser.add_argument("--concurrency", type=int, default=16, help="number of concurrent clients")
+    parser.add_argument("--w-mix", default="1:1,2:1,3:1", help="write concerns with their weights, w:weight,...")
+    parser.add_argument("--delay-ms", default="", help="injected replication delay of the Secondaries, ms,ms,...")
+    parser.add_argument("--server-mode", choices=("threaded", "asyncio"), help="Master serving mode")
+    parser.add_argument("--storage", choices=("memory", "segment"), help="Master storage engine")
+    parser.add_argument("--fsync", choices=("always", "group", "none"), help="fsync policy of the segment store")
+    parser.add_argument("--base-port", type=int, default=18080, help="Master port, Secondaries use the next ones")
+    parser.add_argument("--lag-interval-ms", type=int, default=100, help="replication lag sampling interval")
+    parser.add_argument("--output", help="save results to this JSON file")
+    parser.add_argument("--compare", help="previous results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression for --compare")
+    return parser.parse_args()
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize(values_ms):
+    values_ms = sorted(values_ms)
+    return {
+        "count": len(values_ms),
+        "p50": percentile(values_ms, 0.5),
+        "p99": percentile(values_ms, 0.99),
+        "p999": percentile(values_ms, 0.999),
+        "max": values_ms[-1] if values_ms else None
+    }
+
+"""
+Cluster of local processes
+"""
+class Cluster():
+
+    # constructor
+    def __init__(self, args):
+        self.args = args
+        self.dir = tempfile.mkdtemp(prefix="replicated-log-bench-")
+        self.config_path = os.path.join(self.dir, "config.json")
+        self.processes = []
+        with open(os.path.join(script_path, "config.json")) as json_file:
+            self.config = json.load(json_file)
+        delays = [int(delay) for delay in args.delay_ms.split(",") if delay]
+        self.config["Hosts"] = [{"id": 0, "name": "Master", "type": "master", "hostname": "localhost", "port": args.base_port, "active": True}]
+        for secondary_id in range(1, args.secondaries + 1):
+            self.config["Hosts"].append({
+                                            "id": secondary_id,
+                                            "name": f"Secondary #{secondary_id}",
+                                            "type": "secondary",
+                                            "hostname": "localhost",
+                                            "port": args.base_port + secondary_id,
+                                            "active": True,
+                                            "delay_ms": delays[secondary_id - 1] if secondary_id <= len(delays) else 0
+                                        })
+        # everything the processes write goes to the temporary directory, not to the data directory of the repo
+        self.config["Storage"]["path"] = os.path.join(self.dir, "data")
+        self.config.setdefault("Retention", {})["snapshot_path"] = os.path.join(self.dir, "snapshots")
+        if args.storage:
+            self.config["Storage"]["engine"] = args.storage
+        if args.fsync:
+            self.config["Storage"]["fsync"] = args.fsync
+        if args.server_mode:
+            self.config["Server"]["mode"] = args.server_mode
+        with open(self.config_path, "w") as json_file:
+            json.dump(self.config, json_file, indent=4)
+
+    def start(self):
+        env = dict(os.environ, REPLICATED_LOG_CONFIG=self.config_path)
+        for secondary_id in range(1, self.args.secondaries + 1):
+            self.spawn(["secondary.py", str(secondary_id)], env)
+        self.spawn(["master.py"], env)
+        # the Master accepts writes once every Secondary has passed its first health check
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                status, body = request("GET", "/health", self.args.base_port)
+                if status == 200 and body.count("Healthy") == self.args.secondaries:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError("The cluster has not become healthy in 30s")
+
+    def spawn(self, argv, env):
+        log = open(os.path.join(self.dir, os.path.splitext(argv[0])[0] + "".join(argv[1:]) + ".out"), "w")
+        self.processes.append(subprocess.Popen([sys.executable] + argv, cwd=script_path, env=env, stdout=log, stderr=subprocess.STDOUT))
+
+    # the temporary directory is removed unless the output of the processes is kept for a failed run
+    def stop(self, keep=False):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        if not keep:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+def request(method, path, port, body=None):
+    connection = http.client.HTTPConnection("localhost", port, timeout=10)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, response.read().decode("utf-8")
+    finally:
+        connection.close()
+
+def contiguous_id(port):
+    connection = http.client.HTTPConnection("localhost", port, timeout=2)
+    try:
+        connection.request("GET", "/health")
+        response = connection.getresponse()
+        response.read()
+        return int(response.getheader("X-Contiguous-Id", 0))
+    finally:
+        connection.close()
+
+"""
+Workload
+"""
+class Workload():
+
+    # constructor
+    def __init__(self, args):
+        self.args = args
+        self.w_values = []
+        self.w_weights = []
+        for item in args.w_mix.split(","):
+            w, weight = item.split(":")
+            self.w_values.append(int(w))
+            self.w_weights.append(float(weight))
+        self.next_index = 0
+        self.index_lock = threading.Lock()
+        self.latencies = {w: [] for w in self.w_values}
+        # id -> time the Master has acknowledged it, used for the replication lag in ms
+        self.acked_at = {}
+        self.errors = 0
+        self.done = threading.Event()
+
+    def take(self):
+        with self.index_lock:
+            if self.next_index >= self.args.messages:
+                return None
+            self.next_index += 1
+            return self.next_index
+
+    # one client on its own keep-alive connection
+    def client(self):
+        connection = http.client.HTTPConnection("localhost", self.args.base_port, timeout=60)
+        payload = "x" * self.args.msg_size
+        while self.take() is not None:
+            w = random.choices(self.w_values, self.w_weights)[0]
+            body = json.dumps({"msg": payload, "w": w})
+            started = time.perf_counter()
+            try:
+                connection.request("POST", "/", body=body, headers={"Content-Type": "application/json"})
+                response = connection.getresponse()
+                text = response.read().decode("utf-8")
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection("localhost", self.args.base_port, timeout=60)
+                continue
+            finished = time.perf_counter()
+            match = MSG_ID_RE.search(text)
+            if response.status != 200 or match is None:
+                self.errors += 1
+                continue
+            self.latencies[w].append((finished - started) * 1000)
+            self.acked_at[int(match.group(1))] = finished
+        connection.close()
+
+    # sample how far every Secondary is behind the acknowledged messages
+    def sample_lag(self, results):
+        while not self.done.is_set():
+            self.sample_once(results)
+            time.sleep(self.args.lag_interval_ms / 1000)
+
+    def sample_once(self, results):
+        now = time.perf_counter()
+        last_id = max(self.acked_at, default=0)
+        for secondary_id in range(1, self.args.secondaries + 1):
+            try:
+                watermark = contiguous_id(self.args.base_port + secondary_id)
+            except OSError:
+                continue
+            lag = results.setdefault(secondary_id, {"messages": [], "ms": []})
+            lag["messages"].append(max(0, last_id - watermark))
+            oldest = self.acked_at.get(watermark + 1)
+            lag["ms"].append((now - oldest) * 1000 if oldest is not None and watermark < last_id else 0)
+
+    def run(self):
+        lag_samples = {}
+        sampler = threading.Thread(target=self.sample_lag, args=(lag_samples,), daemon=True)
+        clients = [threading.Thread(target=self.client) for i in range(self.args.concurrency)]
+        started = time.perf_counter()
+        sampler.start()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - started
+        self.done.set()
+        sampler.join()
+        catchup_s = self.wait_for_secondaries()
+        acked = sum(len(values) for values in self.latencies.values())
+        return {
+            "throughput_msgs_per_s": acked / elapsed,
+            "elapsed_s": elapsed,
+            "acknowledged": acked,
+            "errors": self.errors,
+            "latency_ms": {f"w={w}": summarize(values) for w, values in self.latencies.items()},
+            "replication_lag": {
+                f"secondary{secondary_id}": {
+                    "messages": summarize(samples["messages"]),
+                    "ms": summarize(samples["ms"])
+                }
+                for secondary_id, samples in lag_samples.items()
+            },
+            "catchup_after_run_s": catchup_s
+        }
+
+    # time until every Secondary has all acknowledged messages
+    def wait_for_secondaries(self, timeout=120):
+        last_id = max(self.acked_at, default=0)
+        started = time.perf_counter()
+        while time.perf_counter() - started < timeout:
+            try:
+                if all(contiguous_id(self.args.base_port + secondary_id) >= last_id for secondary_id in range(1, self.args.secondaries + 1)):
+                    return time.perf_counter() - started
+            except OSError:
+                pass
+            time.sleep(0.05)
+        return None
+
+"""
+Regression check
+"""
+def compare(results, baseline, tolerance):
+    regressions = []
+    if results["throughput_msgs_per_s"] < baseline["throughput_msgs_per_s"] * (1 - tolerance):
+        regressions.append(f'throughput {baseline["throughput_msgs_per_s"]:.1f} -> {results["throughput_msgs_per_s"]:.1f} msgs/s')
+    for name, latency in results["latency_ms"].items():
+        baseline_latency = baseline["latency_ms"].get(name)
+        if not baseline_latency:
+            continue
+        for key in ("p50", "p99", "p999"):
+            if latency[key] is not None and baseline_latency[key] is not None and latency[key] > baseline_latency[key] * (1 + tolerance):
+                regressions.append(f'{name} {key} {baseline_latency[key]:.2f} -> {latency[key]:.2f} ms')
+    return regressions
+
+def main():
+    args = parse_args()
+    cluster = Cluster(args)
+    print(f"Starting the Master and {args.secondaries} Secondaries in {cluster.dir}")
+    try:
+        cluster.start()
+        results = Workload(args).run()
+    except BaseException:
+        cluster.stop(keep=True)
+        print(f"The output of the processes is kept in {cluster.dir}")
+        raise
+    cluster.stop()
+    results["run"] = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tolerance")}
+    }
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(results, json_file, indent=4)
+    if args.compare:
+        with open(args.compare) as json_file:
+            regressions = compare(results, json.load(json_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+import math, time, threading, collections
+
+"""
+Phi accrual failure detector
+https://doi.org/10.1109/RELDIS.2004.1353004
+Instead of a fixed timeout the detector keeps the recent intervals between the heartbeats of a node
+and tells how unlikely it is, given their distribution, that the next heartbeat is still to come.
+phi = 1 means a 10% chance of a false suspicion, phi = 2 a 1% chance and so on. The threshold adapts
+to the network: a node answering every 200 ms is suspected within a few hundred ms of silence,
+a slow or jittery one gets more slack. Any sign of life counts as a heartbeat, not only the probes.
+As in Akka, the interval ending a silence which was already suspicious (phi at or above max_phi) is not
+kept: an outage would otherwise inflate the mean and the deviation and slow down the next detection.
+"""
+class PhiAccrualDetector():
+
+    # constructor
+    def __init__(self, expected_interval, window_size=100, min_std=0.05, acceptable_pause=0, max_phi=None):
+        self.lock = threading.Lock()
+        self.intervals = collections.deque(maxlen=window_size)
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        self.max_phi = max_phi
+        # the history starts with the expected interval, so a node which never answers is suspected too
+        self.intervals.append(expected_interval)
+        self.intervals.append(expected_interval + expected_interval / 2)
+        self.interval_sum = sum(self.intervals)
+        self.interval_squares = sum(interval ** 2 for interval in self.intervals)
+        self.last = time.monotonic()
+
+    # new settings on reload, the intervals are kept
+    def configure(self, min_std, acceptable_pause, max_phi):
+        with self.lock:
+            self.min_std = min_std
+            self.acceptable_pause = acceptable_pause
+            self.max_phi = max_phi
+
+    def heartbeat(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            interval = now - self.last
+            # the heartbeats of the probes and of the replication answers arrive from several threads
+            if interval <= 0:
+                return
+            suspicious = self.max_phi is not None and self.compute_phi(interval) >= self.max_phi
+            self.last = now
+            if suspicious:
+                return
+            if len(self.intervals) == self.intervals.maxlen:
+                dropped = self.intervals[0]
+                self.interval_sum -= dropped
+                self.interval_squares -= dropped ** 2
+            self.intervals.append(interval)
+            self.interval_sum += interval
+            self.interval_squares += interval ** 2
+
+    def phi(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return self.compute_phi(now - self.last)
+
+    # phi after elapsed seconds of silence, called under the lock
+    def compute_phi(self, elapsed):
+        count = len(self.intervals)
+        mean = self.interval_sum / count + self.acceptable_pause
+        std = max(math.sqrt(max(self.interval_squares / count - (self.interval_sum / count) ** 2, 0)), self.min_std)
+        # logistic approximation of the cumulative normal distribution, as used by Akka and Cassandra
+        # y is clamped so the exponent neither overflows nor underflows, phi is then ~0 or well above any threshold
+        y = min(max((elapsed - mean) / std, -15), 15)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if elapsed > mean:
+            return -math.log10(e / (1 + e))
+        return -math.log10(1 - 1 / (1 + e))
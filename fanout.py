@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import json, asyncio, threading
+
+"""
+Fan-out of new messages to the subscribers
+Every log keeps the messages which have recently become visible in one buffer shared by all of its
+subscribers, a subscriber only remembers the next id it has to send. Subscribers wait on the buffer
+and are woken up when it grows, the ones which have fallen behind the buffer read from the log itself.
+On the Master a message is visible once it is appended, on a Secondary once it is part of the
+contiguous prefix of the log.
+"""
+SSE_CONTENT_TYPE = 'text/event-stream'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+class FanOut():
+
+    # constructor
+    def __init__(self, last_id=0, capacity=10000):
+        self.capacity = capacity
+        self.condition = threading.Condition()
+        # entry i has id base_id+i, the ids are contiguous
+        self.entries = []
+        self.base_id = last_id + 1
+        # groups of messages published ahead of a gap, by their first id
+        self.early = {}
+        # called on every change, the coroutines of the asyncio server are resumed on their event loops
+        self.listeners = []
+        self.subscribers = 0
+
+    def last_id(self):
+        return self.base_id + len(self.entries) - 1
+
+    # add messages in id order, groups published out of order by concurrent appends wait for the gap to be filled
+    def publish(self, messages):
+        with self.condition:
+            if messages[0]["id"] != self.last_id() + 1:
+                self.early[messages[0]["id"]] = messages
+                return
+            self.extend(messages)
+            while self.last_id() + 1 in self.early:
+                self.extend(self.early.pop(self.last_id() + 1))
+        self.notify()
+
+    # the messages first_id-last_id have been replicated, the buffered copies get the time as the log has it
+    # subscribers which have already been sent a message do not get it again
+    def stamp(self, first_id, last_id, replicated_ts):
+        with self.condition:
+            for idx in range(max(first_id - self.base_id, 0), min(last_id - self.base_id + 1, len(self.entries))):
+                self.entries[idx] = dict(self.entries[idx], replicated_ts=replicated_ts)
+            for messages in self.early.values():
+                for idx, msg_dict in enumerate(messages):
+                    if first_id <= msg_dict["id"] <= last_id:
+                        messages[idx] = dict(msg_dict, replicated_ts=replicated_ts)
+
+    # the visible prefix of the log has grown up to last_id, read gives the new messages
+    def advance(self, last_id, read):
+        with self.condition:
+            if last_id <= self.last_id():
+                return
+            messages = list(read(self.last_id() + 1, last_id - self.last_id()))
+            if not messages:
+                return
+            if messages[0]["id"] != self.last_id() + 1:
+                # the log has been replaced by a snapshot, the buffer starts again
+                self.entries = []
+                self.base_id = messages[0]["id"]
+            self.extend(messages)
+        self.notify()
+
+    def extend(self, messages):
+        self.entries += messages
+        # trimmed in steps, so the list is not shifted on every message
+        if len(self.entries) > 2 * self.capacity:
+            trimmed = len(self.entries) - self.capacity
+            del self.entries[:trimmed]
+            self.base_id += trimmed
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+    # messages from from_id on, None when from_id is before the buffer
+    def read(self, from_id, limit):
+        with self.condition:
+            idx = from_id - self.base_id
+            if idx < 0:
+                return None
+            return self.entries[idx:idx + limit]
+
+    # wait until a message after after_id is visible, False on timeout
+    def wait(self, after_id, timeout):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.last_id() > after_id, timeout)
+
+    async def wait_async(self, after_id, timeout):
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        listener = lambda: loop.call_soon_threadsafe(changed.set)
+        with self.condition:
+            if self.last_id() > after_id:
+                return True
+            self.listeners.append(listener)
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.condition:
+                self.listeners.remove(listener)
+        return self.last_id() > after_id
+
+
+class Subscription():
+    """
+    Position of one subscriber, produces the chunks of its streamed response.
+    SSE events carry the id, so a reconnecting EventSource resumes with Last-Event-ID
+    """
+
+    # constructor
+    def __init__(self, fanout, store, from_id, fmt, batch_messages=1000, keepalive_s=15):
+        self.fanout = fanout
+        self.store = store
+        self.next_id = from_id
+        self.fmt = fmt
+        self.batch_messages = batch_messages
+        self.keepalive_s = keepalive_s
+        # set when the stream cannot go on
+        self.finished = False
+
+    # chunks of the next messages, an empty list when there is nothing new
+    def poll(self):
+        messages = self.fanout.read(self.next_id, self.batch_messages)
+        if messages is None:
+            # behind the buffer, the messages up to the buffer are read from the log
+            first_id = self.store.first_id()
+            if self.next_id < first_id:
+                self.finished = True
+                return [self.format_error(f'Messages before id {first_id} have been compacted, id {self.next_id} is no longer available'), b'']
+            limit = min(self.batch_messages, self.fanout.last_id() - self.next_id + 1)
+            messages = list(self.store.read(self.next_id, limit)) if limit > 0 else []
+        if not messages:
+            return []
+        self.next_id = messages[-1]["id"] + 1
+        # an empty chunk flushes the messages to the subscriber
+        return [self.format(msg_dict) for msg_dict in messages] + [b'']
+
+    def format(self, msg_dict):
+        if self.fmt == 'sse':
+            return f'id: {msg_dict["id"]}\ndata: {json.dumps(msg_dict)}\n\n'.encode('utf-8')
+        return json.dumps(msg_dict).encode('utf-8') + b'\n'
+
+    def format_error(self, error):
+        if self.fmt == 'sse':
+            return f'event: error\ndata: {json.dumps({"error": error, "next_id": self.next_id})}\n\n'.encode('utf-8')
+        return json.dumps({"error": error, "next_id": self.next_id}).encode('utf-8') + b'\n'
+
+    # an SSE comment or an empty NDJSON line keeps idle connections open through proxies
+    def keepalive(self):
+        return [b': keep-alive\n\n' if self.fmt == 'sse' else b'\n', b'']
+
+    def stream(self):
+        with self.fanout.condition:
+            self.fanout.subscribers += 1
+        try:
+            while True:
+                chunks = self.poll()
+                if chunks:
+                    yield from chunks
+                    if self.finished:
+                        return
+                elif not self.fanout.wait(self.next_id - 1, self.keepalive_s):
+                    yield from self.keepalive()
+        finally:
+            with self.fanout.condition:
+                self.fanout.subscribers -= 1
+
+    # the same without blocking the event loop
+    async def stream_async(self):
+        with self.fanout.condition:
+            self.fanout.subscribers += 1
+        try:
+            while True:
+                chunks = self.poll()
+                if chunks:
+                    for chunk in chunks:
+                        yield chunk
+                    if self.finished:
+                        return
+                elif not await self.fanout.wait_async(self.next_id - 1, self.keepalive_s):
+                    for chunk in self.keepalive():
+                        yield chunk
+        finally:
+            with self.fanout.condition:
+                self.fanout.subscribers -= 1
+
+def parse_subscription(params, headers, last_id):
+    """
+    First id and format of a subscription, raises ValueError.
+    By default the stream starts with the next message, Last-Event-ID resumes a reconnecting SSE client
+    """
+    fmt = params.get("format") or ('sse' if SSE_CONTENT_TYPE in headers.get('Accept', '') else 'ndjson')
+    if fmt not in ('sse', 'ndjson'):
+        raise ValueError("format must be sse or ndjson")
+    if headers.get('Last-Event-ID'):
+        from_id = int(headers.get('Last-Event-ID')) + 1
+    else:
+        from_id = int(params.get("from_id", last_id + 1))
+    if from_id < 1:
+        raise ValueError("from_id must be positive")
+    return from_id, fmt, SSE_CONTENT_TYPE if fmt == 'sse' else NDJSON_CONTENT_TYPE
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import json
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import requests
+from views import etag_matches
+
+# streamed responses are written in chunks of about this size
+CHUNK_SIZE = 64 * 1024
+
+"""
+HTTP helpers shared by the Master and the Secondaries
+"""
+class ResponseMixin():
+    """
+    Responses built on top of send_body / send_chunked of the server specific handler
+    """
+
+    # send the plain text response
+    def send_text(self, code, response, headers=None):
+        self.send_body(code, response + '\n', headers=headers)
+
+    # a cached view with its ETag, a client which has the same version gets 304 Not Modified without the body
+    def send_view(self, body, etag, headers=None):
+        headers = dict(headers or {}, **{'ETag': etag, 'Cache-Control': 'no-cache'})
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            self.send_body(304, b'', headers=headers)
+        else:
+            self.send_body(200, body, headers=headers)
+
+    # the requested range has been removed by the retention
+    def send_compacted(self, from_id, first_id):
+        self.send_body(410, f"Messages before id {first_id} have been compacted, id {from_id} is no longer available. The log starts at id {first_id}\n", headers={'X-First-Id': str(first_id)})
+
+    # stream log entries as a JSON document or as NDJSON, one entry per line
+    def send_entries(self, entries, fmt, from_id, headers=None):
+        if fmt == 'ndjson':
+            chunks = (json.dumps(msg_dict).encode('utf-8') + b'\n' for msg_dict in entries)
+            self.send_chunked(200, chunks, 'application/x-ndjson', headers=headers)
+        else:
+            self.send_chunked(200, json_entries(entries, from_id), 'application/json', headers=headers)
+
+class KeepAliveRequestHandler(ResponseMixin, BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the connection open between requests,
+    # so every response has to carry its Content-Length or be sent chunked
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, without TCP_NODELAY the body of a
+    # response on a reused connection waits for the delayed ACK of the headers
+    disable_nagle_algorithm = True
+    # value of the Server header
+    server_name = None
+
+    # read the request body
+    def read_body(self):
+        content_length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(content_length)
+
+    # send the complete response
+    def send_body(self, code, body, content_type='text/plain; charset=utf-8', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        # a 304 answer has no body, its Content-Length would be the one of the full answer
+        if code != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.send_header('Server', self.server_name)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    # send the response body with chunked transfer encoding as it is produced
+    def send_chunked(self, code, chunks, content_type, headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Server', self.server_name)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        buffer = []
+        buffer_size = 0
+        for chunk in chunks:
+            buffer.append(chunk)
+            buffer_size += len(chunk)
+            # an empty chunk asks for what has been produced so far to be sent right away
+            if buffer_size >= CHUNK_SIZE or (not chunk and buffer_size):
+                self.write_chunk(b''.join(buffer))
+                buffer = []
+                buffer_size = 0
+        if buffer:
+            self.write_chunk(b''.join(buffer))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def log_message(self, format, *args):
+        pass
+
+def create_session(pool_size):
+    """
+    Create the HTTP session keeping up to pool_size connections to a single host alive
+    """
+    session = requests.Session()
+    # https://requests.readthedocs.io/en/latest/user/advanced/#transport-adapters
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    return session
+
+def json_entries(entries, from_id):
+    """
+    Produce {"entries": [...], "next_from_id": N} piece by piece
+    """
+    next_from_id = from_id
+    separator = b''
+    yield b'{"entries": ['
+    for msg_dict in entries:
+        yield separator + json.dumps(msg_dict).encode('utf-8')
+        separator = b', '
+        next_from_id = msg_dict["id"] + 1
+    yield b'], "next_from_id": %d}\n' % next_from_id
+
+def parse_path(path):
+    """
+    Split the request path into the route and the query parameters
+    """
+    url = urlsplit(path)
+    return url.path, {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+def parse_range(params, read_conf, default_format='json', first_id=1):
+    """
+    Validate from_id / limit / format query parameters, raises ValueError
+    from_id defaults to the first id kept in the log
+    """
+    from_id = int(params.get("from_id", first_id))
+    limit = int(params.get("limit", read_conf.get("page_default_limit")))
+    fmt = params.get("format", default_format)
+    if from_id < 1:
+        raise ValueError("from_id must be a positive integer")
+    if not 0 <= limit <= read_conf.get("page_max_limit"):
+        raise ValueError(f'limit must be between 0 and {read_conf.get("page_max_limit")}')
+    if fmt not in ('json', 'ndjson', 'table'):
+        raise ValueError("format must be one of json, ndjson, table")
+    return from_id, limit, fmt
+
+def parse_bounds(params):
+    """
+    Validate min_id / max_lag_ms staleness bounds of a read, None when not set, raises ValueError
+    """
+    min_id = int(params["min_id"]) if "min_id" in params else None
+    max_lag_ms = float(params["max_lag_ms"]) if "max_lag_ms" in params else None
+    if min_id is not None and min_id < 0:
+        raise ValueError("min_id must be a non-negative integer")
+    if max_lag_ms is not None and max_lag_ms < 0:
+        raise ValueError("max_lag_ms must be non-negative")
+    return min_id, max_lag_ms
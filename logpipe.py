@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+import json, time, queue, atexit, logging, threading
+from logging.handlers import QueueHandler, QueueListener
+
+"""
+Logging setup shared by the Master and the Secondaries
+In async mode request threads only put records on a bounded queue, the file and console handlers
+run on a background listener thread. Per-request records go through request_log, which is rate limited,
+and message texts are logged through payload() so they are truncated or omitted.
+"""
+request_log = logging.getLogger("replog.request")
+payload_conf = {"log_payloads": False, "payload_max_chars": 64}
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Never blocks the request thread, records are dropped while the queue is full
+    """
+
+    # constructor
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most rate INFO/DEBUG records per second, warnings and errors always pass
+    """
+
+    # constructor
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.window = None
+        self.count = 0
+        self.suppressed = 0
+
+    def filter(self, record):
+        if not self.rate or record.levelno >= logging.WARNING:
+            return True
+        window = int(time.monotonic())
+        with self.lock:
+            if window != self.window:
+                self.window = window
+                self.count = 0
+                # report the records suppressed during the previous second on the first record of this one
+                if self.suppressed:
+                    record.msg = f'{record.getMessage()} ({self.suppressed} request log records suppressed)'
+                    record.args = ()
+                    self.suppressed = 0
+            self.count += 1
+            if self.count > self.rate:
+                self.suppressed += 1
+                return False
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON document per line
+    """
+
+    def format(self, record):
+        document = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage()
+        }
+        if record.exc_info:
+            document["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            document["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(document)
+
+
+def payload(text):
+    """
+    Message text as it may be written to the log
+    """
+    if text is None:
+        return None
+    if not payload_conf["log_payloads"]:
+        return f'<{len(text)} chars>'
+    if len(text) > payload_conf["payload_max_chars"]:
+        return text[:payload_conf["payload_max_chars"]] + '...'
+    return text
+
+def setup_logging(logfile_path, debug, logging_conf):
+    """
+    Configure the root logger according to the Logging section of config.json
+    """
+    payload_conf["log_payloads"] = logging_conf.get("log_payloads", False)
+    payload_conf["payload_max_chars"] = logging_conf.get("payload_max_chars", 64)
+
+    handlers = [
+        logging.FileHandler(logfile_path),
+        logging.StreamHandler()
+    ]
+    formatter = JsonFormatter() if logging_conf.get("format") == "json" else logging.Formatter('%(asctime)s %(levelname)s %(message)s')
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG if debug else logging.INFO)
+    if logging_conf.get("async", True):
+        log_queue = queue.Queue(logging_conf.get("queue_size", 10000))
+        root.addHandler(DroppingQueueHandler(log_queue))
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        # flush the queue on exit
+        atexit.register(listener.stop)
+    else:
+        for handler in handlers:
+            root.addHandler(handler)
+
+    request_log.addFilter(RateLimitFilter(logging_conf.get("request_rate_limit", 0)))
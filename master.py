@@ -1,22 +1,26 @@
 #!/usr/bin/env python3
-import sys, os, json, time, logging, requests, threading
+import sys, os, json, time, zlib, uuid, random, logging, requests, threading, queue, asyncio, collections
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import HTTPServer
 from socketserver import ThreadingMixIn
-from jsonschema import validate
+from jsonschema import Draft7Validator
 from tabulate import tabulate
-from random import randint
+from httputils import KeepAliveRequestHandler, create_session, parse_path, parse_range, parse_bounds, CHUNK_SIZE
+from storage import open_store, Compactor
+from wire import encode_batch, decode_acks, negotiate, Freshness, BINARY_CONTENT_TYPE, MASTER_LAST_ID_HEADER, CONTIGUOUS_ID_HEADER, MASTER_LAST_IDS_HEADER, CONTIGUOUS_IDS_HEADER
+from aioserver import AsyncRequestHandler, AsyncHTTPServer, AsyncHTTPConnection
+from detector import PhiAccrualDetector
+from fanout import FanOut, Subscription, parse_subscription
+from views import LogView, CachedView
+from topology import ClusterConfig, ConfigError
+from logpipe import setup_logging, request_log, payload
+from metrics import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 def get_config(key):
     """
-    Read config
+    Section of the cluster config, loaded once and swapped on reload (see topology.py)
     """
-    with open(os.path.join(script_path,'config.json')) as json_file:
-        try:
-            dict_conf = json.load(json_file)
-            return dict_conf[key]
-        except:
-            raise
+    return cluster_config.section(key)
 
 """
 CountDownLatch implementation
@@ -56,258 +60,1383 @@ class CountDownLatch():
             # wait to be notified when the latch is open
             self.condition.wait()
 
+"""
+Latch of a batch on a single secondary
+counts down the write concern latch once the secondary has acknowledged every message of the batch
+"""
+class GroupLatch():
+
+    # constructor
+    def __init__(self, count, latch):
+        self.count = count
+        self.latch = latch
+        self.lock = threading.Lock()
+
+    # count down the latch by one increment
+    def count_down(self):
+        with self.lock:
+            if self.count <= 0:
+                return
+            self.count -= 1
+            if self.count > 0:
+                return
+        self.latch.count_down()
+
 
 """
-HTTP-server
+Write token
+Tracks how many replicas (the Master included) have every message of a write. The request waits on the token
+for its write concern until its deadline. A write answered earlier - an async write or one past its deadline -
+hands the token out, the client asks GET /writes/<token> how far the replication has got, waiting for it if asked
 """
-# Processing Simultaneous/Asynchronous Requests with Python BaseHTTPServer
-# https://stackoverflow.com/a/12651298
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    pass
+class WriteToken():
 
-class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
-    # create a lock
-    lock = threading.Lock()
+    # constructor
+    def __init__(self, appended, w):
+        self.token = uuid.uuid4().hex
+        self.w = w
+        # id range of every partition, the messages themselves are not kept
+        self.ranges = [(log, msg_dicts[0]["id"], msg_dicts[-1]["id"]) for log, msg_dicts, position in appended]
+        self.replicas = 1
+        self.created = time.monotonic()
+        self.replicated_ts = None
+        self.condition = threading.Condition()
+        # called on every change, the coroutines waiting on the token are resumed on their event loops
+        self.listeners = []
+        if self.replicas >= self.w:
+            self.complete()
 
-    def do_GET(self):
+    # a secondary has acknowledged every message of the write
+    def count_down(self):
+        with self.condition:
+            self.replicas += 1
+            if self.replicas == self.w:
+                self.complete()
+            self.condition.notify_all()
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+    # the write concern is met, the messages get their replicated_ts before any waiter is woken up
+    def complete(self):
+        self.replicated_ts = time.time()
+        for log, first_id, last_id in self.ranges:
+            for msg_id in range(first_id, last_id + 1):
+                log.store.set_replicated_ts(msg_id, self.replicated_ts)
+            log.fanout.stamp(first_id, last_id, self.replicated_ts)
+            log.view.touch()
+
+    # wait until the write has reached the replicas, False on timeout
+    def wait(self, replicas, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.replicas >= replicas, timeout)
+
+    # the same without blocking the event loop
+    async def wait_async(self, replicas, timeout=None):
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        listener = lambda: loop.call_soon_threadsafe(changed.set)
+        with self.condition:
+            self.listeners.append(listener)
         try:
-            if self.path == '/health':
-                logging.info(f'[GET] {self.address_string()} requested secondaries health status')      
-                secondary_health_fmt = [
-                                            {
-                                                "secondary_name" : secondary_host.get("name"),
-                                                "health_check_status" : secondary_statuses[secondary_host["id"]]
-                                            } 
-                                        for secondary_host in secondary_hosts     
-                                        ]
-                secondary_health_str = tabulate(secondary_health_fmt, headers="keys", tablefmt="simple_grid")
-                response = "Secondaries health status:\n" + secondary_health_str
+            deadline = None if timeout is None else loop.time() + timeout
+            while self.replicas < replicas:
+                try:
+                    await asyncio.wait_for(changed.wait(), None if deadline is None else max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    return self.replicas >= replicas
+                changed.clear()
+            return True
+        finally:
+            with self.condition:
+                self.listeners.remove(listener)
+
+    def status(self):
+        return {
+            "token": self.token,
+            "w": self.w,
+            "replicas": self.replicas,
+            "secondaries": len(secondary_hosts),
+            "done": self.replicas >= self.w,
+            "logs": {log.name: [first_id, last_id] for log, first_id, last_id in self.ranges},
+            "replicated_ts": self.replicated_ts
+        }
+
+def register_token(token):
+    """
+    Keep the token for GET /writes/<token>, the tokens older than write_token_ttl_s are dropped
+    """
+    expired = time.monotonic() - server_conf.get("write_token_ttl_s", 300)
+    with write_tokens_lock:
+        while write_tokens and next(iter(write_tokens.values())).created < expired:
+            write_tokens.popitem(last=False)
+        write_tokens[token.token] = token
+
+
+"""
+Replication worker
+One long-lived worker per secondary and log drains its own queue, packs messages into batches
+(bounded by size and linger time) and keeps several batches in flight at once.
+Failed batches are not retried one by one: the catch-up asks the secondary for its highest
+contiguous id and streams the missing range from the log
+"""
+class ReplicationWorker():
+
+    # constructor
+    def __init__(self, secondary_host, log):
+        self.secondary_host = secondary_host
+        self.log = log
+        self.url = f'http://{secondary_host.get("hostname")}:{secondary_host.get("port")}/batch?log={log.name}'
+        self.health_url = f'http://{secondary_host.get("hostname")}:{secondary_host.get("port")}/health?log={log.name}'
+        self.snapshot_url = f'http://{secondary_host.get("hostname")}:{secondary_host.get("port")}/snapshot?log={log.name}'
+        # set when the secondary may have missed messages, the log may also be ahead of it after a restart
+        self.catchup_needed = threading.Event()
+        self.catchup_needed.set()
+        self.configure(get_config("Replication"))
+        # the number of senders is fixed once they are started
+        self.max_in_flight = get_config("Replication").get("max_in_flight", 4)
+        # JSON until the secondary has announced the formats it accepts
+        self.wire = ("json", "identity")
+        # messages waiting to be packed into a batch
+        self.queue = queue.Queue()
+        # packed batches waiting for a free sender
+        self.batches = queue.Queue(self.max_in_flight)
+        # latch, submit time and size of the messages which have not been acknowledged yet
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # messages and bytes in pending: queued, in flight or waiting for the catch-up, counted under pending_lock
+        self.backlog_messages = 0
+        self.backlog_bytes = 0
+        # [first_id, last_id, latch] of the messages left to the catch-up because the backlog was full,
+        # only the ids are kept, at most backlog_max_messages ranges
+        self.spilled = collections.deque()
+        # set while the messages are left to the catch-up because the backlog is full
+        self.overflowing = False
+        # set when the secondary has left the cluster
+        self.stopped = False
+        # highest contiguous id reported by the heartbeat
+        self.contiguous_id = None
+        # highest contiguous id reported by any answer of the secondary and the replication lag, published for the reads
+        self.watermark = 0
+        self.freshness = Freshness()
+        self.in_flight = 0
+        # metrics of this secondary and log
+        labels = (secondary_host.get("name"), log.name)
+        self.replication_latency = replication_latency_metric.labels(*labels)
+        self.replicated_messages = replicated_messages_metric.labels(*labels)
+        self.replication_retries = replication_retries_metric.labels(*labels)
+        self.replication_bytes = replication_bytes_metric.labels(*labels)
+        self.snapshot_installs = snapshot_installs_metric.labels(*labels)
+        self.backlog_overflows = backlog_overflows_metric.labels(*labels)
+        backlog_bytes_metric.labels(*labels).set_function(lambda: self.backlog_bytes)
+        queue_depth_metric.labels(*labels).set_function(self.queue.qsize)
+        in_flight_metric.labels(*labels).set_function(lambda: self.in_flight)
+        pending_metric.labels(*labels).set_function(lambda: len(self.pending))
+
+    # the settings which take effect on reload, the threads read them for every batch
+    def configure(self, replication_conf):
+        self.batch_max_messages = replication_conf.get("batch_max_messages", 512)
+        self.batch_max_bytes = replication_conf.get("batch_max_bytes", 1048576)
+        self.linger = replication_conf.get("linger_ms", 5) / 1000
+        self.catchup_chunk_messages = replication_conf.get("catchup_chunk_messages", 10000)
+        self.catchup_chunk_bytes = replication_conf.get("catchup_chunk_bytes", 8388608)
+        self.catchup_retry = replication_conf.get("catchup_retry_ms", 1000) / 1000
+        self.compression_min_bytes = replication_conf.get("compression_min_bytes", 4096)
+        self.backlog_max_messages = replication_conf.get("backlog_max_messages", 100000)
+        self.backlog_max_bytes = replication_conf.get("backlog_max_bytes", 67108864)
+        self.backlog_policy = replication_conf.get("backlog_policy", "spill")
+        wire_preference = (replication_conf.get("wire_format", "binary"), replication_conf.get("compression", "zstd"))
+        if wire_preference != getattr(self, 'wire_preference', wire_preference):
+            # the format is negotiated again by the health check of the catch-up
+            self.catchup_needed.set()
+        self.wire_preference = wire_preference
+        self.wire_format, self.compression = wire_preference
+
+    # start the batching thread and the senders
+    def start(self):
+        name = f'{self.secondary_host.get("name")}, {self.log.name}'
+        threading.Thread(target=self.batch_loop, name=f"Batching for {name}", daemon=True).start()
+        for i in range(self.max_in_flight):
+            threading.Thread(target=self.send_loop, name=f"Replicating on {name} #{i}", daemon=True).start()
+        threading.Thread(target=self.catchup_loop, name=f"Catch-up for {name}", daemon=True).start()
+
+    # the secondary has left the cluster: the threads exit and its metrics are dropped,
+    # the writes waiting for it are answered at their deadline
+    def stop(self):
+        self.stopped = True
+        self.drop_queue()
+        self.queue.put(None)
+        self.catchup_needed.set()
+        labels = (self.secondary_host.get("name"), self.log.name)
+        for metric in (replication_latency_metric, replicated_messages_metric, replication_retries_metric, replication_bytes_metric, snapshot_installs_metric,
+                       backlog_overflows_metric, backlog_bytes_metric, queue_depth_metric, in_flight_metric, pending_metric):
+            metric.remove(*labels)
+
+    # the backlog is below both limits
+    def has_room(self):
+        return self.backlog_messages < self.backlog_max_messages and self.backlog_bytes < self.backlog_max_bytes
+
+    # queue the message for replication, when the backlog is full the message is only kept in the log
+    def submit(self, msg_dict, latch):
+        if self.stopped:
+            return
+        with self.pending_lock:
+            # once full, the backlog takes messages again when it has drained to half of the limits
+            queued = self.has_room() if not self.overflowing else self.backlog_messages < self.backlog_max_messages / 2 and self.backlog_bytes < self.backlog_max_bytes / 2
+            if queued:
+                self.pending[msg_dict["id"]] = (latch, time.perf_counter(), len(msg_dict["msg"]))
+                self.backlog_messages += 1
+                self.backlog_bytes += len(msg_dict["msg"])
+                overflowed, self.overflowing = self.overflowing, False
             else:
-                logging.info(f'[GET] {self.address_string()} requested list of messages')    
-
-                if log_list:
-                    log_list_fmt = [ 
-                                        {
-                                            "id" : msg.get("id"),
-                                            "msg" : msg.get("msg"),
-                                            "w" : msg.get("w"),
-                                            "replicated_ts" : datetime.utcfromtimestamp(msg.get("replicated_ts")).strftime("%Y-%m-%d %H:%M:%S.%f") if msg.get("replicated_ts") != None else "NOT REPLICATED"
-                                        } 
-                                    for msg in log_list
-                                    ]
-                    log_list_str = tabulate(log_list_fmt, headers="keys", tablefmt="simple_grid")
-                    response = 'The replication log:\n' + log_list_str
-                else:
-                    response = 'The replication log is empty'
-    
-            logging.info('[GET] ' + response)
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Server', 'Master')
-            self.end_headers()
-            response = response + '\n'
-            self.wfile.write(response.encode('utf-8'))
-        except Exception as e:
-            logging.error('[GET] ' + response, stack_info=debug)
-            response = f"Exception: {e}"
-            self.send_response(500)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Server', 'Master')
-            self.end_headers()
-            response = response + '\n'
-            self.wfile.write(response.encode('utf-8'))
-
-    def replicate_msg(self, latch, secondary_host, msg_dict):
-        url = f'http://{secondary_host.get("hostname")}:{secondary_host.get("port")}'
-        thread_name =  threading.current_thread().name
-        logging.info(f"[POST] START {thread_name}")
-        sleep_delay = 0
+                self.spill(msg_dict["id"], latch)
+                overflowed, self.overflowing = self.overflowing, True
+        if queued:
+            if overflowed:
+                logging.info(f'[Replication] The backlog of {self.log.name} for {self.secondary_host.get("name")} has room again')
+            self.queue.put(msg_dict)
+            return
+        if not overflowed:
+            self.overflow()
+        self.catchup_needed.set()
+
+    # the messages over the limits are sent from the log by the catch-up, with the resync policy the queued ones too
+    def overflow(self):
+        self.backlog_overflows.inc()
+        dropped = self.drop_queue() if self.backlog_policy == "resync" else 0
+        logging.warning(f'[Replication] The backlog of {self.log.name} for {self.secondary_host.get("name")} is full ({self.backlog_messages} messages, {self.backlog_bytes} bytes), {dropped} queued messages dropped. The messages are left to the catch-up')
+
+    # the queued messages leave the backlog, their writes wait for the catch-up
+    def drop_queue(self):
+        dropped = []
         while True:
-            time.sleep(sleep_delay)
             try:
-                secondary_locks[secondary_host["id"]].wait()
-                # https://requests.readthedocs.io/en/latest/user/advanced/#timeouts
-                response = requests.post(url, json=msg_dict, timeout=(3.5,None)) # (connect timeout, read timeout)
-                if response.status_code == 200:
-                    latch.count_down()
-                    logging.info(f"[POST] {thread_name}. The message has been succesfully replicated")
+                msg_dict = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if msg_dict is None:
+                # stopped
+                self.queue.put(None)
+                break
+            dropped.append(msg_dict)
+        with self.pending_lock:
+            for msg_dict in dropped:
+                item = self.pending.pop(msg_dict["id"], None)
+                if item is not None:
+                    latch, submitted, size = item
+                    self.backlog_messages -= 1
+                    self.backlog_bytes -= size
+                    self.spill(msg_dict["id"], latch)
+        return len(dropped)
+
+    # remember the id of a message left to the catch-up, called under pending_lock
+    # the messages of one write with consecutive ids share a range
+    def spill(self, msg_id, latch):
+        if self.spilled and self.spilled[-1][2] is latch and self.spilled[-1][1] + 1 == msg_id:
+            self.spilled[-1][1] = msg_id
+            return
+        if len(self.spilled) >= self.backlog_max_messages:
+            # the oldest write is no longer followed on this secondary, it is answered at its deadline
+            self.spilled.popleft()
+        self.spilled.append([msg_id, msg_id, latch])
+
+    # the secondary has every message up to last_id
+    def ack_through(self, last_id):
+        with self.pending_lock:
+            msg_ids = [msg_id for msg_id in self.pending if msg_id <= last_id]
+            resolved = [item for item in self.spilled if item[1] <= last_id]
+            if resolved:
+                self.spilled = collections.deque(item for item in self.spilled if item[1] > last_id)
+        if msg_ids:
+            self.ack(msg_ids)
+        for first_id, range_last_id, latch in resolved:
+            for i in range(range_last_id - first_id + 1):
+                latch.count_down()
+
+    # collect messages until the batch is full or the linger time is over
+    def batch_loop(self):
+        while True:
+            batch = [self.queue.get()]
+            if batch[0] is None:
+                # stopped, the senders exit too
+                for i in range(self.max_in_flight):
+                    self.batches.put(None)
+                return
+            batch_bytes = len(batch[0]["msg"])
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.batch_max_messages and batch_bytes < self.batch_max_bytes:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    msg_dict = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if msg_dict is None:
+                    self.queue.put(None)
                     break
+                batch.append(msg_dict)
+                batch_bytes += len(msg_dict["msg"])
+            self.batches.put(batch)
+
+    # count down the latches of the acknowledged messages
+    def ack(self, msg_ids):
+        with self.pending_lock:
+            pending = [item for item in (self.pending.pop(msg_id, None) for msg_id in msg_ids) if item is not None]
+            self.backlog_messages -= len(pending)
+            self.backlog_bytes -= sum(size for latch, submitted, size in pending)
+        now = time.perf_counter()
+        for latch, submitted, size in pending:
+            latch.count_down()
+            self.replication_latency.observe(now - submitted)
+        self.replicated_messages.inc(len(msg_ids))
+
+    # send batches, the messages which have not been acknowledged are resent from the log by the catch-up
+    def send_loop(self):
+        thread_name = threading.current_thread().name
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            try:
+                secondary_locks[self.secondary_host["id"]].wait()
+                if self.stopped:
+                    continue
+                self.in_flight += 1
+                try:
+                    # https://requests.readthedocs.io/en/latest/user/advanced/#timeouts
+                    response = self.post(secondary_sessions[self.secondary_host["id"]], batch, timeout=(connection_conf.get("connect_timeout"), connection_conf.get("read_timeout"))) # (connect timeout, read timeout)
+                finally:
+                    self.in_flight -= 1
+                if response.status_code == 200:
+                    acks = decode_acks(response.headers.get("Content-Type"), response.content)
+                    self.ack(acks)
+                    logging.debug(f"[POST] {thread_name}. {len(acks)} messages have been succesfully replicated")
+                    if len(acks) == len(batch):
+                        continue
+                logging.info(f'[POST] {thread_name}. {self.secondary_host.get("name")} has not acknowledged the batch. Scheduling the catch-up')
             except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-                logging.info(f'[POST] {thread_name}. {secondary_host.get("name")} not available. Retrying in {sleep_delay}s ...')
+                logging.info(f'[POST] {thread_name}. {self.secondary_host.get("name")} not available. Scheduling the catch-up')
             except Exception as e:
                 logging.error(f"[POST] {thread_name}. An exception of type {type(e).__name__} occurred. Arguments: {e.args}")
-            finally:
-                # "smart" delays logic
-                if sleep_delay < 60:
-                    sleep_delay += randint(1, 10)
-                else:
-                    sleep_delay = randint(1, 10)
-        logging.info(f"[POST] END {thread_name}")
+            self.replication_retries.inc()
+            self.catchup_needed.set()
 
-    def do_POST(self):
-        logging.info(f'[POST] {self.address_string()} sent a request to append message')
-        try:
-            content_length = int(self.headers['Content-Length'])
-            body = self.rfile.read(content_length).decode("utf-8")
-            body_dict = json.loads(body)
-            msg = body_dict.get("msg")
-            w = body_dict.get("w") or 3
+    # send the messages in the negotiated wire format
+    def post(self, session, messages, timeout):
+        data, headers = encode_batch(messages, *self.wire, min_bytes=self.compression_min_bytes)
+        self.replication_bytes.inc(len(data))
+        headers[MASTER_LAST_ID_HEADER] = self.report_last_id()
+        response = session.post(self.url, data=data, headers=headers, timeout=timeout)
+        failure_detector.heartbeat(self.secondary_host["id"])
+        if CONTIGUOUS_ID_HEADER in response.headers:
+            self.update_watermark(int(response.headers[CONTIGUOUS_ID_HEADER]))
+        return response
+
+    # the last id of the log sent to the secondary, its next watermark tells how fresh it is
+    def report_last_id(self):
+        last_id = self.log.store.durable_last_id()
+        self.freshness.report(last_id)
+        return str(last_id)
+
+    # answers of concurrent requests arrive in any order, the watermark only goes back on a heartbeat
+    def update_watermark(self, watermark):
+        self.watermark = max(self.watermark, watermark)
+
+    # replication lag in ms, None when unknown
+    def lag_ms(self):
+        if self.watermark >= self.log.store.last_id():
+            return 0
+        return self.freshness.lag_ms(self.watermark)
 
-            #Validate input
+    # pick the wire format from the ones announced in the health check response
+    def negotiate(self, headers):
+        wire = negotiate(headers, self.wire_format, self.compression)
+        if wire != self.wire:
+            logging.info(f'[Replication] Sending {self.log.name} to {self.secondary_host.get("name")} as {wire[0]}, content encoding {wire[1]}')
+            self.wire = wire
+
+    # the heartbeat reports the highest contiguous id of the secondary,
+    # a secondary which has just recovered or whose id went back (restart) may have missed messages
+    def update_contiguous_id(self, contiguous_id, recovered):
+        if recovered or (self.contiguous_id is not None and contiguous_id < self.contiguous_id):
+            self.catchup_needed.set()
+            self.watermark = contiguous_id
+        self.contiguous_id = contiguous_id
+        self.update_watermark(contiguous_id)
+
+    # bring the secondary up to date whenever it may have missed messages
+    def catchup_loop(self):
+        while True:
+            self.catchup_needed.wait()
+            self.catchup_needed.clear()
+            secondary_locks[self.secondary_host["id"]].wait()
+            if self.stopped:
+                return
             try:
-                post_request_schema = {
-                    "type": "object",
-                    "properties": {
-                        "msg": {"type": "string"},
-                        "w": {"type": "integer"}, 
-                    },
-                    "required": ["msg"]
-                }
-                validate(instance=body_dict, schema=post_request_schema)
+                catchup_runs_metric.inc()
+                self.catchup()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.replication_retries.inc()
+                logging.info(f'[Catch-up] {self.secondary_host.get("name")} not available. Retrying in {self.catchup_retry}s ...')
+                self.catchup_needed.set()
+                time.sleep(self.catchup_retry)
             except Exception as e:
-                response = f"Invalid POST request. Server accepts HTTP POST requests containing JSON of the following schema: {{\"msg\": \"message\"}}. Exception: {e}"               
-                self.send_response(400)
-                self.send_header('Content-Type', 'text/plain; charset=utf-8')
-                self.send_header('Server', 'Master')
-                self.end_headers()
-                response = response + '\n'
-                self.wfile.write(response.encode('utf-8'))
-                logging.error(f"[POST] Invalid POST request. Received message {body} has incorrect form. Exception: {e}", stack_info=debug)
-            
-            # Quorum check
-            if not get_quorum():
-                response = f"There is no Secondaries quorum. The Master has been switched into read-only mode and does not accept messages append requests"
-                logging.info('[POST] ' + response)
-                self.send_response(200)
-                self.send_header('Content-Type', 'text/plain; charset=utf-8')
-                self.send_header('Server', 'Master')
-                self.end_headers()
-                response = response + '\n'
-                self.wfile.write(response.encode('utf-8'))
+                logging.error(f"[Catch-up] An exception of type {type(e).__name__} occurred. Arguments: {e.args}")
+                self.replication_retries.inc()
+                self.catchup_needed.set()
+                time.sleep(self.catchup_retry)
+
+    # stream the range the secondary is missing in large chunks
+    def catchup(self):
+        session = secondary_sessions[self.secondary_host["id"]]
+        timeout = (connection_conf.get("connect_timeout"), connection_conf.get("read_timeout"))
+        response = session.get(self.health_url, timeout=timeout)
+        response.raise_for_status()
+        self.negotiate(response.headers)
+        from_id = int(response.headers.get(CONTIGUOUS_ID_HEADER, 0)) + 1
+        self.ack_through(from_id - 1)
+        if from_id < self.log.store.first_id():
+            from_id = self.bootstrap(session, timeout)
+        # the messages which are not on disk yet are sent by the workers once they are
+        target_id = self.log.store.durable_last_id()
+        if from_id > target_id:
+            return
+        logging.info(f'[Catch-up] {self.secondary_host.get("name")} has messages of {self.log.name} up to id {from_id - 1}, sending messages up to id {target_id}')
+        while from_id <= target_id:
+            chunk = []
+            chunk_bytes = 0
+            for msg_dict in self.log.store.read(from_id, min(self.catchup_chunk_messages, target_id - from_id + 1)):
+                chunk.append(msg_dict)
+                chunk_bytes += len(msg_dict["msg"])
+                if chunk_bytes >= self.catchup_chunk_bytes:
+                    break
+            if not chunk or chunk[0]["id"] != from_id:
+                # the retention has moved the start of the log past from_id in the meantime, the read starts at the new
+                # start or finds nothing: sending it would leave a gap, the next run installs a newer snapshot
+                logging.info(f'[Catch-up] Messages of {self.log.name} from id {from_id} have been removed by the retention, starting again')
+                self.catchup_needed.set()
                 return
-            
-            # acquire the lock
-            self.lock.acquire()
-            #log_list_last_index = max(log_list, key=lambda msg:msg['id']).get('id') if log_list else 0
-            msg_id = len(log_list) + 1
-            msg_dict = {"id": msg_id, "msg": msg, "replicated_ts" : None, "w": w}
-            # add new message to log
-            log_list.append(msg_dict)
-            logging.info(f"[POST] Received message \"" + msg_dict["msg"] + "\" has been added to log with id: " + str(msg_dict["id"]))
-            # release the lock
-            self.lock.release()
-            
-            logging.info(f'[POST] Replicating the message')
-            
-            # create the countdown latch
-            latch = CountDownLatch(w-1)
-            
+            response = self.post(session, chunk, timeout=timeout)
+            response.raise_for_status()
+            self.ack(decode_acks(response.headers.get("Content-Type"), response.content))
+            # the chunks follow the contiguous prefix of the secondary
+            self.ack_through(chunk[-1]["id"])
+            from_id = chunk[-1]["id"] + 1
+        logging.info(f'[Catch-up] {self.secondary_host.get("name")} has caught up to id {target_id} of {self.log.name}')
+
+    # the secondary is behind the start of the log, it gets the snapshot and then the log tail
+    # returns the first id after the snapshot
+    def bootstrap(self, session, timeout):
+        snapshot = self.log.compactor.latest_snapshot()
+        logging.info(f'[Catch-up] {self.secondary_host.get("name")} is behind the start of {self.log.name}, sending the snapshot of messages {snapshot.first_id}-{snapshot.last_id} ({snapshot.size} bytes)')
+        headers = {
+            'Content-Type': BINARY_CONTENT_TYPE,
+            'Content-Encoding': 'deflate',
+            'X-Snapshot-First-Id': str(snapshot.first_id),
+            'X-Snapshot-Last-Id': str(snapshot.last_id),
+            MASTER_LAST_ID_HEADER: self.report_last_id()
+        }
+        with open(snapshot.path, 'rb') as snapshot_file:
+            response = session.post(self.snapshot_url, data=snapshot_file, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        self.update_watermark(int(response.headers.get(CONTIGUOUS_ID_HEADER, 0)))
+        self.replication_bytes.inc(snapshot.size)
+        self.snapshot_installs.inc()
+        self.ack_through(snapshot.last_id)
+        return snapshot.last_id + 1
+
+
+"""
+Logs
+Every topic is split into partitions, each partition is an independent log with its own sequence of ids,
+storage, retention and replication workers. Messages are ordered within a partition, appends to different
+partitions do not wait for each other. A message goes to the partition given by the client, to the one
+its key hashes to, or to partition 0
+"""
+class PartitionLog():
+
+    # constructor
+    def __init__(self, topic, partition):
+        self.topic = topic
+        self.partition = partition
+        self.name = f'{topic}-{partition}'
+        storage_conf = get_config("Storage")
+        retention_conf = get_config("Retention")
+        self.store = open_store(dict(storage_conf, path=os.path.join(storage_conf.get("path", "data"), topic, str(partition))), script_path)
+        self.compactor = Compactor(
+                                    self.store,
+                                    os.path.join(script_path, retention_conf.get("snapshot_path", "data/snapshots"), topic, str(partition)),
+                                    max_messages=retention_conf.get("max_messages"),
+                                    max_age_s=retention_conf.get("max_age_s"),
+                                    max_bytes=retention_conf.get("max_bytes"),
+                                    interval_s=retention_conf.get("interval_s", 60)
+                                )
+        self.workers = {secondary_host["id"]:ReplicationWorker(secondary_host, self) for secondary_host in secondary_hosts}
+        # new messages for the subscribers
+        self.fanout = FanOut(self.store.last_id(), read_conf.get("subscribe_buffer_messages", 10000))
+        subscribers_metric.labels(self.name).set_function(lambda: self.fanout.subscribers)
+        # rendered table pages for GET /
+        self.view = LogView(read_conf.get("view_cache_pages", 8))
+        first_id_metric.labels(self.name).set_function(self.store.first_id)
+        last_id_metric.labels(self.name).set_function(self.store.last_id)
+        bytes_metric.labels(self.name).set_function(self.store.bytes_stored)
+
+    def start(self):
+        self.compactor.start()
+        for worker in self.workers.values():
+            worker.start()
+
+    # a secondary has joined the cluster, it gets the whole log from the catch-up
+    def add_worker(self, secondary_host):
+        worker = ReplicationWorker(secondary_host, self)
+        self.workers[secondary_host["id"]] = worker
+        worker.start()
+
+def open_logs():
+    """
+    Open the partitions of the topics in the Topics section of config.json
+    """
+    for topic, topic_conf in get_config("Topics").items():
+        topics[topic] = [PartitionLog(topic, partition) for partition in range(topic_conf.get("partitions", 1))]
+        for log in topics[topic]:
+            logs[log.name] = log
+
+class UnknownLogError(Exception):
+    pass
+
+def get_log(topic, partition=None, key=None):
+    """
+    Partition for the message or the read, raises UnknownLogError for an unknown topic or partition
+    """
+    if topic not in topics:
+        raise UnknownLogError(f'Unknown topic: {topic}')
+    partitions = topics[topic]
+    if partition is None:
+        # crc32 is stable across processes, unlike hash()
+        partition = zlib.crc32(key.encode('utf-8')) % len(partitions) if key is not None else 0
+    if not 0 <= int(partition) < len(partitions):
+        raise UnknownLogError(f'Topic {topic} has no partition {partition}')
+    return partitions[int(partition)]
+
+
+"""
+Failure detector
+One event loop on one thread probes every secondary with GET /health over its own keep-alive connection,
+so a slow secondary delays only its own probes and dozens of secondaries need no extra threads.
+The answers to the probes and to the replication requests are the heartbeats of a phi accrual detector,
+the status of a secondary follows its phi: Suspected at phi_suspect, Unhealthy at phi_unhealthy
+"""
+class FailureDetector():
+
+    # constructor
+    def __init__(self):
+        self.detectors = {}
+        self.configure(get_config("Heartbeat"), connection_conf)
+        self.startup_grace = self.heartbeat_conf.get("startup_grace_ms", 3000) / 1000
+        self.connections = {}
+        for secondary_host in secondary_hosts:
+            self.add_detector(secondary_host)
+        # probe task of every secondary, created on the event loop
+        self.probes = {}
+        self.loop = None
+        self.started = threading.Event()
+        self.quorum = None
+
+    # the settings which take effect on reload, the detectors keep their window of heartbeats
+    def configure(self, heartbeat_conf, connection_conf):
+        self.heartbeat_conf = heartbeat_conf
+        self.interval = heartbeat_conf.get("interval_ms", 200) / 1000
+        self.check_interval = heartbeat_conf.get("check_interval_ms", 50) / 1000
+        self.phi_suspect = heartbeat_conf.get("phi_suspect", 3)
+        self.phi_unhealthy = heartbeat_conf.get("phi_unhealthy", 8)
+        self.timeout = connection_conf.get("heartbeat_read_timeout")
+        for detector in list(self.detectors.values()):
+            detector.configure(
+                                min_std=heartbeat_conf.get("min_std_ms", 100) / 1000,
+                                acceptable_pause=heartbeat_conf.get("acceptable_pause_ms", 0) / 1000,
+                                max_phi=self.phi_suspect
+                            )
+
+    def add_detector(self, secondary_host):
+        self.detectors[secondary_host["id"]] = PhiAccrualDetector(
+                                                                    self.interval,
+                                                                    window_size=self.heartbeat_conf.get("window_size", 100),
+                                                                    min_std=self.heartbeat_conf.get("min_std_ms", 100) / 1000,
+                                                                    acceptable_pause=self.heartbeat_conf.get("acceptable_pause_ms", 0) / 1000,
+                                                                    # the silence of a Suspected secondary is not a usual interval
+                                                                    max_phi=self.phi_suspect
+                                                                )
+        self.connections[secondary_host["id"]] = AsyncHTTPConnection(secondary_host.get("hostname"), secondary_host.get("port"))
+        phi_metric.labels(secondary_host.get("name")).set_function(self.detectors[secondary_host["id"]].phi)
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self.run()), name="Failure detector", daemon=True).start()
+        self.started.wait()
+
+    # a secondary has joined the cluster, it is probed from now on
+    # the detector is set up before the secondary is listed in secondary_hosts
+    def add(self, secondary_host):
+        self.add_detector(secondary_host)
+        self.loop.call_soon_threadsafe(self.start_probe, secondary_host)
+
+    # a secondary has left the cluster, returns once its probes have stopped
+    # and the replication threads waiting for it to be healthy have been released
+    def remove(self, secondary_host):
+        asyncio.run_coroutine_threadsafe(self.stop_probe(secondary_host), self.loop).result()
+        phi_metric.remove(secondary_host.get("name"))
+        heartbeat_rtt_metric.remove(secondary_host.get("name"))
+
+    def start_probe(self, secondary_host):
+        self.probes[secondary_host["id"]] = asyncio.get_running_loop().create_task(self.probe_loop(secondary_host))
+
+    # runs on the event loop, so no status change of the secondary can come after it
+    async def stop_probe(self, secondary_host):
+        probe = self.probes.pop(secondary_host["id"], None)
+        if probe is not None:
+            probe.cancel()
+        secondary_locks[secondary_host["id"]].count_down()
+
+    # any answer of the secondary is a sign of life
+    def heartbeat(self, secondary_id):
+        self.detectors[secondary_id].heartbeat()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        for secondary_host in secondary_hosts:
+            self.start_probe(secondary_host)
+        self.started.set()
+        await self.check_loop()
+
+    async def probe_loop(self, secondary_host):
+        connection = self.connections[secondary_host["id"]]
+        try:
+            while True:
+                started = time.monotonic()
+                await self.probe(secondary_host, connection)
+                await asyncio.sleep(max(0, self.interval - (time.monotonic() - started)))
+        finally:
+            connection.close()
+
+    async def probe(self, secondary_host, connection):
+        headers = {MASTER_LAST_IDS_HEADER: json.dumps({name: int(log.workers[secondary_host["id"]].report_last_id()) for name, log in logs.items()})}
+        started = time.perf_counter()
+        try:
+            status, response_headers, body = await connection.request('GET', '/health', headers, timeout=self.timeout)
+        except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return
+        except Exception as e:
+            logging.error(f'[Heartbeat check] Exception: {e}')
+            return
+        heartbeat_rtt_metric.labels(secondary_host.get("name")).observe(time.perf_counter() - started)
+        if status != 200:
+            return
+        self.heartbeat(secondary_host["id"])
+        recovered = secondary_statuses[secondary_host["id"]] != "Healthy"
+        if recovered:
+            self.set_status(secondary_host, "Healthy")
+        contiguous_ids = json.loads(response_headers.get(CONTIGUOUS_IDS_HEADER, '{}'))
+        for name, log in logs.items():
+            worker = log.workers[secondary_host["id"]]
+            worker.negotiate(response_headers)
+            worker.update_contiguous_id(contiguous_ids.get(name, 0), recovered)
+
+    # the secondaries which have not been heard of for too long are suspected, a successful probe brings them back
+    async def check_loop(self):
+        await asyncio.sleep(self.startup_grace)
+        while True:
+            now = time.monotonic()
             for secondary_host in secondary_hosts:
-                t = threading.Thread(
-                                        target=self.replicate_msg, 
-                                        name="Replicating msg_id = " + str(msg_dict["id"]) + " on " + secondary_host.get("name"),
-                                        args=(latch, secondary_host, msg_dict)
-                                    )
-                t.start()
-            
-            # wait for the latch to close
-            latch.wait()
-            
-            #set ts
-            log_list[msg_id-1]["replicated_ts"] = time.time()
-            
+                phi = self.detectors[secondary_host["id"]].phi(now)
+                status = secondary_statuses[secondary_host["id"]]
+                if phi >= self.phi_unhealthy and status != "Unhealthy":
+                    self.set_status(secondary_host, "Unhealthy")
+                elif phi >= self.phi_suspect and status in (None, "Healthy"):
+                    self.set_status(secondary_host, "Suspected")
+
+            quorum_prev = self.quorum
+            self.quorum = get_quorum()
+            if not self.quorum and not self.quorum == quorum_prev:
+                logging.info(f'[Heartbeat check] Master has been switched into read-only mode. Waiting for Secondaries quorum')
+            if self.quorum and not self.quorum == quorum_prev and not quorum_prev is None:
+                logging.info(f'[Heartbeat check] The Secondaries quorum has been restored. Master is ready to accept messages append requests')
+            await asyncio.sleep(self.check_interval)
+
+    def set_status(self, secondary_host, status):
+        status_prev = secondary_statuses[secondary_host["id"]]
+        secondary_statuses[secondary_host["id"]] = status
+        if status == "Healthy":
+            # resume the replication
+            secondary_locks[secondary_host["id"]].count_down()
+        elif status_prev == "Healthy":
+            # hold the replication until the secondary is back
+            secondary_locks[secondary_host["id"]] = CountDownLatch(1)
+        if not (status == "Healthy" and status_prev is None):
+            logging.info(f'[Heartbeat check] {secondary_host.get("name")} is in {status} status')
+
+
+"""
+HTTP-server
+"""
+# Processing Simultaneous/Asynchronous Requests with Python BaseHTTPServer
+# https://stackoverflow.com/a/12651298
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class MasterRequestHandler():
+    """
+    Routes of the Master shared by the threaded and the asyncio servers
+    """
+    # reads routed with "proxy" are passed through the Master, otherwise redirected
+    proxy_supported = True
+
+    def do_GET(self):
+        try:
+            route, params = parse_path(self.path)
+            if route == '/metrics':
+                self.send_body(200, REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+                return
+            if route == '/watermarks':
+                self.send_body(200, json.dumps(get_watermarks()), content_type='application/json')
+                return
+            if route == '/health':
+                request_log.info(f'[GET] {self.address_string()} requested secondaries health status')      
+                # rendered again only when a status or the membership changes
+                # the list is replaced as a whole by apply_config(), the table is rendered from the one the version is built from
+                members = secondary_hosts
+                statuses = tuple(secondary_statuses.get(secondary_host["id"]) for secondary_host in members)
+                version = (tuple((secondary_host["id"], secondary_host.get("name")) for secondary_host in members), statuses)
+                def render():
+                    secondary_health_fmt = [
+                                                {
+                                                    "secondary_name" : secondary_host.get("name"),
+                                                    "health_check_status" : status
+                                                } 
+                                            for secondary_host, status in zip(members, statuses)
+                                            ]
+                    secondary_health_str = tabulate(secondary_health_fmt, headers="keys", tablefmt="simple_grid")
+                    return "Secondaries health status:\n" + secondary_health_str + '\n'
+                self.send_view(*health_view.get(version, render))
+            else:
+                try:
+                    log = get_log(params.get("topic", "default"), params.get("partition"), params.get("key"))
+                except (UnknownLogError, ValueError) as e:
+                    self.send_text(404, f"{e}")
+                    return
+                first_id = log.store.first_id()
+                try:
+                    from_id, limit, fmt = parse_range(params, read_conf, default_format='json' if route == '/log' else 'table', first_id=first_id)
+                except ValueError as e:
+                    self.send_text(400, f"Invalid GET request. Exception: {e}")
+                    return
+
+                if from_id < first_id:
+                    request_log.info(f'[GET] {self.address_string()} requested compacted messages from id {from_id}')
+                    self.send_compacted(from_id, first_id)
+                    return
+
+                # move the read to a secondary which satisfies its staleness bound, the Master serves it when none does
+                try:
+                    min_id, max_lag_ms = parse_bounds(params)
+                    routing = params.get("routing", read_conf.get("routing", "local"))
+                    if routing not in ('local', 'redirect', 'proxy'):
+                        raise ValueError("routing must be one of local, redirect, proxy")
+                except ValueError as e:
+                    self.send_text(400, f"Invalid GET request. Exception: {e}")
+                    return
+                secondary_host = pick_secondary(log, min_id, max_lag_ms) if routing != 'local' else None
+                if secondary_host is not None:
+                    url = secondary_host.get("public_url", f'http://{secondary_host.get("hostname")}:{secondary_host.get("port")}') + self.path
+                    if "log" not in params:
+                        url += ('&' if '?' in url else '?') + f'log={log.name}'
+                    if routing == 'proxy' and self.proxy_supported:
+                        request_log.info(f'[GET] Proxying the read of {self.address_string()} to {secondary_host.get("name")}')
+                        self.proxy_read(secondary_host, url)
+                    else:
+                        request_log.info(f'[GET] Redirecting the read of {self.address_string()} to {secondary_host.get("name")}')
+                        self.send_text(307, f"Read from {url}", headers={'Location': url})
+                    return
+
+                if fmt != 'table':
+                    request_log.info(f'[GET] {self.address_string()} requested {limit} messages from id {from_id} as {fmt}')
+                    self.send_entries(log.store.read(from_id, limit), fmt, from_id)
+                    return
+
+                request_log.info(f'[GET] {self.address_string()} requested list of messages')    
+
+                # the human readable view is capped, larger ranges are paged with from_id
+                # the page is rendered again only for new or newly replicated messages
+                limit = min(limit, read_conf.get("table_max_rows"))
+                self.send_view(*log.view.get(from_id, limit, first_id, log.store.last_id(), log.store.read, lambda msg_dict: msg_dict.get("replicated_ts") is not None))
+        except Exception as e:
+            request_log.error(f'[GET] Exception: {e}', stack_info=debug)
+            self.send_text(500, f"Exception: {e}")
+
+    # stream the answer of the secondary to the client
+    def proxy_read(self, secondary_host, url):
+        response = secondary_sessions[secondary_host["id"]].get(url, stream=True, timeout=(connection_conf.get("connect_timeout"), connection_conf.get("read_timeout")))
+        headers = {key: response.headers[key] for key in (CONTIGUOUS_ID_HEADER, 'X-Lag-Ms', 'X-First-Id', 'Retry-After') if key in response.headers}
+        headers['X-Served-By'] = secondary_host.get("name")
+        with response:
+            self.send_chunked(response.status_code, response.iter_content(CHUNK_SIZE), response.headers.get('Content-Type', 'text/plain; charset=utf-8'), headers=headers)
+
+    # parse, validate and append the message or the batch of messages, returns None when the response has already been sent
+    # otherwise the (log, messages, position) of every partition the messages have been appended to
+    def append_msgs(self):
+        if not self.prepare_msgs():
+            return None
+        return self.store_msgs()
+
+    # parse and validate the request, returns False when the response has already been sent
+    def prepare_msgs(self):
+        self.started = time.perf_counter()
+        self.msg_id = None
+        self.msg = None
+        route, params = parse_path(self.path)
+        self.is_batch = route == '/batch'
+        body = self.read_body().decode("utf-8")
+
+        #Validate input
+        try:
+            if self.is_batch:
+                request_log.debug(f'[POST] {self.address_string()} sent a request to append a batch of messages')
+                items, w, topic = self.parse_batch(body, params)
+            else:
+                request_log.debug(f'[POST] {self.address_string()} sent a request to append message')
+                body_dict = json.loads(body)
+                post_request_validator.validate(body_dict)
+                self.msg = body_dict.get("msg")
+                items, w, topic = [body_dict], body_dict.get("w") or 3, body_dict.get("topic")
+            topic = topic or params.get("topic", "default")
+            # the write is answered without waiting for the write concern or once its deadline has passed
+            options = body_dict if not self.is_batch else self.batch_options
+            self.write_async = str(options.get("async", params.get("async", "false"))).lower() in ("true", "1")
+            timeout_ms = options.get("timeout_ms", params.get("timeout_ms", server_conf.get("write_timeout_ms")))
+            self.deadline = None if timeout_ms is None else int(timeout_ms) / 1000
+            # the partition of every message, in the order of the request
+            self.entries = [
+                                (
+                                    get_log(topic, item.get("partition", params.get("partition")), item.get("key", params.get("key"))),
+                                    {"msg": item["msg"], "replicated_ts" : None, "w": w}
+                                )
+                            for item in items
+                            ]
+        except UnknownLogError as e:
+            self.send_text(404, f"{e}")
+            return False
+        except Exception as e:
+            if self.is_batch:
+                response = f"Invalid POST request. /batch accepts a JSON array of {{\"msg\": \"message\"}} objects, {{\"messages\": [...], \"w\": n}} or NDJSON with the w query parameter. Exception: {e}"
+            else:
+                response = f"Invalid POST request. Server accepts HTTP POST requests containing JSON of the following schema: {{\"msg\": \"message\"}}. Exception: {e}"
+            self.send_text(400, response)
+            request_log.error(f"[POST] Invalid POST request. Received message {payload(body)} has incorrect form. Exception: {e}", stack_info=debug)
+            return False
+
+        # Quorum check
+        if not get_quorum():
+            response = f"There is no Secondaries quorum. The Master has been switched into read-only mode and does not accept messages append requests"
+            request_log.info('[POST] ' + response)
+            self.send_text(200, response)
+            return False
+
+        # Backpressure, a write concern the Secondaries cannot meet without growing their backlogs is refused
+        w = self.entries[0][1]["w"]
+        if replication_conf.get("backlog_policy", "spill") == "reject" and w > 1:
+            ready = ready_secondaries({log for log, msg_dict in self.entries})
+            if ready < w - 1:
+                rejected_appends_metric.inc()
+                response = f"The replication backlog is full, {ready} Secondaries can accept messages, w = {w} cannot be met. Retry later or use a lower write concern"
+                request_log.info('[POST] ' + response)
+                self.send_text(429, response, headers={'Retry-After': str(replication_conf.get("backlog_retry_after_s", 1))})
+                return False
+        return True
+
+    # append the validated messages, the stores may block on the disk
+    def store_msgs(self):
+        groups = {}
+        for log, msg_dict in self.entries:
+            groups.setdefault(log, []).append(msg_dict)
+        # add new messages to log, the store of every partition assigns them a contiguous id range as it writes them
+        appended = []
+        for log, msg_dicts in groups.items():
+            position = log.store.append_batch(msg_dicts)
+            # the subscribers see the messages once they are on disk, the partitions appended before a failure are published as well
+            # copies as the log reads them, the write token stamps the replicated_ts of the buffered ones
+            published = [{"id": msg_dict["id"], "msg": msg_dict["msg"], "w": msg_dict["w"], "replicated_ts": msg_dict["replicated_ts"]} for msg_dict in msg_dicts]
+            log.store.on_durable(position, lambda log=log, published=published: log.fanout.publish(published))
+            appended.append((log, msg_dicts, position))
+        self.msg_id = self.entries[0][1]["id"]
+        for log, msg_dicts, position in appended:
+            request_log.debug(f'[POST] {len(msg_dicts)} received messages have been added to {log.name} with ids: {msg_dicts[0]["id"]}-{msg_dicts[-1]["id"]}')
+        return appended
+
+    # messages of POST /batch: a JSON array, {"messages": [...], "w": n} or NDJSON, one message per line
+    def parse_batch(self, body, params):
+        w = params.get("w")
+        topic = None
+        self.batch_options = {}
+        if 'ndjson' in self.headers.get('Content-Type', ''):
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            body_json = json.loads(body)
+            if isinstance(body_json, dict):
+                batch_request_validator.validate(body_json)
+                items = body_json["messages"]
+                w = w or body_json.get("w")
+                topic = body_json.get("topic")
+                self.batch_options = body_json
+            else:
+                items = body_json
+        batch_messages_validator.validate(items)
+        if len(items) > server_conf.get("client_batch_max_messages", 10000):
+            raise ValueError(f'a batch may contain at most {server_conf.get("client_batch_max_messages", 10000)} messages')
+        return items, int(w or 3), topic
+
+    # hand the messages over to the replication workers, a batch counts down the latch once per secondary
+    def replicate_msgs(self, appended, latch):
+        count = sum(len(msg_dicts) for log, msg_dicts, position in appended)
+        for secondary_host in secondary_hosts:
+            secondary_latch = GroupLatch(count, latch) if count > 1 else latch
+            for log, msg_dicts, position in appended:
+                request_log.debug(f'[POST] Replicating the messages of {log.name} with ids: {msg_dicts[0]["id"]}-{msg_dicts[-1]["id"]}')
+                worker = log.workers[secondary_host["id"]]
+                for msg_dict in msg_dicts:
+                    worker.submit(msg_dict, secondary_latch)
+
+    # the write concern is met
+    def complete_msgs(self, appended):
+        w = self.entries[0][1]["w"]
+        if self.is_batch:
+            request_log.info(f'[POST] The batch of {len(self.entries)} messages, w = {w} has been succesfully replicated to {", ".join(log.name for log, msg_dicts, position in appended)}')
+            response = {
+                "topic": self.entries[0][0].topic,
+                "ids": [msg_dict["id"] for log, msg_dict in self.entries],
+                "partitions": [log.partition for log, msg_dict in self.entries],
+                "w": w
+            }
+            self.send_body(200, json.dumps(response), content_type='application/json')
+        else:
+            log, msg_dict = self.entries[0]
             response = f"The message msg_id = " + str(msg_dict["id"]) +", msg = \"" + msg_dict["msg"] + "\" has been succesfully replicated"
-            logging.info('[POST] ' + response)
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Server', 'Master')
-            self.end_headers()
-            response = response + '\n'
-            self.wfile.write(response.encode('utf-8'))
+            request_log.info(f'[POST] The message msg_id = {msg_dict["id"]}, msg = {payload(msg_dict["msg"])}, w = {w} has been succesfully replicated to {log.name}')
+            self.send_text(200, response, headers={'X-Log': log.name})
+        # w comes from the client, the values no cluster of this size can meet share one series
+        append_latency_metric.labels(w if 1 <= w <= len(secondary_hosts) + 1 else "other").observe(time.perf_counter() - self.started)
+
+    # the write is answered before its write concern is met, the client follows it with the token
+    def accept_msgs(self, token):
+        register_token(token)
+        if self.write_async:
+            reason = f"the write concern w = {token.w} is pending"
+        else:
+            reason = f"the write concern w = {token.w} has not been met within {self.deadline * 1000:.0f} ms, the message is on {token.replicas} replicas"
+            write_timeouts_metric.inc()
+        headers = {'X-Write-Token': token.token, 'Location': f'/writes/{token.token}'}
+        if self.is_batch:
+            request_log.info(f'[POST] The batch of {len(self.entries)} messages has been accepted, {reason}')
+            response = {
+                "topic": self.entries[0][0].topic,
+                "ids": [msg_dict["id"] for log, msg_dict in self.entries],
+                "partitions": [log.partition for log, msg_dict in self.entries],
+                "w": token.w,
+                "token": token.token,
+                "replicas": token.replicas
+            }
+            self.send_body(202, json.dumps(response), content_type='application/json', headers=headers)
+        else:
+            log, msg_dict = self.entries[0]
+            request_log.info(f'[POST] The message msg_id = {msg_dict["id"]}, msg = {payload(msg_dict["msg"])} has been accepted, {reason}')
+            response = f"The message msg_id = " + str(msg_dict["id"]) + ", msg = \"" + msg_dict["msg"] + "\" has been accepted, " + reason + ". Write token: " + token.token
+            self.send_text(202, response, headers=dict(headers, **{'X-Log': log.name}))
+
+    # GET /writes/<token>: status of the write, wait_ms waits until the write has reached the replicas
+    # (w by default), stream sends the status as NDJSON on every change until every replica has the write
+    def parse_write_request(self, route, params):
+        token = write_tokens.get(route[len('/writes/'):])
+        if token is None:
+            self.send_text(404, "Unknown or expired write token")
+            return None
+        stream = params.get("stream", "false").lower() in ("true", "1")
+        try:
+            replicas = int(params.get("replicas", token.w))
+            wait_ms = params.get("wait_ms", server_conf.get("write_timeout_ms") if stream else 0)
+            timeout = None if wait_ms is None else int(wait_ms) / 1000
+        except ValueError as e:
+            self.send_text(400, f"Invalid GET request. Exception: {e}")
+            return None
+        return token, replicas, timeout, stream
+
+    def send_write_status(self, token):
+        self.send_body(200, json.dumps(token.status()), content_type='application/json')
+
+    # GET /subscribe: the messages of the partition from from_id on, as they are appended
+    def parse_subscribe_request(self, params):
+        try:
+            log = get_log(params.get("topic", "default"), params.get("partition"), params.get("key"))
+        except (UnknownLogError, ValueError) as e:
+            self.send_text(404, f"{e}")
+            return None
+        try:
+            from_id, fmt, content_type = parse_subscription(params, self.headers, log.fanout.last_id())
+        except ValueError as e:
+            self.send_text(400, f"Invalid GET request. Exception: {e}")
+            return None
+        request_log.info(f'[GET] {self.address_string()} subscribed to {log.name} from id {from_id} as {fmt}')
+        subscription = Subscription(log.fanout, log.store, from_id, fmt, read_conf.get("subscribe_batch_messages", 1000), read_conf.get("subscribe_keepalive_s", 15))
+        return subscription, content_type
+
+    def fail_msg(self, e):
+        request_log.error(f'[POST] Exception: {e}', stack_info=debug)
+        response = f"Failed to replicate message: msg_id = {self.msg_id}, msg = \"{self.msg}\". Exception: {e}"
+        self.send_text(500, response)
+
+class SimpleHTTPRequestHandler(MasterRequestHandler, KeepAliveRequestHandler):
+    server_name = 'Master'
+
+    def do_GET(self):
+        route, params = parse_path(self.path)
+        if route == '/subscribe':
+            request = self.parse_subscribe_request(params)
+            if request is None:
+                return
+            subscription, content_type = request
+            try:
+                self.send_chunked(200, subscription.stream(), content_type, headers={'Cache-Control': 'no-cache'})
+            except (BrokenPipeError, ConnectionResetError):
+                # the subscriber has gone
+                self.close_connection = True
+            return
+        if not route.startswith('/writes/'):
+            MasterRequestHandler.do_GET(self)
+            return
+        request = self.parse_write_request(route, params)
+        if request is None:
+            return
+        token, replicas, timeout, stream = request
+        if stream:
+            self.send_chunked(200, self.write_status_stream(token, timeout), 'application/x-ndjson')
+            return
+        if timeout:
+            token.wait(replicas, timeout)
+        self.send_write_status(token)
+
+    # a line on every change of the replicas, the empty chunk flushes it to the client
+    def write_status_stream(self, token, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        replicas = 0
+        while True:
+            if replicas == token.replicas and not token.wait(replicas + 1, None if deadline is None else max(deadline - time.monotonic(), 0)):
+                return
+            replicas = token.replicas
+            yield json.dumps(token.status()).encode('utf-8') + b'\n'
+            yield b''
+            if replicas > len(secondary_hosts):
+                return
+
+    def do_POST(self):
+        try:
+            appended = self.append_msgs()
+            if appended is None:
+                return
+            # wait for the fsync according to the storage policy, outside of the store lock so appends are committed in groups
+            for log, msg_dicts, position in appended:
+                log.store.sync(position)
+            token = WriteToken(appended, self.entries[0][1]["w"])
+            self.replicate_msgs(appended, token)
+            # wait for the write concern until the deadline
+            if self.write_async or not token.wait(token.w, self.deadline):
+                self.accept_msgs(token)
+                return
+            self.complete_msgs(appended)
         except Exception as e:
-            logging.error('[POST] ' + response, stack_info=debug)
-            response = f"Failed to replicate message: msg_id = {msg_id}, msg = \"{msg}\". Exception: {e}"
-            self.send_response(500)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Server', 'Master')
-            self.end_headers()
-            response = response + '\n'
-            self.wfile.write(response.encode('utf-8'))  
-
-    def log_message(self, format, *args):
-        pass
+            self.fail_msg(e)
+
+class AsyncHTTPRequestHandler(MasterRequestHandler, AsyncRequestHandler):
+    server_name = 'Master'
+    # a proxied read would block the event loop, such reads are redirected
+    proxy_supported = False
+
+    # the same steps as SimpleHTTPRequestHandler, waiting without blocking the event loop
+    async def do_GET(self):
+        route, params = parse_path(self.path)
+        if route == '/subscribe':
+            request = self.parse_subscribe_request(params)
+            if request is not None:
+                subscription, content_type = request
+                self.send_chunked(200, subscription.stream_async(), content_type, headers={'Cache-Control': 'no-cache'})
+            return
+        if not route.startswith('/writes/'):
+            MasterRequestHandler.do_GET(self)
+            return
+        request = self.parse_write_request(route, params)
+        if request is None:
+            return
+        token, replicas, timeout, stream = request
+        if stream:
+            self.send_chunked(200, self.write_status_stream(token, timeout), 'application/x-ndjson')
+            return
+        if timeout:
+            await token.wait_async(replicas, timeout)
+        self.send_write_status(token)
+
+    async def write_status_stream(self, token, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        replicas = 0
+        while True:
+            if replicas == token.replicas and not await token.wait_async(replicas + 1, None if deadline is None else max(deadline - time.monotonic(), 0)):
+                return
+            replicas = token.replicas
+            yield json.dumps(token.status()).encode('utf-8') + b'\n'
+            yield b''
+            if replicas > len(secondary_hosts):
+                return
+
+    async def do_POST(self):
+        try:
+            if not self.prepare_msgs():
+                return
+            loop = asyncio.get_running_loop()
+            # the writes, and the fsync of every append with fsync=always, would stall every connection of the loop
+            appended = await loop.run_in_executor(None, self.store_msgs)
+            durable = []
+            for log, msg_dicts, position in appended:
+                future = loop.create_future()
+                log.store.on_durable(position, lambda future=future: loop.call_soon_threadsafe(future.set_result, None))
+                durable.append(future)
+            await asyncio.gather(*durable)
+            token = WriteToken(appended, self.entries[0][1]["w"])
+            self.replicate_msgs(appended, token)
+            if self.write_async or not await token.wait_async(token.w, self.deadline):
+                self.accept_msgs(token)
+                return
+            self.complete_msgs(appended)
+        except Exception as e:
+            self.fail_msg(e)
 
 def run_HTTP_server(server_class=ThreadedHTTPServer, handler_class=SimpleHTTPRequestHandler):
     master_port = [e.get("port") for e in hosts if e.get("type") == "master"][0]
-    httpd = ThreadedHTTPServer(('', master_port), SimpleHTTPRequestHandler)
+    # close idle keep-alive connections
+    handler_class.timeout = connection_conf.get("idle_timeout")
+    httpd = server_class(('', master_port), handler_class)
     logging.info(f'HTTP server started and listening on {master_port}')
     httpd.serve_forever()
 
-def health_check(secondary_host):
-    try:
-        status_prev = secondary_statuses[secondary_host["id"]]
-        url = f'http://{secondary_host.get("hostname")}:{secondary_host.get("port")}/health'
-        response = requests.get(url, timeout=(3,1)) # (connect timeout, read timeout)
-        request_failed = False
-        
-        if response.status_code == 200:
-            secondary_statuses[secondary_host["id"]] = "Healthy"
-            secondary_locks[secondary_host["id"]].count_down()
-        else:
-            request_failed = True
-    except (requests.ConnectionError, requests.Timeout) as e:
-        request_failed = True
-    except Exception as e:
-        logging.error(f'[Heartbeat check] Exception: {e}')
-    finally:
-        if request_failed:
-            if secondary_statuses[secondary_host["id"]] is None or secondary_statuses[secondary_host["id"]] == "Healthy":
-                secondary_statuses[secondary_host["id"]] = "Suspected"
-            elif secondary_statuses[secondary_host["id"]] == "Suspected":
-                secondary_statuses[secondary_host["id"]] = "Unhealthy"
-        if secondary_statuses[secondary_host["id"]] != status_prev and not (secondary_statuses[secondary_host["id"]] == "Healthy" and status_prev is None):
-            logging.info(f'[Heartbeat check] {secondary_host.get("name")} is in {secondary_statuses[secondary_host["id"]]} status')
+def run_async_HTTP_server(handler_class=AsyncHTTPRequestHandler):
+    master_port = [e.get("port") for e in hosts if e.get("type") == "master"][0]
+    httpd = AsyncHTTPServer(master_port, handler_class, idle_timeout=connection_conf.get("idle_timeout"), backlog=server_conf.get("backlog", 1024))
+    logging.info(f'asyncio HTTP server started and listening on {master_port}')
+    asyncio.run(httpd.serve_forever())
+
+"""
+Membership
+Secondaries can be added to and removed from Hosts while the Master is running, the in-memory log is kept.
+A joining Secondary gets its connection pool, its replication workers and its heartbeats before it is listed
+in secondary_hosts, and receives the log from the catch-up. A leaving Secondary is taken off the list first
+and then stopped, its stopped state stays in the dictionaries by id, so requests still going over the previous
+list do not fail, and is replaced when the id joins again. A Secondary whose address has changed leaves and joins
+"""
+def start_secondary(secondary_host):
+    secondary_id = secondary_host["id"]
+    secondary_statuses[secondary_id] = None
+    secondary_locks[secondary_id] = CountDownLatch(1)
+    secondary_sessions[secondary_id] = create_session(connection_conf.get("pool_size"))
+    for log in logs.values():
+        log.add_worker(secondary_host)
+    failure_detector.add(secondary_host)
+    logging.info(f'[Config] {secondary_host.get("name")} has joined the cluster')
+
+def stop_secondary(secondary_host):
+    secondary_id = secondary_host["id"]
+    failure_detector.remove(secondary_host)
+    for log in logs.values():
+        log.workers[secondary_id].stop()
+    secondary_sessions[secondary_id].close()
+    logging.info(f'[Config] {secondary_host.get("name")} has left the cluster')
+
+# settings read once at startup, by the threads, the sockets or the logs they create
+RESTART_KEYS = {
+    "Server": ("mode", "backlog"),
+    "Replication": ("max_in_flight",),
+    "Connection": ("pool_size", "idle_timeout"),
+    "Heartbeat": ("window_size", "startup_grace_ms"),
+    "Read": ("subscribe_buffer_messages", "view_cache_pages")
+}
+
+def apply_config(old, new):
+    """
+    Apply a reloaded config: the membership changes, the request settings, the settings of the replication
+    workers and of the failure detector take effect right away. The storage, the topics, the logging,
+    the server and the keys listed in RESTART_KEYS after a restart
+    """
+    global secondary_hosts, server_conf, replication_conf, read_conf, connection_conf
+    server_conf = new.section("Server")
+    replication_conf = new.section("Replication")
+    read_conf = new.section("Read")
+    connection_conf = new.section("Connection")
+    current = {secondary_host["id"]:secondary_host for secondary_host in secondary_hosts}
+    wanted = {secondary_host["id"]:secondary_host for secondary_host in new.secondaries}
+    leaving = [secondary_host for secondary_id, secondary_host in current.items() if wanted.get(secondary_id) != secondary_host]
+    joining = [secondary_host for secondary_id, secondary_host in wanted.items() if current.get(secondary_id) != secondary_host]
+    if leaving:
+        secondary_hosts = [secondary_host for secondary_host in secondary_hosts if secondary_host not in leaving]
+        for secondary_host in leaving:
+            stop_secondary(secondary_host)
+    for secondary_host in joining:
+        start_secondary(secondary_host)
+    secondary_hosts = list(new.secondaries)
+    for log in list(logs.values()):
+        for worker in list(log.workers.values()):
+            worker.configure(replication_conf)
+    failure_detector.configure(new.section("Heartbeat"), connection_conf)
+    restart = [key for key in ("Storage", "Retention", "Topics", "Logging", "debug") if old.sections.get(key) != new.sections.get(key)]
+    if old.master != new.master:
+        restart.append("the master host")
+    for section, keys in RESTART_KEYS.items():
+        restart += old.changed(new, section, keys)
+    if restart:
+        logging.warning(f'[Config] The changes of {", ".join(restart)} take effect after a restart of the Master')
+
+def get_watermarks():
+    """
+    Replication progress of every log on every secondary, published for the clients routing their reads
+    """
+    return {"logs": {name: get_log_watermarks(log) for name, log in logs.items()}}
+
+def get_log_watermarks(log):
+    secondaries = []
+    for secondary_host in secondary_hosts:
+        worker = log.workers[secondary_host["id"]]
+        lag_ms = worker.lag_ms()
+        secondaries.append({
+                                "id": secondary_host["id"],
+                                "name": secondary_host.get("name"),
+                                "url": secondary_host.get("public_url", f'http://{secondary_host.get("hostname")}:{secondary_host.get("port")}'),
+                                "status": secondary_statuses[secondary_host["id"]],
+                                "watermark": worker.watermark,
+                                "lag_ms": None if lag_ms is None else round(lag_ms, 1)
+                            })
+    return {"topic": log.topic, "partition": log.partition, "first_id": log.store.first_id(), "last_id": log.store.last_id(), "secondaries": secondaries}
+
+def pick_secondary(log, min_id, max_lag_ms):
+    """
+    Random healthy secondary satisfying the staleness bound for the log, None if there is no such secondary
+    """
+    candidates = []
+    for secondary_host in secondary_hosts:
+        if secondary_statuses[secondary_host["id"]] != "Healthy":
+            continue
+        worker = log.workers[secondary_host["id"]]
+        if min_id is not None and worker.watermark < min_id:
+            continue
+        if max_lag_ms is not None:
+            lag_ms = worker.lag_ms()
+            if lag_ms is None or lag_ms > max_lag_ms:
+                continue
+        candidates.append(secondary_host)
+    return random.choice(candidates) if candidates else None
+
+def ready_secondaries(partitions):
+    """
+    Number of Secondaries whose backlogs have room on every partition of a write
+    """
+    return sum(all(log.workers[secondary_host["id"]].has_room() for log in partitions) for secondary_host in secondary_hosts)
 
 def get_quorum():
-    if any(value is None or value == "Healthy" for value in secondary_statuses.values()):
+    if any(secondary_statuses[secondary_host["id"]] in (None, "Healthy") for secondary_host in secondary_hosts):
         return True
     else:
         return False
 
-def heartbeats():
-    time.sleep(3)
-    quorum = None
-    while True:
-        threads = []
-        for secondary_host in secondary_hosts:
-            if secondary_statuses[secondary_host["id"]] == "Healthy":
-                secondary_locks[secondary_host["id"]] = CountDownLatch(1)
-            t = threading.Thread(
-                                    target=health_check,
-                                    name="[Heartbeat check] Checking " + secondary_host.get("name") + " health status",
-                                    args=(secondary_host,)
-                                )
-            threads.append(t)
-            t.start()
-        for t in threads:
-            t.join()
-        time.sleep(5)
-
-        quorum_prev = quorum
-        quorum = get_quorum()
-
-        if not quorum and not quorum == quorum_prev:
-            logging.info(f'[Heartbeat check] Master has been switched into read-only mode. Waiting for Secondaries quorum')
-        if quorum and not quorum == quorum_prev and not quorum_prev is None:
-            logging.info(f'[Heartbeat check] The Secondaries quorum has been restored. Master is ready to accept messages append requests')
-        
+# Metrics
+append_latency_metric = Histogram("replog_append_latency_seconds", "Time from an append request to its response", ["w"])
+replication_latency_metric = Histogram("replog_replication_latency_seconds", "Time from queueing a message for a secondary to its acknowledgement", ["secondary", "log"])
+replicated_messages_metric = Counter("replog_replicated_messages_total", "Messages acknowledged by the secondary", ["secondary", "log"])
+replication_retries_metric = Counter("replog_replication_retries_total", "Failed replication batches and catch-up attempts", ["secondary", "log"])
+replication_bytes_metric = Counter("replog_replication_bytes_total", "Bytes of replication request bodies sent to the secondary", ["secondary", "log"])
+snapshot_installs_metric = Counter("replog_snapshot_installs_total", "Snapshots sent to the secondary by the catch-up", ["secondary", "log"])
+backlog_overflows_metric = Counter("replog_replication_backlog_overflows_total", "Times the backlog of the secondary has filled up", ["secondary", "log"])
+write_timeouts_metric = Counter("replog_write_timeouts_total", "Writes answered with 202 because their write concern was not met before the deadline")
+rejected_appends_metric = Counter("replog_rejected_appends_total", "Append requests refused with 429 because the backlogs are full")
+catchup_runs_metric = Counter("replog_catchup_runs_total", "Catch-up runs")
+queue_depth_metric = Gauge("replog_replication_queue_depth", "Messages waiting to be packed into a batch", ["secondary", "log"])
+in_flight_metric = Gauge("replog_replication_in_flight_batches", "Batches sent to the secondary and not answered yet", ["secondary", "log"])
+pending_metric = Gauge("replog_replication_pending_messages", "Messages in the backlog, not acknowledged by the secondary yet", ["secondary", "log"])
+backlog_bytes_metric = Gauge("replog_replication_backlog_bytes", "Bytes of the messages in the backlog: queued, in flight or waiting for the catch-up", ["secondary", "log"])
+heartbeat_rtt_metric = Histogram("replog_heartbeat_rtt_seconds", "Round trip time of the health checks", ["secondary"])
+subscribers_metric = Gauge("replog_subscribers", "Open subscriptions to the log", ["log"])
+phi_metric = Gauge("replog_secondary_phi", "Suspicion level of the failure detector", ["secondary"])
+first_id_metric = Gauge("replog_log_first_id", "Id of the first message kept in the log", ["log"])
+last_id_metric = Gauge("replog_log_last_id", "Id of the last message in the log", ["log"])
+bytes_metric = Gauge("replog_log_bytes", "Bytes kept by the storage engine", ["log"])
+
+# JSON schemas of the POST requests, compiled once
+message_schema = {
+    "type": "object",
+    "properties": {
+        "msg": {"type": "string"},
+        "w": {"type": "integer"},
+        "topic": {"type": "string"},
+        "partition": {"type": "integer"},
+        "key": {"type": "string"},
+        "async": {"type": "boolean"},
+        "timeout_ms": {"type": ["integer", "null"]},
+    },
+    "required": ["msg"]
+}
+post_request_validator = Draft7Validator(message_schema)
+batch_request_validator = Draft7Validator({
+    "type": "object",
+    "properties": {
+        "messages": {"type": "array"},
+        "w": {"type": "integer"},
+        "topic": {"type": "string"},
+        "async": {"type": "boolean"},
+        "timeout_ms": {"type": ["integer", "null"]},
+    },
+    "required": ["messages"]
+})
+# the write concern, the topic and the deadline are set for the whole batch, an item only carries its message and partition
+batch_item_schema = {
+    "type": "object",
+    "properties": {
+        "msg": {"type": "string"},
+        "partition": {"type": "integer"},
+        "key": {"type": "string"},
+    },
+    "required": ["msg"],
+    "additionalProperties": False
+}
+batch_messages_validator = Draft7Validator({"type": "array", "items": batch_item_schema, "minItems": 1})
+
 # Init for shared variables
 script_path = os.path.dirname(os.path.realpath(__file__))
+# REPLICATED_LOG_CONFIG points to another config file (used by bench.py)
+try:
+    cluster_config = ClusterConfig(os.environ.get("REPLICATED_LOG_CONFIG", os.path.join(script_path,'config.json')))
+except (OSError, ConfigError) as e:
+    sys.exit(f"Cannot load the config: {e}")
 hosts = get_config("Hosts")
-secondary_hosts = list(filter(lambda host: host.get("type") == "secondary" and host.get("active") == 1, hosts))
+# replaced as a whole when the membership changes, see apply_config()
+secondary_hosts = list(cluster_config.topology.secondaries)
 secondary_statuses = {secondary_host["id"]:None for secondary_host in secondary_hosts}
 secondary_locks = {secondary_host["id"]:CountDownLatch(1) for secondary_host in secondary_hosts}
-log_list = []
+# one keep-alive connection pool per secondary shared by replication, catch-up and proxied reads,
+# the failure detector sends the heartbeats over its own connections
+connection_conf = get_config("Connection")
+secondary_sessions = {secondary_host["id"]:create_session(connection_conf.get("pool_size")) for secondary_host in secondary_hosts}
+failure_detector = FailureDetector()
+server_conf = get_config("Server")
+replication_conf = get_config("Replication")
+# tokens of the writes answered before their write concern was met, in the order of creation
+write_tokens = collections.OrderedDict()
+write_tokens_lock = threading.Lock()
+read_conf = get_config("Read")
+# rendered GET /health table
+health_view = CachedView()
+# partitions of every topic and every partition by its log name, filled by open_logs()
+topics = {}
+logs = {}
 
 def main():
     """
@@ -315,10 +1444,21 @@ def main():
     """
     logging.info('Master host has been started')
     try:
-        t = threading.Thread(target=heartbeats)
-        t.start()
+        open_logs()
+
+        failure_detector.start()
+
+        for log in logs.values():
+            log.start()
 
-        run_HTTP_server()
+        # membership and settings changes are applied without a restart
+        cluster_config.on_reload(apply_config)
+        cluster_config.watch(get_config("Config").get("watch_interval_s", 1))
+
+        if server_conf.get("mode", "threaded") == "asyncio":
+            run_async_HTTP_server()
+        else:
+            run_HTTP_server()
     except Exception as e:
         logging.error(f"Exception: {e}", stack_info=debug)
         raise
@@ -332,13 +1472,5 @@ if __name__ == '__main__':
     except OSError:
         pass
 
-    logging.basicConfig(
-        format='%(asctime)s %(levelname)s %(message)s',
-        level=logging.DEBUG if debug else logging.INFO,
-        handlers=[
-            logging.FileHandler(logfile_path),
-            logging.StreamHandler()
-        ]
-    )
+    setup_logging(logfile_path, debug, get_config("Logging"))
     main()
-
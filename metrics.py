@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+import bisect, threading
+
+"""
+In-process metrics in the Prometheus text format
+Counters and histograms keep one array of numbers per thread, so recording a value on the hot path
+is a couple of list operations without any lock. Values are summed when /metrics is scraped.
+Gauges are either set directly or computed by a callback at scrape time.
+"""
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class ShardedValues():
+
+    # constructor
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        # the lock is taken only when a thread records its first value and on scrape
+        self.lock = threading.Lock()
+        self.shards = {}
+        # values of the threads which have finished
+        self.retired = [0] * size
+
+    # array of the current thread
+    def shard(self):
+        try:
+            return self.local.values
+        except AttributeError:
+            values = [0] * self.size
+            with self.lock:
+                # a thread per connection registers a shard, the finished ones are folded here too
+                # so the shards stay bounded by the live threads when /metrics is never scraped
+                self.retire()
+                self.shards[threading.current_thread()] = values
+            self.local.values = values
+            return values
+
+    # fold the values of the threads which have finished, called under the lock
+    def retire(self):
+        for thread in [thread for thread in self.shards if not thread.is_alive()]:
+            for idx, value in enumerate(self.shards.pop(thread)):
+                self.retired[idx] += value
+
+    def snapshot(self):
+        with self.lock:
+            self.retire()
+            total = list(self.retired)
+            for values in self.shards.values():
+                for idx, value in enumerate(values):
+                    total[idx] += value
+        return total
+
+
+class Metric():
+    kind = None
+
+    # constructor
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.children_lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    # child metric for the label values, created once and cached
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self.children.get(key)
+        if child is None:
+            with self.children_lock:
+                child = self.children.setdefault(key, self.create_child())
+        return child
+
+    # drop the child of the label values, e.g. of a Secondary which has left the cluster
+    def remove(self, *values):
+        with self.children_lock:
+            self.children.pop(tuple(str(value) for value in values), None)
+
+    def label_str(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for key, child in list(self.children.items()):
+            lines += self.render_child(key, child)
+        return lines
+
+
+class CounterChild():
+
+    # constructor
+    def __init__(self):
+        self.values = ShardedValues(1)
+
+    def inc(self, amount=1):
+        self.values.shard()[0] += amount
+
+    def value(self):
+        return self.values.snapshot()[0]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def create_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render_child(self, key, child):
+        return [f'{self.name}{self.label_str(key)} {child.value()}']
+
+
+class GaugeChild():
+
+    # constructor
+    def __init__(self):
+        self.current = 0
+        self.function = None
+
+    def set(self, value):
+        self.current = value
+
+    # the value is computed on scrape
+    def set_function(self, function):
+        self.function = function
+
+    def value(self):
+        return self.function() if self.function is not None else self.current
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def create_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+    def render_child(self, key, child):
+        return [f'{self.name}{self.label_str(key)} {child.value()}']
+
+
+class HistogramChild():
+
+    # constructor
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one counter per bucket, one for +Inf, then the sum
+        self.values = ShardedValues(len(buckets) + 2)
+
+    def observe(self, value):
+        shard = self.values.shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    # constructor
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help, labelnames, registry)
+
+    def create_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def render_child(self, key, child):
+        values = child.values.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), values[:-1]):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{self.label_str(key, [("le", bound)])} {cumulative}')
+        lines.append(f'{self.name}_sum{self.label_str(key)} {values[-1]}')
+        lines.append(f'{self.name}_count{self.label_str(key)} {cumulative}')
+        return lines
+
+
+class Registry():
+
+    # constructor
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    # text exposition format, https://prometheus.io/docs/instrumenting/exposition_formats/
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -1,21 +1,209 @@
 #!/usr/bin/env python3
-import sys, os, json, time, logging
+import sys, os, json, time, heapq, queue, logging, threading, itertools
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import HTTPServer
 from socketserver import ThreadingMixIn
-from jsonschema import validate
-from tabulate import tabulate
+from jsonschema import Draft7Validator
+from httputils import KeepAliveRequestHandler, parse_path, parse_range, parse_bounds
+from storage import SecondaryLog, Compactor
+from wire import decode_batch, encode_acks, capabilities, WireFormatError, Freshness, MASTER_LAST_ID_HEADER, CONTIGUOUS_ID_HEADER, MASTER_LAST_IDS_HEADER, CONTIGUOUS_IDS_HEADER
+from logpipe import setup_logging, request_log
+from fanout import FanOut, Subscription, parse_subscription
+from views import LogView
+from topology import ClusterConfig, ConfigError
+from metrics import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
 
 def get_config(key):
     """
-    Read config
+    Section of the cluster config, loaded once and swapped on reload (see topology.py)
     """
-    with open(os.path.join(script_path,'config.json')) as json_file:
+    return cluster_config.section(key)
+
+# settings read once at startup or by the logs when they are created
+RESTART_KEYS = {
+    "Connection": ("idle_timeout",),
+    "Read": ("subscribe_buffer_messages", "view_cache_pages")
+}
+
+def apply_config(old, new):
+    """
+    Apply a reloaded config: the read settings, the apply batch size and the injected delay take effect right away,
+    the retention, the logging and the keys listed in RESTART_KEYS after a restart
+    """
+    global hosts, read_conf, replication_delay
+    hosts = new.hosts
+    read_conf = new.section("Read")
+    for replica in list(replica_logs.values()):
+        replica.ingest.batch_max_messages = new.section("Replication").get("apply_batch_max_messages", 10000)
+    restart = [key for key in ("Retention", "Logging", "debug") if old.sections.get(key) != new.sections.get(key)]
+    for section, keys in RESTART_KEYS.items():
+        restart += old.changed(new, section, keys)
+    if restart:
+        logging.warning(f'[Config] The changes of {", ".join(restart)} take effect after a restart of the Secondary')
+    secondary_host = new.secondary(int(secondary_id))
+    if secondary_host is None:
+        logging.warning(f'[Config] Secondary {secondary_id} is no longer listed in Hosts, it keeps running until it is stopped')
+        return
+    replication_delay = secondary_host.get("delay_ms", 0) / 1000
+    old_host = old.secondary(int(secondary_id))
+    if old_host is not None and secondary_host.get("port") != old_host.get("port"):
+        logging.warning(f'[Config] The new port {secondary_host.get("port")} takes effect after a restart of the Secondary')
+
+"""
+Ingest pipeline
+Request threads only decode and validate the replicated messages and hand them over to the apply thread
+of the log. The apply thread takes everything queued by then, inserts it into the log as one batch and
+wakes the request threads up once their messages are stored, so the watermark and the subscribers move
+once per batch. The "wait" test message is held back by the apply thread instead of blocking it:
+it is inserted 10 s later, the messages after it stay invisible until then.
+"""
+WAIT_DELAY_S = 10
+
+class IngestRequest():
+
+    # constructor
+    def __init__(self, count):
+        self.remaining = count
+        self.stored = 0
+        self.error = None
+        self.done = threading.Event()
+        if count == 0:
+            self.done.set()
+
+    # called by the apply thread only
+    def applied(self, stored):
+        self.remaining -= 1
+        self.stored += stored
+        if self.remaining == 0:
+            self.done.set()
+
+    def fail(self, error):
+        self.error = error
+        self.done.set()
+
+class IngestPipeline():
+
+    # constructor
+    def __init__(self, replica):
+        self.replica = replica
+        self.batch_max_messages = get_config("Replication").get("apply_batch_max_messages", 10000)
+        self.queue = queue.Queue()
+        # held back messages by due time, the sequence keeps the heap from comparing the messages
+        self.delayed = []
+        self.sequence = itertools.count()
+        threading.Thread(target=self.apply_loop, name=f"Apply {replica.name}", daemon=True).start()
+
+    # called by the request threads, returns the number of stored messages once every message is in the log
+    def apply(self, messages):
+        request = IngestRequest(len(messages))
+        if messages:
+            self.queue.put((messages, request))
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.stored
+
+    # the next requests, waiting at most until the first held back message is due
+    def take(self):
+        timeout = max(self.delayed[0][0] - time.monotonic(), 0) if self.delayed else None
         try:
-            dict_conf = json.load(json_file)
-            return dict_conf[key]
-        except:
-            raise
+            items = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        count = len(items[0][0])
+        while count < self.batch_max_messages:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            count += len(items[-1][0])
+        return items
+
+    def apply_loop(self):
+        while True:
+            items = self.take()
+            now = time.monotonic()
+            batch = []
+            for messages, request in items:
+                for msg_dict in messages:
+                    # delay to test message total ordrer, deduplication
+                    if msg_dict["msg"] == "wait":
+                        heapq.heappush(self.delayed, (now + WAIT_DELAY_S, next(self.sequence), msg_dict, request))
+                    else:
+                        batch.append((msg_dict, request))
+            while self.delayed and self.delayed[0][0] <= now:
+                due, sequence, msg_dict, request = heapq.heappop(self.delayed)
+                batch.append((msg_dict, request))
+            if not batch:
+                continue
+            started = time.perf_counter()
+            try:
+                stored = self.replica.log.insert_batch([msg_dict for msg_dict, request in batch], time.time())
+            except Exception as e:
+                logging.error(f'[Apply] {self.replica.name}. Exception: {e}', stack_info=debug)
+                for msg_dict, request in batch:
+                    request.fail(e)
+                continue
+            for (msg_dict, request), is_stored in zip(batch, stored):
+                request.applied(is_stored)
+            stored_count = sum(stored)
+            stored_messages_metric.inc(stored_count)
+            duplicate_messages_metric.inc(len(stored) - stored_count)
+            batch_apply_metric.observe(time.perf_counter() - started)
+            self.replica.fanout.advance(self.replica.log.watermark(), self.replica.log.read)
+
+"""
+Logs
+Every partition of a topic on the Master is replicated into its own log, named topic-partition.
+The logs of the topics in config.json are created at startup, any other log when the Master first
+replicates to it or asks for its watermark. Reads and subscriptions never create a log
+"""
+class ReplicaLog():
+
+    # constructor
+    def __init__(self, name):
+        self.name = name
+        self.log = SecondaryLog()
+        # lag behind the last id the Master has reported for this log
+        self.freshness = Freshness()
+        retention_conf = get_config("Retention")
+        self.compactor = Compactor(
+                                    self.log,
+                                    max_messages=retention_conf.get("max_messages"),
+                                    max_age_s=retention_conf.get("max_age_s"),
+                                    max_bytes=retention_conf.get("max_bytes"),
+                                    interval_s=retention_conf.get("interval_s", 60)
+                                )
+        first_id_metric.labels(name).set_function(self.log.first_id)
+        watermark_metric.labels(name).set_function(self.log.watermark)
+        pending_metric.labels(name).set_function(lambda: len(self.log.pending))
+        bytes_metric.labels(name).set_function(self.log.bytes_stored)
+        # the messages of the contiguous prefix for the subscribers
+        self.fanout = FanOut(0, read_conf.get("subscribe_buffer_messages", 10000))
+        subscribers_metric.labels(name).set_function(lambda: self.fanout.subscribers)
+        # rendered table pages for GET /
+        self.view = LogView(read_conf.get("view_cache_pages", 8))
+        self.ingest = IngestPipeline(self)
+        self.compactor.start()
+
+class UnknownLogError(Exception):
+    pass
+
+def get_log(params, create=True):
+    """
+    Log named by the log parameter or by topic and partition, the default topic has partition 0 only unless told otherwise.
+    Only the requests of the Master create logs, otherwise an unknown log raises UnknownLogError
+    """
+    name = params.get("log") or f'{params.get("topic", "default")}-{params.get("partition", 0)}'
+    replica = replica_logs.get(name)
+    if replica is None:
+        if not create:
+            raise UnknownLogError(f'Unknown log {name}')
+        with replica_logs_lock:
+            replica = replica_logs.get(name)
+            if replica is None:
+                replica = replica_logs[name] = ReplicaLog(name)
+    return replica
 
 """
 HTTP-server
@@ -23,121 +211,217 @@ HTTP-server
 # Processing Simultaneous/Asynchronous Requests with Python BaseHTTPServer
 # https://stackoverflow.com/a/12651298
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    pass
+    daemon_threads = True
+
+class SimpleHTTPRequestHandler(KeepAliveRequestHandler):
+    server_name = 'Secondary'
+
+    # the Master sends the last id of the log with every request, the heartbeat sends the last ids of all logs
+    def report_master_last_id(self, replica):
+        master_last_id = self.headers.get(MASTER_LAST_ID_HEADER)
+        if master_last_id is not None:
+            replica.freshness.report(int(master_last_id))
+        for name, master_last_id in json.loads(self.headers.get(MASTER_LAST_IDS_HEADER, '{}')).items():
+            get_log({"log": name}).freshness.report(master_last_id)
+
+    # watermark and replication lag sent with the reads
+    def freshness_headers(self, watermark, lag_ms):
+        headers = {CONTIGUOUS_ID_HEADER: str(watermark)}
+        if lag_ms is not None:
+            headers['X-Lag-Ms'] = f'{lag_ms:.0f}'
+        return headers
 
-class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
     def do_GET(self):
-        if self.path == '/health':
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Server', 'Secondary')
-            self.end_headers()
-            response = 'OK'
-            self.wfile.write(response.encode('utf-8'))
+        route, params = parse_path(self.path)
+        if route == '/metrics':
+            self.send_body(200, REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+            return
+        if route == '/subscribe':
+            # the messages are sent once they are part of the contiguous prefix, in the order of ids
+            try:
+                replica = get_log(params, create=False)
+            except UnknownLogError as e:
+                self.send_text(404, f"{e}")
+                return
+            try:
+                from_id, fmt, content_type = parse_subscription(params, self.headers, replica.fanout.last_id())
+            except ValueError as e:
+                self.send_text(400, f"Invalid GET request. Exception: {e}")
+                return
+            request_log.info(f'[GET] {self.address_string()} subscribed to {replica.name} from id {from_id} as {fmt}')
+            subscription = Subscription(replica.fanout, replica.log, from_id, fmt, read_conf.get("subscribe_batch_messages", 1000), read_conf.get("subscribe_keepalive_s", 15))
+            try:
+                self.send_chunked(200, subscription.stream(), content_type, headers={'Cache-Control': 'no-cache'})
+            except (BrokenPipeError, ConnectionResetError):
+                # the subscriber has gone
+                self.close_connection = True
+            return
+        if route == '/health':
+            # the Master uses the highest contiguous id to send the missing messages
+            # and picks the replication wire format from the accepted ones
+            replica = get_log(params)
+            self.report_master_last_id(replica)
+            headers = {
+                CONTIGUOUS_ID_HEADER: str(replica.log.watermark()),
+                CONTIGUOUS_IDS_HEADER: json.dumps({name: replica.log.watermark() for name, replica in list(replica_logs.items())})
+            }
+            self.send_body(200, 'OK', headers=dict(capabilities(), **headers))
             return
         
-        logging.info(f'[GET] {self.address_string()} requested list of messages')
         try:
-            gap_index = None
-            # find first gap
-            for index, msg in enumerate(log_list):
-                if msg is None:
-                    gap_index = index
-                    logging.info(f"gap_index= {gap_index}")
-                    break
-            if log_list and (gap_index is None or gap_index > 0):
-                log_list_fmt = [
-                                    {
-                                        "id": msg.get("id"),
-                                        "msg": msg.get("msg"),
-                                        "w": msg.get("w"),
-                                        "replicated_ts" : datetime.utcfromtimestamp(msg.get("replicated_ts")).strftime("%Y-%m-%d %H:%M:%S.%f")
-                                    }
-                                for index, msg in enumerate(log_list) if gap_index is None or index < gap_index
-                                ]
-                log_list_str = tabulate(log_list_fmt, headers="keys", tablefmt="simple_grid")
-                response = 'The replication log:\n' + log_list_str
-            else:
-                response = 'The replication log is empty'
-            logging.info('[GET] ' + response)
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Server', 'Secondary')
-            self.end_headers()
-            response = response + '\n'
-            self.wfile.write(response.encode('utf-8'))
+            try:
+                replica = get_log(params, create=False)
+            except UnknownLogError as e:
+                self.send_text(404, f"{e}")
+                return
+            secondary_log = replica.log
+            first_id = secondary_log.first_id()
+            try:
+                from_id, limit, fmt = parse_range(params, read_conf, default_format='json' if route == '/log' else 'table', first_id=first_id)
+            except ValueError as e:
+                self.send_text(400, f"Invalid GET request. Exception: {e}")
+                return
+
+            if from_id < first_id:
+                request_log.info(f'[GET] {self.address_string()} requested compacted messages from id {from_id}')
+                self.send_compacted(from_id, first_id)
+                return
+
+            # the staleness bound of the read is checked against the watermark and the lag behind the Master
+            try:
+                min_id, max_lag_ms = parse_bounds(params)
+            except ValueError as e:
+                self.send_text(400, f"Invalid GET request. Exception: {e}")
+                return
+            watermark = secondary_log.watermark()
+            lag_ms = replica.freshness.lag_ms(watermark)
+            headers = self.freshness_headers(watermark, lag_ms)
+            if (min_id is not None and watermark < min_id) or (max_lag_ms is not None and (lag_ms is None or lag_ms > max_lag_ms)):
+                request_log.info(f'[GET] {self.address_string()} requested messages with min_id = {min_id}, max_lag_ms = {max_lag_ms}, the Secondary is behind the bound')
+                self.send_text(503, f"The Secondary does not satisfy the staleness bound: its highest contiguous id is {watermark}, the lag is {'unknown' if lag_ms is None else f'{lag_ms:.0f} ms'}. Retry later or read from the Master", headers=dict(headers, **{'Retry-After': '1'}))
+                return
+
+            if fmt != 'table':
+                request_log.info(f'[GET] {self.address_string()} requested {limit} messages from id {from_id} as {fmt}')
+                self.send_entries(secondary_log.read(from_id, limit), fmt, from_id, headers=headers)
+                return
+
+            request_log.info(f'[GET] {self.address_string()} requested list of messages')
+            # only the messages before the first gap are visible, the page is rendered again when the watermark moves
+            limit = min(limit, read_conf.get("table_max_rows"))
+            self.send_view(*replica.view.get(from_id, limit, first_id, watermark, secondary_log.read), headers=headers)
         except Exception as e:
-            logging.error('[GET] ' + response, stack_info=debug)
-            response = f"Exception: {e}"
-            self.send_response(500)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Server', 'Secondary')
-            self.end_headers()
-            response = response + '\n'
-            self.wfile.write(response.encode('utf-8'))
+            request_log.error(f'[GET] Exception: {e}', stack_info=debug)
+            self.send_text(500, f"Exception: {e}")
 
     def do_POST(self):
-        global log_list
-        logging.info(f'[POST] {self.address_string()} sent a request to replicate message')
+        request_log.debug(f'[POST] {self.address_string()} sent a request to replicate message')
 
         try:
-            content_length = int(self.headers['Content-Length'])
-            body = self.rfile.read(content_length).decode("utf-8")
-            msg_dict = json.loads(body)
-
-            # delay to test message total ordrer, deduplication
-            if msg_dict["msg"] == "wait":
-                time.sleep(10)
-
-            # add new message to log
-            idx = msg_dict["id"]-1
-            if len(log_list) <= idx or log_list[idx] is None:
-                msg_dict["replicated_ts"] = time.time()
-                if len(log_list) < idx:
-                    npads = idx - len(log_list) + 1
-                    log_list += [ None ] * npads
-                    log_list[idx] = msg_dict
-                elif len(log_list) == idx:
-                    log_list.append(msg_dict)
-                elif log_list[idx] is None:
-                    log_list[idx] = msg_dict
-                response = f"Message with id = " + str(msg_dict["id"]) + " has been replicated"
-            else:    
-                response = f"Message with id = " + str(msg_dict["id"]) + " already exists in the log"
-            
-            logging.info('[POST] ' + response)
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Server', 'Secondary')
-            self.end_headers()
-            response = response + '\n'
-            self.wfile.write(response.encode('utf-8'))
+            body = self.read_body()
+            route, params = parse_path(self.path)
+            replica = get_log(params)
+            secondary_log = replica.log
+            self.report_master_last_id(replica)
+
+            # injected replication delay of a slow Secondary
+            if replication_delay:
+                time.sleep(replication_delay)
+
+            if route == '/snapshot':
+                # the Master bootstraps a Secondary which is behind the start of its log
+                try:
+                    messages = decode_batch(self.headers.get('Content-Type'), self.headers.get('Content-Encoding'), body)
+                except WireFormatError as e:
+                    request_log.error(f'[POST] Invalid snapshot. Exception: {e}')
+                    self.send_text(415, f"Invalid snapshot. Exception: {e}")
+                    return
+                secondary_log.install_snapshot(int(self.headers.get('X-Snapshot-First-Id')), messages, time.time())
+                replica.fanout.advance(secondary_log.watermark(), secondary_log.read)
+                replica.view.touch()
+                logging.info(f"[POST] Snapshot of messages {self.headers.get('X-Snapshot-First-Id')}-{self.headers.get('X-Snapshot-Last-Id')} of {replica.name} has been installed")
+                self.send_body(200, 'OK', headers={CONTIGUOUS_ID_HEADER: str(secondary_log.watermark())})
+            elif route == '/batch':
+                # bulk append in the wire format negotiated with the Master, every stored or already known message is acknowledged by id
+                content_type = self.headers.get('Content-Type')
+                try:
+                    messages = decode_batch(content_type, self.headers.get('Content-Encoding'), body)
+                except WireFormatError as e:
+                    request_log.error(f'[POST] Invalid batch. Exception: {e}')
+                    self.send_text(415, f"Invalid batch. Exception: {e}")
+                    return
+                if not content_type or content_type.startswith('application/json'):
+                    try:
+                        batch_validator.validate(messages)
+                    except Exception as e:
+                        request_log.error(f'[POST] Invalid batch. Exception: {e}')
+                        self.send_text(400, f"Invalid batch. Exception: {e}")
+                        return
+                replica.ingest.apply(messages)
+                acks = [msg_dict["id"] for msg_dict in messages]
+                request_log.info(f"[POST] Batch of {len(acks)} messages of {replica.name} has been replicated")
+                response, response_type = encode_acks(acks, content_type)
+                self.send_body(200, response, content_type=response_type, headers={CONTIGUOUS_ID_HEADER: str(secondary_log.watermark())})
+            else:
+                body_dict = json.loads(body)
+                message_validator.validate(body_dict)
+                if replica.ingest.apply([body_dict]):
+                    response = f"Message with id = " + str(body_dict["id"]) + " has been replicated"
+                else:
+                    response = f"Message with id = " + str(body_dict["id"]) + " already exists in the log"
+                request_log.info('[POST] ' + response)
+                self.send_text(200, response)
         except BrokenPipeError: # https://stackoverflow.com/questions/26692284/how-to-prevent-brokenpipeerror-when-doing-a-flush-in-python
             pass            
         except Exception as e:
-            logging.error('[POST] ' + response, stack_info=debug)
-            response = f"Exception: {e}"
-            self.send_response(500)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.send_header('Server', 'Secondary')
-            self.end_headers()
-            response = response + '\n'
-            self.wfile.write(response.encode('utf-8'))
-
-    def log_message(self, format, *args):
-        pass
+            request_log.error(f'[POST] Exception: {e}', stack_info=debug)
+            self.send_text(500, f"Exception: {e}")
 
 def run_HTTP_server(server_class=ThreadedHTTPServer, handler_class=SimpleHTTPRequestHandler):
     secondary_port = [e.get("port") for e in hosts if e.get("type") == "secondary" and e.get("id") == int(secondary_id)][0]
-    httpd = ThreadedHTTPServer(('', secondary_port), SimpleHTTPRequestHandler)
+    # close idle keep-alive connections
+    handler_class.timeout = get_config("Connection").get("idle_timeout")
+    httpd = server_class(('', secondary_port), handler_class)
     logging.info(f'HTTP server started and listening on {secondary_port}')
     httpd.serve_forever()
 
 # Init for shared variables
 script_path = os.path.dirname(os.path.realpath(__file__))
+# REPLICATED_LOG_CONFIG points to another config file (used by bench.py)
+try:
+    cluster_config = ClusterConfig(os.environ.get("REPLICATED_LOG_CONFIG", os.path.join(script_path,'config.json')))
+except (OSError, ConfigError) as e:
+    sys.exit(f"Cannot load the config: {e}")
 hosts = get_config("Hosts")
 master_host = [e.get("port") for e in hosts if e.get("type") == "master"][0]
-log_list = []
+read_conf = get_config("Read")
+# logs by name, see get_log()
+replica_logs = {}
+replica_logs_lock = threading.Lock()
+
+# JSON schema of the replicated messages, compiled once
+message_schema = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "integer", "minimum": 1},
+        "msg": {"type": "string"},
+        "w": {"type": ["integer", "null"]},
+    },
+    "required": ["id", "msg"]
+}
+message_validator = Draft7Validator(message_schema)
+batch_validator = Draft7Validator({"type": "array", "items": message_schema})
+
+# Metrics
+messages_metric = Counter("replog_secondary_messages_total", "Replicated messages by result", ["result"])
+stored_messages_metric = messages_metric.labels("stored")
+duplicate_messages_metric = messages_metric.labels("duplicate")
+batch_apply_metric = Histogram("replog_secondary_batch_apply_seconds", "Time to apply a replicated batch")
+first_id_metric = Gauge("replog_log_first_id", "Id of the first message kept in the log", ["log"])
+watermark_metric = Gauge("replog_log_watermark", "Highest contiguous id", ["log"])
+pending_metric = Gauge("replog_log_pending_messages", "Messages waiting for a gap to be filled", ["log"])
+bytes_metric = Gauge("replog_log_bytes", "Bytes of message texts kept in the log", ["log"])
+subscribers_metric = Gauge("replog_subscribers", "Open subscriptions to the log", ["log"])
 
 def main():
     """
@@ -145,6 +429,11 @@ def main():
     """
     logging.info('Secondary host has been started')
     try:
+        for topic, topic_conf in get_config("Topics").items():
+            for partition in range(topic_conf.get("partitions", 1)):
+                get_log({"topic": topic, "partition": partition})
+        cluster_config.on_reload(apply_config)
+        cluster_config.watch(get_config("Config").get("watch_interval_s", 1))
         run_HTTP_server();
     except Exception as e:
         logging.error(f"Exception: {e}", stack_info=debug)
@@ -155,6 +444,7 @@ if __name__ == '__main__':
     if len(sys.argv) == 1:
         sys.exit("Please provide the Sedondary id (1 or 2) as first argument")
     secondary_id = sys_ags[1]
+    replication_delay = [e.get("delay_ms", 0) for e in hosts if e.get("type") == "secondary" and e.get("id") == int(secondary_id)][0] / 1000
 
     debug = get_config("debug")
     logfile_name = datetime.now().strftime(f"secondary{secondary_id}.log")
@@ -164,13 +454,5 @@ if __name__ == '__main__':
     except OSError:
         pass
 
-    logging.basicConfig(
-        format='%(asctime)s %(levelname)s %(message)s',
-        level=logging.DEBUG if debug else logging.INFO,
-        handlers=[
-            logging.FileHandler(logfile_path),
-            logging.StreamHandler()
-        ]
-    )
+    setup_logging(logfile_path, debug, get_config("Logging"))
     main()
-   
\ No newline at end of file
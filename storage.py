@@ -0,0 +1,726 @@
+#!/usr/bin/env python3
+import os, json, math, time, struct, bisect, threading, zlib, logging
+from array import array
+from wire import FRAME_HEADER
+
+"""
+Storage engines for the replication log
+Every engine keeps messages ordered by their contiguous id (starting from 1) and exposes the same methods:
+append / append_batch / sync / on_durable / get / read / set_replicated_ts / first_id / last_id / bytes_stored / compact / close
+append and append_batch assign the next ids to the messages in the same critical section which orders the writes,
+so a log needs no lock of its own around them. The prefix before first_id() has been removed by the retention policy (see Compactor).
+"""
+
+class MemoryStore():
+    """
+    Plain in-memory log, everything is lost on restart
+    """
+
+    # constructor
+    def __init__(self):
+        self.entries = []
+        # id of entries[0]
+        self.base_id = 1
+        self.size = 0
+        # appends and the retention swap the entries, readers take a consistent view
+        self.lock = threading.Lock()
+
+    # add the message to the end of the log, returns the position for sync()
+    def append(self, msg_dict):
+        return self.append_batch([msg_dict])
+
+    def append_batch(self, msg_dicts):
+        with self.lock:
+            next_id = self.base_id + len(self.entries)
+            for msg_dict in msg_dicts:
+                msg_dict["id"] = next_id
+                next_id += 1
+            self.entries += msg_dicts
+            self.size += sum(len(msg_dict["msg"]) for msg_dict in msg_dicts)
+            return self.base_id + len(self.entries) - 1
+
+    # nothing to flush
+    def sync(self, position):
+        pass
+
+    def on_durable(self, position, callback):
+        callback()
+
+    # message by id or None
+    def get(self, msg_id):
+        with self.lock:
+            idx = msg_id - self.base_id
+            if 0 <= idx < len(self.entries):
+                return self.entries[idx]
+        return None
+
+    # iterate over messages starting from from_id
+    def read(self, from_id=1, limit=None):
+        with self.lock:
+            start = max(from_id - self.base_id, 0)
+            entries = self.entries[start:] if limit is None else self.entries[start:start + limit]
+        yield from entries
+
+    def set_replicated_ts(self, msg_id, ts):
+        msg_dict = self.get(msg_id)
+        if msg_dict is not None:
+            msg_dict["replicated_ts"] = ts
+
+    def first_id(self):
+        return self.base_id
+
+    def last_id(self):
+        with self.lock:
+            return self.base_id + len(self.entries) - 1
+
+    # nothing is on disk, every message is as durable as it gets
+    def durable_last_id(self):
+        return self.last_id()
+
+    def bytes_stored(self):
+        return self.size
+
+    # drop the prefix which is out of the retention limits, returns the new first id
+    def compact(self, max_messages=None, max_age_s=None, max_bytes=None):
+        # only the retention thread removes entries, so the prefix can be measured without the lock
+        entries = self.entries
+        cutoff = time.time() - max_age_s if max_age_s is not None else None
+        count = 0
+        dropped_bytes = 0
+        for msg_dict in entries:
+            if max_messages is not None and len(entries) - count > max_messages:
+                pass
+            elif max_bytes is not None and self.size - dropped_bytes > max_bytes:
+                pass
+            elif cutoff is not None and msg_dict["replicated_ts"] is not None and msg_dict["replicated_ts"] < cutoff:
+                pass
+            else:
+                break
+            count += 1
+            dropped_bytes += len(msg_dict["msg"])
+        if count:
+            with self.lock:
+                del self.entries[:count]
+                self.base_id += count
+                self.size -= dropped_bytes
+        return self.base_id
+
+    def close(self):
+        pass
+
+
+"""
+Append-only segment store
+
+Layout of the storage directory:
+    <base_id>.log   - records with ids starting from base_id
+    <base_id>.index - sparse id -> offset index, one entry every index_interval_bytes
+
+Record: header (payload length, payload crc32, id, replicated_ts) followed by the JSON payload.
+replicated_ts is a fixed-width field, so it is stamped in place once the message has been replicated
+(NaN means "not replicated yet"). On recovery only the index files and the tail of the last segment
+are read, a torn tail left by a crash is truncated.
+"""
+RECORD_HEADER = struct.Struct('<IIQd')
+INDEX_ENTRY = struct.Struct('<QQ')
+TS_OFFSET = 16
+
+class Segment():
+
+    # constructor
+    def __init__(self, dir_path, base_id):
+        self.base_id = base_id
+        self.log_path = os.path.join(dir_path, f'{base_id:020d}.log')
+        self.index_path = os.path.join(dir_path, f'{base_id:020d}.index')
+        self.fd = os.open(self.log_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.index_fd = os.open(self.index_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        # sparse index, the first record of the segment is always at offset 0
+        self.index_ids = array('Q', [base_id])
+        self.index_offsets = array('Q', [0])
+        self.last_id = base_id - 1
+        self.indexed_size = 0
+
+    # load the sparse index, entries pointing past the end of the segment are dropped
+    def load_index(self):
+        data = os.pread(self.index_fd, os.fstat(self.index_fd).st_size, 0)
+        for pos in range(0, len(data) - len(data) % INDEX_ENTRY.size, INDEX_ENTRY.size):
+            msg_id, offset = INDEX_ENTRY.unpack_from(data, pos)
+            if offset >= self.size or msg_id <= self.index_ids[-1]:
+                break
+            self.index_ids.append(msg_id)
+            self.index_offsets.append(offset)
+        self.indexed_size = self.index_offsets[-1]
+
+    # rewrite the index file after the tail has been truncated
+    def rewrite_index(self):
+        os.ftruncate(self.index_fd, 0)
+        os.write(self.index_fd, b''.join(INDEX_ENTRY.pack(msg_id, offset) for msg_id, offset in zip(self.index_ids[1:], self.index_offsets[1:])))
+
+    # scan the records starting from the offset, stops at the end of the segment or at a torn record
+    def scan(self, offset):
+        while offset + RECORD_HEADER.size <= self.size:
+            header = os.pread(self.fd, RECORD_HEADER.size, offset)
+            length, crc, msg_id, ts = RECORD_HEADER.unpack(header)
+            if offset + RECORD_HEADER.size + length > self.size:
+                return
+            payload = os.pread(self.fd, length, offset + RECORD_HEADER.size)
+            if zlib.crc32(payload) != crc:
+                return
+            yield offset, msg_id, ts, payload
+            offset += RECORD_HEADER.size + length
+
+    # rebuild the tail of the segment starting from the last indexed record
+    def recover(self):
+        self.load_index()
+        end = self.index_offsets[-1]
+        self.last_id = self.index_ids[-1] - 1
+        for offset, msg_id, ts, payload in self.scan(end):
+            end = offset + RECORD_HEADER.size + len(payload)
+            self.last_id = msg_id
+        if end < self.size:
+            logging.info(f'[Storage] Truncating torn tail of {self.log_path} at offset {end}')
+            os.ftruncate(self.fd, end)
+            self.size = end
+            if self.index_offsets[-1] >= end and len(self.index_ids) > 1:
+                self.index_ids.pop()
+                self.index_offsets.pop()
+                self.rewrite_index()
+
+    # offset of the record with the given id, None if it is not in the segment
+    def locate(self, msg_id):
+        pos = bisect.bisect_right(self.index_ids, msg_id) - 1
+        for offset, record_id, ts, payload in self.scan(self.index_offsets[pos]):
+            if record_id == msg_id:
+                return offset
+            if record_id > msg_id:
+                break
+        return None
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self.index_fd)
+
+
+class SegmentStore():
+
+    # constructor
+    def __init__(self, dir_path, fsync="group", group_commit_ms=5, segment_max_bytes=64*1024*1024, index_interval_bytes=4096):
+        self.dir_path = dir_path
+        self.fsync = fsync
+        self.group_commit = group_commit_ms / 1000
+        self.segment_max_bytes = segment_max_bytes
+        self.index_interval_bytes = index_interval_bytes
+        # serializes appends and segment rolls
+        self.lock = threading.Lock()
+        # bytes written / known to be on disk, positions returned by append() are compared against them
+        self.written = 0
+        self.durable = 0
+        # on disk, but the callbacks of the last group commit may still be running
+        self.synced = 0
+        # highest id known to be on disk
+        self.durable_id = 0
+        self.durable_condition = threading.Condition()
+        # (position, callback) waiting for the next group commit
+        self.durable_callbacks = []
+        # offsets of this run's records which are not stamped as replicated yet
+        self.unstamped = {}
+        self.segments = []
+        # segments removed by the retention, closed on the next compaction so that running reads can finish
+        self.retired = []
+        os.makedirs(dir_path, exist_ok=True)
+        self.recover()
+        self.durable_id = self.last_id()
+        if self.fsync == "group":
+            threading.Thread(target=self.group_commit_loop, name="[Storage] Group commit", daemon=True).start()
+
+    # open the existing segments, only the last one is scanned
+    def recover(self):
+        base_ids = sorted(int(name[:-4]) for name in os.listdir(self.dir_path) if name.endswith('.log'))
+        for base_id in base_ids:
+            if self.segments:
+                self.segments[-1].load_index()
+                self.segments[-1].last_id = base_id - 1
+            self.segments.append(Segment(self.dir_path, base_id))
+        if self.segments:
+            self.segments[-1].recover()
+        else:
+            self.segments.append(Segment(self.dir_path, 1))
+        logging.info(f'[Storage] Recovered {self.last_id()} messages from {len(self.segments)} segment(s) in {self.dir_path}')
+
+    # close the active segment and start the new one
+    def roll(self, base_id):
+        os.fsync(self.segments[-1].fd)
+        os.fsync(self.segments[-1].index_fd)
+        self.segments.append(Segment(self.dir_path, base_id))
+
+    # add the message to the end of the log, returns the position for sync()
+    def append(self, msg_dict):
+        return self.append_batch([msg_dict])
+
+    # add messages to the end of the log with one write per segment, returns the position for sync()
+    def append_batch(self, msg_dicts):
+        # everything but the header is encoded before taking the lock
+        payloads = []
+        for msg_dict in msg_dicts:
+            payload = json.dumps({key: value for key, value in msg_dict.items() if key not in ("id", "replicated_ts")}).encode('utf-8')
+            payloads.append((payload, zlib.crc32(payload)))
+        with self.lock:
+            next_id = self.segments[-1].last_id + 1
+            records = []
+            for msg_dict, (payload, crc) in zip(msg_dicts, payloads):
+                msg_dict["id"] = next_id
+                next_id += 1
+                ts = msg_dict.get("replicated_ts")
+                records.append(RECORD_HEADER.pack(len(payload), crc, msg_dict["id"], math.nan if ts is None else ts) + payload)
+            segment = self.segments[-1]
+            buffer = []
+            end = segment.size
+            for msg_dict, record in zip(msg_dicts, records):
+                if end > 0 and end + len(record) > self.segment_max_bytes:
+                    self.write_records(segment, buffer, end)
+                    self.roll(msg_dict["id"])
+                    segment = self.segments[-1]
+                    buffer = []
+                    end = 0
+                if end - segment.indexed_size >= self.index_interval_bytes:
+                    os.write(segment.index_fd, INDEX_ENTRY.pack(msg_dict["id"], end))
+                    segment.index_ids.append(msg_dict["id"])
+                    segment.index_offsets.append(end)
+                    segment.indexed_size = end
+                self.unstamped[msg_dict["id"]] = (segment, end)
+                buffer.append((msg_dict["id"], record))
+                end += len(record)
+            self.write_records(segment, buffer, end)
+            position = self.written
+            if self.fsync == "always":
+                os.fsync(segment.fd)
+                self.durable = position
+                self.durable_id = segment.last_id
+        return position
+
+    # the records become visible to readers only after they have been written
+    def write_records(self, segment, buffer, end):
+        if not buffer:
+            return
+        os.pwrite(segment.fd, b''.join(record for msg_id, record in buffer), segment.size)
+        self.written += end - segment.size
+        segment.size = end
+        segment.last_id = buffer[-1][0]
+
+    # wait until the record at the position is on disk according to the fsync policy
+    def sync(self, position):
+        if self.fsync != "group":
+            return
+        with self.durable_condition:
+            while self.durable < position:
+                self.durable_condition.wait()
+
+    # call back from the group commit thread once the record at the position is on disk
+    def on_durable(self, position, callback):
+        if self.fsync == "group":
+            with self.durable_condition:
+                if self.synced < position:
+                    self.durable_callbacks.append((position, callback))
+                    return
+        callback()
+
+    # one fsync covers every append made since the previous one
+    def group_commit_loop(self):
+        while True:
+            with self.durable_condition:
+                self.durable_condition.wait(self.group_commit)
+            with self.lock:
+                position = self.written
+                last_id = self.segments[-1].last_id
+                fd = self.segments[-1].fd
+            if position == self.durable:
+                continue
+            os.fsync(fd)
+            with self.durable_condition:
+                self.synced = position
+                callbacks = [callback for callback_position, callback in self.durable_callbacks if callback_position <= position]
+                self.durable_callbacks = [item for item in self.durable_callbacks if item[0] > position]
+            # the callbacks run before sync() returns, so what they do (e.g. publishing to the subscribers)
+            # happens before the appending request goes on
+            for callback in callbacks:
+                callback()
+            with self.durable_condition:
+                self.durable = position
+                self.durable_id = last_id
+                self.durable_condition.notify_all()
+
+    def segment_for(self, msg_id, segments):
+        pos = bisect.bisect_right([segment.base_id for segment in segments], msg_id) - 1
+        if pos < 0 or msg_id > segments[pos].last_id:
+            return None
+        return segments[pos]
+
+    def decode(self, msg_id, ts, payload):
+        msg_dict = {"id": msg_id}
+        msg_dict.update(json.loads(payload))
+        msg_dict["replicated_ts"] = None if math.isnan(ts) else ts
+        return msg_dict
+
+    # message by id or None
+    def get(self, msg_id):
+        for msg_dict in self.read(msg_id, 1):
+            return msg_dict
+        return None
+
+    # iterate over messages starting from from_id
+    def read(self, from_id=1, limit=None):
+        # the list of segments is replaced, never modified, by the retention
+        segments = self.segments
+        from_id = max(from_id, segments[0].base_id)
+        segment = self.segment_for(from_id, segments)
+        if segment is None or limit == 0:
+            return
+        count = 0
+        offset = segment.locate(from_id)
+        for segment in segments[segments.index(segment):]:
+            for offset, msg_id, ts, payload in segment.scan(offset):
+                yield self.decode(msg_id, ts, payload)
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+            offset = 0
+
+    # stamp the replication time in place
+    def set_replicated_ts(self, msg_id, ts):
+        location = self.unstamped.pop(msg_id, None)
+        if location is None:
+            segment = self.segment_for(msg_id, self.segments)
+            if segment is None:
+                return
+            location = (segment, segment.locate(msg_id))
+        segment, offset = location
+        os.pwrite(segment.fd, struct.pack('<d', ts), offset + TS_OFFSET)
+
+    def first_id(self):
+        return self.segments[0].base_id
+
+    def last_id(self):
+        return self.segments[-1].last_id
+
+    # highest id which survives a crash, the messages above it may still be lost and get their ids reused
+    def durable_last_id(self):
+        if self.fsync == "none":
+            return self.last_id()
+        return self.durable_id
+
+    def bytes_stored(self):
+        return sum(segment.size for segment in self.segments)
+
+    # delete the oldest segments which are out of the retention limits, the active segment is always kept
+    # returns the new first id
+    def compact(self, max_messages=None, max_age_s=None, max_bytes=None):
+        for segment in self.retired:
+            segment.close()
+        self.retired = []
+        segments = self.segments
+        last_id = segments[-1].last_id
+        cutoff = time.time() - max_age_s if max_age_s is not None else None
+        total_bytes = sum(segment.size for segment in segments)
+        count = 0
+        for segment in segments[:-1]:
+            if max_messages is not None and last_id - segment.last_id >= max_messages:
+                pass
+            elif max_bytes is not None and total_bytes > max_bytes:
+                pass
+            elif cutoff is not None and os.fstat(segment.fd).st_mtime < cutoff:
+                pass
+            else:
+                break
+            count += 1
+            total_bytes -= segment.size
+        if count:
+            with self.lock:
+                self.segments = self.segments[count:]
+            first_id = self.segments[0].base_id
+            for msg_id in [msg_id for msg_id in list(self.unstamped) if msg_id < first_id]:
+                self.unstamped.pop(msg_id, None)
+            # the files are unlinked now, the descriptors stay open for the reads which are still running
+            for segment in segments[:count]:
+                os.remove(segment.log_path)
+                os.remove(segment.index_path)
+                self.retired.append(segment)
+            logging.info(f'[Storage] Retention has removed {count} segment(s), the log starts at id {first_id}')
+        return self.segments[0].base_id
+
+    def close(self):
+        with self.lock:
+            for segment in self.segments:
+                os.fsync(segment.fd)
+                segment.close()
+
+
+"""
+Log of a Secondary
+
+Messages may arrive out of order and more than once. The contiguous prefix (the visible part of the log)
+is kept column-wise: replication time and write concern in typed arrays, message texts in one bytearray
+addressed by offsets, the id of an entry is its position. Messages which arrived ahead of a gap wait
+as slotted records in a dict until the gap is filled, so the watermark (highest contiguous id) is
+advanced incrementally and duplicate checks, gap lookups and reads are O(1) per message.
+"""
+class PendingRecord():
+    __slots__ = ('ts', 'w', 'payload')
+
+    # constructor
+    def __init__(self, ts, w, payload):
+        self.ts = ts
+        self.w = w
+        self.payload = payload
+
+
+class SecondaryLog():
+
+    # constructor
+    def __init__(self):
+        self.lock = threading.Lock()
+        # columns of the contiguous prefix, entry i has id base_id+i
+        self.base_id = 1
+        self.ts = array('d')
+        self.w = array('q')
+        self.offsets = array('Q')
+        self.payloads = bytearray()
+        # offsets keep counting from the start of the log, payloads[0] is at payload_base
+        self.payload_base = 0
+        # out-of-order messages above the watermark, id -> PendingRecord
+        self.pending = {}
+
+    # highest contiguous id
+    def watermark(self):
+        return self.base_id + len(self.ts) - 1
+
+    # id already stored, either visible or waiting for a gap, or removed by the retention
+    def contains(self, msg_id):
+        return msg_id <= self.watermark() or msg_id in self.pending
+
+    def append_column(self, ts, w, payload):
+        self.ts.append(ts)
+        self.w.append(w)
+        self.offsets.append(self.payload_base + len(self.payloads))
+        self.payloads += payload
+
+    # store the message, returns False for a duplicate
+    def insert(self, msg_dict, ts):
+        return self.insert_batch([msg_dict], ts)[0]
+
+    # store the messages under one lock, the watermark moves once for the whole batch
+    # returns for every message whether it has been stored, False for a duplicate
+    def insert_batch(self, messages, ts):
+        records = [(msg_dict["id"], msg_dict.get("w") or 0, msg_dict["msg"].encode('utf-8')) for msg_dict in messages]
+        stored = []
+        with self.lock:
+            for msg_id, w, payload in records:
+                if self.contains(msg_id):
+                    stored.append(False)
+                    continue
+                if msg_id == self.watermark() + 1:
+                    self.append_column(ts, w, payload)
+                else:
+                    self.pending[msg_id] = PendingRecord(ts, w, payload)
+                stored.append(True)
+            self.drain_pending()
+        return stored
+
+    # the gap is filled, move the messages which were waiting for it
+    def drain_pending(self):
+        while self.watermark() + 1 in self.pending:
+            record = self.pending.pop(self.watermark() + 1)
+            self.append_column(record.ts, record.w, record.payload)
+
+    # replace the log with a snapshot of the Master starting at first_id, messages above it are kept
+    def install_snapshot(self, first_id, messages, ts):
+        with self.lock:
+            self.base_id = first_id
+            self.ts = array('d')
+            self.w = array('q')
+            self.offsets = array('Q')
+            self.payloads = bytearray()
+            self.payload_base = 0
+            for msg_dict in messages:
+                self.append_column(ts, msg_dict.get("w") or 0, msg_dict["msg"].encode('utf-8'))
+            self.pending = {msg_id: record for msg_id, record in self.pending.items() if msg_id > self.watermark()}
+            self.drain_pending()
+
+    # visible message by id or None
+    def get(self, msg_id):
+        with self.lock:
+            idx = msg_id - self.base_id
+            if not 0 <= idx < len(self.ts):
+                return None
+            start = self.offsets[idx] - self.payload_base
+            end = self.offsets[idx + 1] - self.payload_base if idx + 1 < len(self.offsets) else len(self.payloads)
+            return {"id": msg_id, "msg": self.payloads[start:end].decode('utf-8'), "w": self.w[idx], "replicated_ts": self.ts[idx]}
+
+    # iterate over the visible messages starting from from_id
+    def read(self, from_id=1, limit=None):
+        end = self.watermark() if limit is None else min(self.watermark(), from_id - 1 + limit)
+        for msg_id in range(max(from_id, self.base_id), end + 1):
+            msg_dict = self.get(msg_id)
+            if msg_dict is None:
+                return
+            yield msg_dict
+
+    def first_id(self):
+        return self.base_id
+
+    def last_id(self):
+        return self.watermark()
+
+    # kept in memory only
+    def durable_last_id(self):
+        return self.watermark()
+
+    def bytes_stored(self):
+        return len(self.payloads) + sum(len(record.payload) for record in list(self.pending.values()))
+
+    # drop the prefix which is out of the retention limits, returns the new first id
+    def compact(self, max_messages=None, max_age_s=None, max_bytes=None):
+        count = 0
+        if max_messages is not None:
+            count = max(count, len(self.ts) - max_messages)
+        if max_bytes is not None and len(self.payloads) > max_bytes:
+            # offsets are ascending, the first entry which leaves at most max_bytes behind it
+            count = max(count, bisect.bisect_left(self.offsets, self.payload_base + len(self.payloads) - max_bytes))
+        if max_age_s is not None:
+            cutoff = time.time() - max_age_s
+            # the replication times only grow apart from the snapshot entries, which share one
+            while count < len(self.ts) and self.ts[count] < cutoff:
+                count += 1
+        if count <= 0:
+            return self.base_id
+        with self.lock:
+            count = min(count, len(self.ts))
+            payload_end = self.offsets[count] - self.payload_base if count < len(self.offsets) else len(self.payloads)
+            del self.ts[:count]
+            del self.w[:count]
+            del self.offsets[:count]
+            # deleting from the front of a bytearray only moves its start
+            del self.payloads[:payload_end]
+            self.payload_base += payload_end
+            self.base_id += count
+        return self.base_id
+
+
+"""
+Retention and snapshots
+
+The Compactor periodically drops the prefix of a log which is out of the retention limits (number of
+messages, age or bytes). It runs on its own thread and swaps the prefix out under a short lock, so appends
+are not blocked by it. On the Master it also keeps a snapshot for the Secondaries which have fallen behind
+the start of the log: the messages from the first retained id up to the id at which the snapshot was taken,
+as deflate-compressed binary frames of the replication wire format. A snapshot is taken once the log no
+longer starts right after the previous one.
+"""
+class Snapshot():
+
+    # constructor
+    def __init__(self, path, first_id, last_id):
+        self.path = path
+        self.first_id = first_id
+        self.last_id = last_id
+        self.size = os.path.getsize(path)
+
+
+class Compactor():
+
+    # constructor
+    def __init__(self, store, snapshot_dir=None, max_messages=None, max_age_s=None, max_bytes=None, interval_s=60):
+        self.store = store
+        self.snapshot_dir = snapshot_dir
+        self.max_messages = max_messages
+        self.max_age_s = max_age_s
+        self.max_bytes = max_bytes
+        self.interval = interval_s
+        self.snapshot = None
+        self.snapshot_lock = threading.Lock()
+        if snapshot_dir is not None:
+            os.makedirs(snapshot_dir, exist_ok=True)
+            self.load_snapshot()
+
+    # keep the newest snapshot which still belongs to the log
+    def load_snapshot(self):
+        for name in sorted(os.listdir(self.snapshot_dir), reverse=True):
+            path = os.path.join(self.snapshot_dir, name)
+            if self.snapshot is None and name.endswith('.snapshot'):
+                first_id, last_id = (int(value) for value in name[:-len('.snapshot')].split('-'))
+                if last_id <= self.store.last_id():
+                    self.snapshot = Snapshot(path, first_id, last_id)
+                    continue
+            os.remove(path)
+
+    def start(self):
+        if self.max_messages is None and self.max_age_s is None and self.max_bytes is None:
+            return
+        threading.Thread(target=self.loop, name="[Storage] Retention", daemon=True).start()
+
+    def loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run()
+            except Exception as e:
+                logging.error(f"[Storage] Retention. An exception of type {type(e).__name__} occurred. Arguments: {e.args}")
+
+    def run(self):
+        # a snapshot being taken for a catch-up reads the log from its first id, the compaction waits for it
+        with self.snapshot_lock:
+            first_id = self.store.compact(self.max_messages, self.max_age_s, self.max_bytes)
+        if self.snapshot_dir is not None and first_id > 1 and (self.snapshot is None or self.snapshot.last_id + 1 < first_id):
+            self.take_snapshot()
+
+    # snapshot the Secondaries behind the start of the log can be bootstrapped from, taken when there is none
+    def latest_snapshot(self):
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.last_id + 1 < self.store.first_id():
+            snapshot = self.take_snapshot()
+        return snapshot
+
+    def take_snapshot(self):
+        with self.snapshot_lock:
+            if self.snapshot is not None and self.snapshot.last_id + 1 >= self.store.first_id():
+                return self.snapshot
+            started = time.perf_counter()
+            first_id = self.store.first_id()
+            # only what survives a crash, the ids above it could be given to other messages after a restart
+            last_id = self.store.durable_last_id()
+            tmp_path = os.path.join(self.snapshot_dir, 'snapshot.tmp')
+            compressor = zlib.compressobj(1)
+            with open(tmp_path, 'wb') as snapshot_file:
+                for msg_dict in self.store.read(first_id, last_id - first_id + 1):
+                    payload = msg_dict["msg"].encode('utf-8')
+                    snapshot_file.write(compressor.compress(FRAME_HEADER.pack(msg_dict["id"], msg_dict.get("w") or 0, len(payload)) + payload))
+                snapshot_file.write(compressor.flush())
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            path = os.path.join(self.snapshot_dir, f'{first_id:020d}-{last_id:020d}.snapshot')
+            os.replace(tmp_path, path)
+            if self.snapshot is not None:
+                os.remove(self.snapshot.path)
+            self.snapshot = Snapshot(path, first_id, last_id)
+            logging.info(f'[Storage] Snapshot of messages {first_id}-{last_id} ({self.snapshot.size} bytes) has been taken in {time.perf_counter() - started:.3f}s')
+            return self.snapshot
+
+
+def open_store(storage_conf, base_path):
+    """
+    Create the storage engine configured in the Storage section of config.json
+    """
+    engine = storage_conf.get("engine", "memory")
+    if engine == "memory":
+        return MemoryStore()
+    if engine == "segment":
+        if storage_conf.get("fsync", "group") not in ("always", "group", "none"):
+            raise ValueError(f'Unknown fsync policy: {storage_conf.get("fsync")}')
+        return SegmentStore(
+                            os.path.join(base_path, storage_conf.get("path", "data")),
+                            fsync=storage_conf.get("fsync", "group"),
+                            group_commit_ms=storage_conf.get("group_commit_ms", 5),
+                            segment_max_bytes=storage_conf.get("segment_max_bytes", 64*1024*1024),
+                            index_interval_bytes=storage_conf.get("index_interval_bytes", 4096)
+                        )
+    raise ValueError(f'Unknown storage engine: {engine}')
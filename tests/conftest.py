@@ -0,0 +1,42 @@
+import os, sys, json, importlib, threading
+import pytest
+
+# the modules live next to master.py and secondary.py, not in a package
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(scope="session")
+def master(tmp_path_factory):
+    """
+    master.py reads its config on import, it gets a copy of config.json with an in-memory log
+    and everything it writes in a temporary directory. Nothing is started
+    """
+    with open(os.path.join(ROOT, 'config.json')) as json_file:
+        conf = json.load(json_file)
+    tmp_path = tmp_path_factory.mktemp("master")
+    conf["Storage"] = {"engine": "memory"}
+    conf["Retention"] = {"snapshot_path": str(tmp_path / "snapshots")}
+    conf["Server"]["write_timeout_ms"] = 200
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(conf))
+    os.environ["REPLICATED_LOG_CONFIG"] = str(config_path)
+    try:
+        module = importlib.import_module("master")
+    finally:
+        del os.environ["REPLICATED_LOG_CONFIG"]
+    # set by the __main__ block
+    module.debug = False
+    return module
+
+@pytest.fixture(scope="session")
+def server(master):
+    """
+    The threaded server of the Master on a free port, the replication workers and the failure detector are not started
+    """
+    master.open_logs()
+    httpd = master.ThreadedHTTPServer(('127.0.0.1', 0), master.SimpleHTTPRequestHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
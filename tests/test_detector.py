@@ -0,0 +1,72 @@
+import math
+import pytest
+from detector import PhiAccrualDetector
+
+def regular(detector, start, count, interval):
+    now = start
+    for i in range(count):
+        now += interval
+        detector.heartbeat(now)
+    return now
+
+# first moment at which phi reaches the threshold
+def time_to_phi(detector, now, threshold, step=0.01):
+    elapsed = 0
+    while detector.phi(now + elapsed) < threshold:
+        elapsed += step
+    return elapsed
+
+@pytest.fixture
+def detector():
+    detector = PhiAccrualDetector(0.2, window_size=100, min_std=0.1)
+    detector.last = 0
+    return detector
+
+def test_phi_grows_with_the_silence(detector):
+    now = regular(detector, 0, 100, 0.2)
+    values = [detector.phi(now + elapsed) for elapsed in (0, 0.1, 0.2, 0.4, 0.6, 1.0)]
+    assert values == sorted(values)
+    assert values[0] < 0.1
+    assert values[-1] > 8
+
+def test_phi_at_the_mean_interval(detector):
+    now = regular(detector, 0, 100, 0.2)
+    # half of the heartbeats come later than the mean, phi = -log10(0.5)
+    mean = sum(detector.intervals) / len(detector.intervals)
+    assert detector.phi(now + mean) == pytest.approx(math.log10(2), abs=0.01)
+
+def test_phi_is_finite_for_long_silences(detector):
+    now = regular(detector, 0, 10, 0.2)
+    assert math.isfinite(detector.phi(now + 3600))
+
+def test_a_node_which_never_answers_is_suspected(detector):
+    assert detector.phi(2) > 8
+
+def test_acceptable_pause_delays_the_suspicion():
+    strict = PhiAccrualDetector(0.2, min_std=0.1)
+    lenient = PhiAccrualDetector(0.2, min_std=0.1, acceptable_pause=1)
+    strict.last = lenient.last = 0
+    assert time_to_phi(lenient, 0, 8) == pytest.approx(time_to_phi(strict, 0, 8) + 1, abs=0.02)
+
+def test_heartbeats_out_of_order_are_ignored(detector):
+    now = regular(detector, 0, 10, 0.2)
+    count = len(detector.intervals)
+    detector.heartbeat(now - 0.1)
+    assert len(detector.intervals) == count
+    assert detector.last == now
+
+@pytest.mark.parametrize("outage", [10, 60])
+def test_an_outage_is_not_learned_above_max_phi(outage):
+    detector = PhiAccrualDetector(0.2, min_std=0.1, max_phi=3)
+    detector.last = 0
+    now = regular(detector, 0, 100, 0.2)
+    before = time_to_phi(detector, now, 8)
+    now = regular(detector, now + outage, 5, 0.2)
+    assert max(detector.intervals) < 1
+    assert time_to_phi(detector, now, 8) == pytest.approx(before, abs=0.02)
+
+def test_an_outage_is_learned_without_max_phi(detector):
+    now = regular(detector, 0, 100, 0.2)
+    before = time_to_phi(detector, now, 8)
+    now = regular(detector, now + 10, 5, 0.2)
+    assert time_to_phi(detector, now, 8) > 2 * before
@@ -0,0 +1,54 @@
+import json
+from fanout import FanOut, Subscription
+from storage import MemoryStore
+
+def message(msg_id, replicated_ts=None):
+    return {"id": msg_id, "msg": f"m{msg_id}", "w": 1, "replicated_ts": replicated_ts}
+
+def ids(messages):
+    return [msg_dict["id"] for msg_dict in messages]
+
+def test_groups_published_ahead_of_a_gap_wait_for_it():
+    fanout = FanOut()
+    fanout.publish([message(3), message(4)])
+    fanout.publish([message(6)])
+    assert fanout.last_id() == 0
+    fanout.publish([message(1), message(2)])
+    assert fanout.last_id() == 4
+    assert ids(fanout.read(1, 10)) == [1, 2, 3, 4]
+    fanout.publish([message(5)])
+    assert ids(fanout.read(1, 10)) == [1, 2, 3, 4, 5, 6]
+    assert fanout.early == {}
+
+def test_stamp_updates_buffered_and_early_messages():
+    fanout = FanOut()
+    fanout.publish([message(1), message(2)])
+    fanout.publish([message(4)])
+    sent = fanout.read(1, 1)[0]
+    fanout.stamp(2, 4, 123.5)
+    assert [msg_dict["replicated_ts"] for msg_dict in fanout.read(1, 10)] == [None, 123.5]
+    # the entries are replaced, the ones already handed out do not change under a subscriber
+    fanout.stamp(1, 1, 99.0)
+    assert sent["replicated_ts"] is None
+    fanout.publish([message(3)])
+    assert [msg_dict["replicated_ts"] for msg_dict in fanout.read(1, 10)] == [99.0, 123.5, None, 123.5]
+
+def test_buffer_is_trimmed_to_its_capacity():
+    fanout = FanOut(capacity=2)
+    for msg_id in range(1, 6):
+        fanout.publish([message(msg_id)])
+    assert fanout.read(1, 10) is None
+    assert ids(fanout.read(4, 10)) == [4, 5]
+
+def test_subscriber_behind_the_buffer_reads_the_log():
+    store = MemoryStore()
+    messages = [{"msg": f"m{i}", "w": 1, "replicated_ts": None} for i in range(1, 6)]
+    store.append_batch(messages)
+    fanout = FanOut(capacity=1)
+    for msg_dict in messages:
+        fanout.publish([msg_dict])
+    subscription = Subscription(fanout, store, 1, 'ndjson', batch_messages=10)
+    chunks = subscription.poll()
+    assert [json.loads(chunk)["id"] for chunk in chunks if chunk] == [1, 2, 3, 4, 5]
+    assert subscription.next_id == 6
+    assert subscription.poll() == []
@@ -0,0 +1,14 @@
+import requests
+
+def test_health_follows_the_membership(master, server, monkeypatch):
+    monkeypatch.setitem(master.secondary_statuses, 1, "Healthy")
+    monkeypatch.setitem(master.secondary_statuses, 2, "Healthy")
+    body = requests.get(f'{server}/health').text
+    assert "Secondary #1" in body and "Secondary #2" in body
+    # the same statuses for another set of secondaries
+    monkeypatch.setattr(master, "secondary_hosts", [dict(master.secondary_hosts[0], name="Renamed #1"), master.secondary_hosts[1]])
+    body = requests.get(f'{server}/health').text
+    assert "Renamed #1" in body and "Secondary #1" not in body
+    monkeypatch.setattr(master, "secondary_hosts", master.secondary_hosts[:1])
+    body = requests.get(f'{server}/health').text
+    assert "Secondary #2" not in body
@@ -0,0 +1,26 @@
+import threading
+from metrics import Counter, Histogram, Registry
+
+def run_threads(count, target):
+    for i in range(count):
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+
+def test_finished_threads_are_folded_without_a_scrape():
+    counter = Counter("test_requests_total", "Requests", registry=Registry())
+    run_threads(200, counter.inc)
+    values = counter.labels().values
+    # only the shard of the last thread is left
+    assert len(values.shards) == 1
+    assert values.snapshot() == [200]
+
+def test_values_of_every_thread_are_summed():
+    histogram = Histogram("test_latency_seconds", "Latency", ["w"], buckets=(0.1, 1), registry=Registry())
+    threads = [threading.Thread(target=lambda: [histogram.labels(1).observe(0.5) for i in range(100)]) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    histogram.labels(1).observe(2)
+    assert 'test_latency_seconds_count{w="1"} 401' in histogram.render()
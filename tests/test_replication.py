@@ -0,0 +1,174 @@
+import itertools
+import pytest
+from wire import decode_batch, encode_acks, CONTIGUOUS_ID_HEADER
+
+logs = itertools.count()
+
+class Response():
+
+    # constructor
+    def __init__(self, headers=None, content=b'', status_code=200):
+        self.headers = headers or {}
+        self.content = content
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        pass
+
+class Secondary():
+    """
+    Session of a Secondary which stores everything it is sent
+    """
+
+    # constructor
+    def __init__(self, contiguous_id=0):
+        self.contiguous_id = contiguous_id
+        self.received = []
+
+    def get(self, url, timeout=None):
+        return Response({CONTIGUOUS_ID_HEADER: str(self.contiguous_id)})
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        messages = decode_batch(headers.get('Content-Type'), headers.get('Content-Encoding'), data)
+        self.received += [msg_dict["id"] for msg_dict in messages]
+        body, content_type = encode_acks([msg_dict["id"] for msg_dict in messages], headers.get('Content-Type'))
+        return Response({'Content-Type': content_type}, body)
+
+class Detector():
+
+    def heartbeat(self, secondary_id):
+        pass
+
+@pytest.fixture
+def log(master):
+    return master.PartitionLog(f"replication-{next(logs)}", 0)
+
+@pytest.fixture
+def secondary(master, monkeypatch):
+    session = Secondary()
+    monkeypatch.setitem(master.secondary_sessions, 1, session)
+    monkeypatch.setattr(master, "failure_detector", Detector())
+    return session
+
+def worker_of(log, **replication_conf):
+    worker = log.workers[1]
+    worker.configure(dict({"backlog_max_messages": 4, "backlog_max_bytes": 1 << 20}, **replication_conf))
+    return worker
+
+def append(log, count, size=1):
+    msg_dicts = [{"msg": "x" * size, "replicated_ts": None, "w": 2} for i in range(count)]
+    log.store.append_batch(msg_dicts)
+    return msg_dicts
+
+def test_messages_over_the_limit_are_spilled_as_ranges(master, log):
+    worker = worker_of(log)
+    latch = master.CountDownLatch(10)
+    for msg_dict in append(log, 10):
+        worker.submit(msg_dict, latch)
+    assert sorted(worker.pending) == [1, 2, 3, 4]
+    assert (worker.backlog_messages, worker.backlog_bytes) == (4, 4)
+    assert worker.queue.qsize() == 4
+    # only the ids of the overflowed messages are kept, consecutive ones of one write share a range
+    assert list(worker.spilled) == [[5, 10, latch]]
+    assert worker.overflowing
+
+def test_ack_through_counts_down_pending_and_spilled(master, log):
+    worker = worker_of(log)
+    latch = master.CountDownLatch(10)
+    for msg_dict in append(log, 10):
+        worker.submit(msg_dict, latch)
+    # a range is resolved only once the secondary has all of it
+    worker.ack_through(7)
+    assert latch.count == 6
+    assert worker.pending == {}
+    assert (worker.backlog_messages, worker.backlog_bytes) == (0, 0)
+    assert list(worker.spilled) == [[5, 10, latch]]
+    worker.ack_through(10)
+    assert latch.count == 0
+    assert not worker.spilled
+
+def test_backlog_takes_messages_again_at_half_of_the_limits(master, log):
+    worker = worker_of(log)
+    latch = master.CountDownLatch(8)
+    msg_dicts = append(log, 8)
+    for msg_dict in msg_dicts[:5]:
+        worker.submit(msg_dict, latch)
+    assert worker.overflowing
+    worker.ack([1])
+    # below the limit but not below half of it
+    assert worker.has_room()
+    worker.submit(msg_dicts[5], latch)
+    assert 6 not in worker.pending
+    worker.ack([2, 3])
+    worker.submit(msg_dicts[6], latch)
+    assert 7 in worker.pending
+    assert not worker.overflowing
+    assert list(worker.spilled) == [[5, 6, latch]]
+
+def test_byte_limit(master, log):
+    worker = worker_of(log, backlog_max_bytes=100)
+    latch = master.CountDownLatch(3)
+    for msg_dict in append(log, 3, size=60):
+        worker.submit(msg_dict, latch)
+    assert sorted(worker.pending) == [1, 2]
+    assert worker.backlog_bytes == 120
+    assert list(worker.spilled) == [[3, 3, latch]]
+
+def test_spilled_ranges_are_capped(master, log):
+    worker = worker_of(log, backlog_max_messages=2)
+    latches = [master.CountDownLatch(1) for i in range(6)]
+    for msg_dict, latch in zip(append(log, 6), latches):
+        worker.submit(msg_dict, latch)
+    # the writes of 3 and 4 are no longer followed on this secondary
+    assert [item[:2] for item in worker.spilled] == [[5, 5], [6, 6]]
+    worker.ack_through(6)
+    assert [latch.count for latch in latches] == [0, 0, 1, 1, 0, 0]
+
+def test_resync_drops_the_queue(master, log):
+    worker = worker_of(log, backlog_policy="resync")
+    latch = master.CountDownLatch(5)
+    for msg_dict in append(log, 5):
+        worker.submit(msg_dict, latch)
+    assert worker.queue.qsize() == 0
+    assert worker.pending == {}
+    assert (worker.backlog_messages, worker.backlog_bytes) == (0, 0)
+    assert sorted(item[:2] for item in worker.spilled) == [[1, 4], [5, 5]]
+    worker.ack_through(5)
+    assert latch.count == 0
+
+def test_catchup_resolves_the_spilled_writes(master, log, secondary):
+    worker = worker_of(log)
+    latch = master.CountDownLatch(10)
+    for msg_dict in append(log, 10):
+        worker.submit(msg_dict, latch)
+    worker.catchup()
+    assert secondary.received == list(range(1, 11))
+    assert latch.count == 0
+    assert worker.pending == {} and not worker.spilled
+    assert worker.backlog_messages == 0
+
+def test_catchup_starts_after_the_contiguous_id(master, log, secondary):
+    worker = worker_of(log)
+    latch = master.CountDownLatch(10)
+    for msg_dict in append(log, 10):
+        worker.submit(msg_dict, latch)
+    secondary.contiguous_id = 6
+    worker.catchup()
+    assert secondary.received == [7, 8, 9, 10]
+    assert latch.count == 0
+
+def test_full_backlogs_refuse_the_write_concern(master, log, monkeypatch):
+    monkeypatch.setattr(master, "secondary_hosts", [{"id": 1, "name": "Secondary #1"}, {"id": 2, "name": "Secondary #2"}])
+    worker = worker_of(log, backlog_max_messages=2)
+    log.workers[2].configure({"backlog_max_messages": 2})
+    assert master.ready_secondaries({log}) == 2
+    latch = master.CountDownLatch(2)
+    for msg_dict in append(log, 2):
+        worker.submit(msg_dict, latch)
+    assert master.ready_secondaries({log}) == 1
+    # every partition of the write needs room
+    other = master.PartitionLog(f"replication-{next(logs)}", 0)
+    assert master.ready_secondaries({other}) == 2
+    assert master.ready_secondaries({log, other}) == 1
+    worker.ack([1])
+    assert master.ready_secondaries({log}) == 2
@@ -0,0 +1,57 @@
+from storage import SecondaryLog
+
+def message(msg_id, text=None, w=2):
+    return {"id": msg_id, "msg": text if text is not None else f"m{msg_id}", "w": w}
+
+def test_secondary_log_in_order():
+    log = SecondaryLog()
+    assert log.insert_batch([message(1), message(2)], 10.0) == [True, True]
+    assert log.watermark() == 2
+    assert [msg_dict["msg"] for msg_dict in log.read()] == ["m1", "m2"]
+    assert log.get(2) == {"id": 2, "msg": "m2", "w": 2, "replicated_ts": 10.0}
+
+def test_secondary_log_gap_holds_back_the_watermark():
+    log = SecondaryLog()
+    log.insert(message(1), 1.0)
+    log.insert(message(3), 1.0)
+    log.insert(message(4), 1.0)
+    assert log.watermark() == 1
+    assert log.last_id() == 1
+    assert [msg_dict["id"] for msg_dict in log.read()] == [1]
+    assert log.get(3) is None
+    log.insert(message(2), 1.0)
+    assert log.watermark() == 4
+    assert [msg_dict["id"] for msg_dict in log.read()] == [1, 2, 3, 4]
+    assert log.pending == {}
+
+def test_secondary_log_duplicates():
+    log = SecondaryLog()
+    assert log.insert(message(1), 1.0)
+    assert log.insert(message(3), 1.0)
+    # visible, waiting for the gap and within one batch
+    assert log.insert_batch([message(1), message(3), message(2), message(2)], 1.0) == [False, False, True, False]
+    assert log.watermark() == 3
+
+def test_secondary_log_unicode_payloads():
+    log = SecondaryLog()
+    log.insert_batch([message(1, "ünïcödé"), message(2, ""), message(3, "日本")], 1.0)
+    assert [msg_dict["msg"] for msg_dict in log.read()] == ["ünïcödé", "", "日本"]
+
+def test_secondary_log_snapshot_keeps_pending_above_it():
+    log = SecondaryLog()
+    log.insert_batch([message(1), message(7), message(9)], 1.0)
+    log.install_snapshot(5, [{"msg": "s5", "w": 3}, {"msg": "s6", "w": 3}], 2.0)
+    assert (log.first_id(), log.watermark()) == (5, 7)
+    assert [msg_dict["msg"] for msg_dict in log.read()] == ["s5", "s6", "m7"]
+    assert log.insert(message(8), 3.0)
+    assert log.watermark() == 9
+
+def test_secondary_log_compact():
+    log = SecondaryLog()
+    log.insert_batch([message(i) for i in range(1, 11)], 1.0)
+    assert log.compact(max_messages=4) == 7
+    assert [msg_dict["id"] for msg_dict in log.read()] == [7, 8, 9, 10]
+    assert log.contains(3)
+    assert log.insert(message(3), 1.0) is False
+    assert log.insert(message(11), 1.0)
+    assert log.get(11)["msg"] == "m11"
@@ -0,0 +1,144 @@
+import os, time
+import pytest
+from storage import SegmentStore, RECORD_HEADER
+
+def append(store, *texts):
+    msg_dicts = [{"msg": text, "replicated_ts": None, "w": 3} for text in texts]
+    store.append_batch(msg_dicts)
+    return [msg_dict["id"] for msg_dict in msg_dicts]
+
+def texts(store, from_id=1, limit=None):
+    return [msg_dict["msg"] for msg_dict in store.read(from_id, limit)]
+
+def last_segment_path(dir_path):
+    return os.path.join(dir_path, sorted(name for name in os.listdir(dir_path) if name.endswith('.log'))[-1])
+
+def reopen(store, **kwargs):
+    store.close()
+    return SegmentStore(store.dir_path, fsync="none", **kwargs)
+
+@pytest.fixture
+def store(tmp_path):
+    return SegmentStore(str(tmp_path / "log"), fsync="none")
+
+def test_append_and_read(store):
+    assert append(store, "a", "b") == [1, 2]
+    assert append(store, "c") == [3]
+    assert texts(store) == ["a", "b", "c"]
+    assert texts(store, 2, 1) == ["b"]
+    assert store.get(3)["msg"] == "c"
+    assert store.get(4) is None
+    assert (store.first_id(), store.last_id()) == (1, 3)
+
+def test_recover_after_restart(store):
+    append(store, "a", "b", "c")
+    store.set_replicated_ts(2, 1700000000.5)
+    store = reopen(store)
+    assert store.last_id() == 3
+    assert [msg_dict["replicated_ts"] for msg_dict in store.read()] == [None, 1700000000.5, None]
+    assert append(store, "d") == [4]
+    assert texts(store) == ["a", "b", "c", "d"]
+
+def test_recover_several_segments_with_index(tmp_path):
+    store = SegmentStore(str(tmp_path / "log"), fsync="none", segment_max_bytes=256, index_interval_bytes=64)
+    append(store, *[f"message {i}" for i in range(1, 41)])
+    assert len(store.segments) > 1
+    store = reopen(store, segment_max_bytes=256, index_interval_bytes=64)
+    assert store.last_id() == 40
+    assert texts(store) == [f"message {i}" for i in range(1, 41)]
+    assert texts(store, 27, 3) == ["message 27", "message 28", "message 29"]
+    assert append(store, "next") == [41]
+
+def test_recover_truncates_torn_tail(store):
+    append(store, "a", "b", "c")
+    path = last_segment_path(store.dir_path)
+    store.close()
+    size = os.path.getsize(path)
+    # the last record was only partly written
+    os.truncate(path, size - 1)
+    store = SegmentStore(store.dir_path, fsync="none")
+    assert store.last_id() == 2
+    assert texts(store) == ["a", "b"]
+    assert os.path.getsize(path) < size - 1
+    assert append(store, "c again") == [3]
+    assert texts(reopen(store)) == ["a", "b", "c again"]
+
+def test_recover_truncates_partial_header(store):
+    append(store, "a", "b")
+    path = last_segment_path(store.dir_path)
+    store.close()
+    size = os.path.getsize(path)
+    with open(path, 'ab') as segment_file:
+        segment_file.write(b'\x05' * (RECORD_HEADER.size - 1))
+    store = SegmentStore(store.dir_path, fsync="none")
+    assert store.last_id() == 2
+    assert os.path.getsize(path) == size
+
+def test_recover_stops_at_crc_mismatch(store):
+    append(store, "first", "second", "third")
+    path = last_segment_path(store.dir_path)
+    store.close()
+    # corrupt the payload of the second record
+    with open(path, 'r+b') as segment_file:
+        data = segment_file.read()
+        offset = data.index(b'second')
+        segment_file.seek(offset)
+        segment_file.write(b'SECOND')
+    store = SegmentStore(store.dir_path, fsync="none")
+    assert store.last_id() == 1
+    assert texts(store) == ["first"]
+    assert append(store, "x") == [2]
+
+def test_compact_removes_old_segments(tmp_path):
+    store = SegmentStore(str(tmp_path / "log"), fsync="none", segment_max_bytes=256)
+    append(store, *[f"message {i}" for i in range(1, 41)])
+    first_id = store.compact(max_messages=10)
+    assert 1 < first_id <= 31
+    assert store.first_id() == first_id
+    assert texts(store)[0] == f"message {first_id}"
+    # a read before the start of the log starts at the first retained message
+    assert next(store.read(1))["id"] == first_id
+
+def test_on_durable_group_commit(tmp_path):
+    store = SegmentStore(str(tmp_path / "log"), fsync="group", group_commit_ms=1)
+    durable = []
+    position = store.append_batch([{"msg": "a", "replicated_ts": None, "w": 1}])
+    store.on_durable(position, lambda: durable.append(position))
+    store.sync(position)
+    assert store.durable >= position
+    # the callbacks run on the group commit thread right after the fsync
+    for i in range(100):
+        if durable:
+            break
+        time.sleep(0.01)
+    assert durable == [position]
+
+def test_durable_last_id_follows_the_fsync(tmp_path):
+    store = SegmentStore(str(tmp_path / "log"), fsync="group", group_commit_ms=1000)
+    position = store.append_batch([{"msg": "a", "replicated_ts": None, "w": 1}])
+    # written and readable, but not on disk yet
+    assert store.last_id() == 1
+    assert store.durable_last_id() == 0
+    with store.durable_condition:
+        store.durable_condition.notify_all()
+    store.sync(position)
+    assert store.durable_last_id() == 1
+
+@pytest.mark.parametrize("fsync", ["always", "none"])
+def test_durable_last_id_without_group_commit(tmp_path, fsync):
+    store = SegmentStore(str(tmp_path / "log"), fsync=fsync)
+    append(store, "a", "b")
+    assert store.durable_last_id() == 2
+    assert SegmentStore(store.dir_path, fsync=fsync).durable_last_id() == 2
+
+def test_durable_callbacks_run_before_sync_returns(tmp_path):
+    store = SegmentStore(str(tmp_path / "log"), fsync="group", group_commit_ms=1)
+    published = []
+    for i in range(20):
+        position = store.append_batch([{"msg": str(i), "replicated_ts": None, "w": 1}])
+        store.on_durable(position, lambda i=i: published.append(i))
+        store.sync(position)
+        assert published[-1] == i
+    # registered once the record is on disk, the callback runs right away
+    store.on_durable(position, lambda: published.append("late"))
+    assert published[-1] == "late"
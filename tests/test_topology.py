@@ -0,0 +1,87 @@
+import copy, json
+import pytest
+from topology import Topology, ClusterConfig, ConfigError
+
+CONF = {
+    "Hosts": [
+        {"name": "Master", "type": "master", "hostname": "localhost", "port": 8080},
+        {"name": "Secondary #1", "type": "secondary", "id": 1, "hostname": "localhost", "port": 8081, "active": 1},
+        {"name": "Secondary #2", "type": "secondary", "id": 2, "hostname": "localhost", "port": 8082, "active": 0}
+    ],
+    "Replication": {"backlog_policy": "spill", "wire_format": "binary", "compression": "zstd"},
+    "Heartbeat": {"phi_suspect": 3, "phi_unhealthy": 8},
+    "Topics": {"orders": {"partitions": 4}}
+}
+
+def changed(update):
+    conf = copy.deepcopy(CONF)
+    update(conf)
+    return conf
+
+def test_valid_config():
+    topology = Topology(copy.deepcopy(CONF))
+    assert topology.master["port"] == 8080
+    assert [host["id"] for host in topology.secondaries] == [1]
+    assert topology.secondary(2)["name"] == "Secondary #2"
+    assert topology.secondary(3) is None
+    assert topology.section("Topics")["orders"]["partitions"] == 4
+    with pytest.raises(KeyError):
+        topology.section("Storage")
+
+def test_topology_is_read_only():
+    topology = Topology(copy.deepcopy(CONF))
+    with pytest.raises(TypeError):
+        topology.section("Replication")["backlog_policy"] = "reject"
+    assert isinstance(topology.hosts, tuple)
+
+@pytest.mark.parametrize("update", [
+    lambda conf: conf.pop("Hosts"),
+    lambda conf: conf.update(Hosts=[]),
+    lambda conf: conf["Hosts"].append("localhost:8083"),
+    lambda conf: conf["Hosts"][1].update(type="replica"),
+    lambda conf: conf["Hosts"][1].update(port=70000),
+    lambda conf: conf["Hosts"][1].update(port="8081"),
+    lambda conf: conf["Hosts"][1].update(port=True),
+    lambda conf: conf["Hosts"][2].update(id=1),
+    lambda conf: conf["Hosts"][2].update(id="2"),
+    lambda conf: conf["Hosts"][2].pop("hostname"),
+    lambda conf: conf["Hosts"][2].update(name="Secondary #1"),
+    lambda conf: conf["Hosts"][1].update(type="master"),
+    lambda conf: conf["Hosts"].pop(0),
+    lambda conf: conf["Replication"].update(backlog_policy="drop"),
+    lambda conf: conf["Replication"].update(wire_format="msgpack"),
+    lambda conf: conf["Replication"].update(compression="lz4"),
+    lambda conf: conf.update(Server={"mode": "forking"}),
+    lambda conf: conf.update(Read={"routing": "anycast"}),
+    lambda conf: conf["Heartbeat"].update(phi_suspect=8),
+    lambda conf: conf["Topics"]["orders"].update(partitions=0),
+    lambda conf: conf["Topics"]["orders"].update(partitions="4"),
+])
+def test_invalid_config_is_rejected(update):
+    with pytest.raises(ConfigError):
+        Topology(changed(update))
+
+def test_not_an_object_is_rejected():
+    with pytest.raises(ConfigError):
+        Topology([CONF])
+
+def test_changed_keys():
+    old = Topology(copy.deepcopy(CONF))
+    new = Topology(changed(lambda conf: conf["Replication"].update(compression="none", max_in_flight=2)))
+    assert old.changed(new, "Replication", ("max_in_flight", "wire_format")) == ["Replication.max_in_flight"]
+    assert old.changed(new, "Connection", ("pool_size",)) == []
+
+def test_reload_keeps_the_current_config_when_invalid(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(CONF))
+    cluster_config = ClusterConfig(str(path))
+    reloads = []
+    cluster_config.on_reload(lambda old, new: reloads.append((old, new)))
+    path.write_text("{")
+    assert not cluster_config.reload("test")
+    path.write_text(json.dumps(changed(lambda conf: conf["Hosts"][2].update(active=1))))
+    assert not reloads
+    assert cluster_config.reload("test")
+    old, new = reloads[0]
+    assert len(old.secondaries) == 1 and len(new.secondaries) == 2
+    assert cluster_config.topology is new
@@ -0,0 +1,96 @@
+import pytest
+from tabulate import tabulate
+from views import GridTable, LogView, CachedView, LOG_HEADERS, LOG_NUMERIC, format_row, make_etag, etag_matches
+
+ROWS = [
+    {"id": 1, "msg": "first", "w": 3, "replicated_ts": "2026-01-01 00:00:00.000000"},
+    {"id": 2, "msg": "a longer message", "w": 1, "replicated_ts": "NOT REPLICATED"},
+    {"id": 10, "msg": "two\nlines", "w": 2, "replicated_ts": "NOT REPLICATED"},
+]
+
+def grid(rows):
+    table = GridTable(LOG_HEADERS, LOG_NUMERIC)
+    for row in rows:
+        table.append(row)
+    return table
+
+def test_same_layout_as_tabulate_for_text_messages():
+    assert grid(ROWS).render() == tabulate(ROWS, headers="keys", tablefmt="simple_grid")
+
+def test_wide_characters():
+    rows = [dict(ROWS[0], msg="日本語のメッセージ")]
+    assert grid(rows).render() == tabulate(rows, headers="keys", tablefmt="simple_grid")
+
+def test_numeric_looking_messages_are_shown_as_sent():
+    # tabulate would right-align the column and show 1.5
+    table = grid([dict(ROWS[0], msg="1.50"), dict(ROWS[1], msg="10")])
+    lines = table.render().split('\n')
+    assert lines[3] == '│    1 │ 1.50  │   3 │ 2026-01-01 00:00:00.000000 │'
+    assert lines[5] == '│    2 │ 10    │   1 │ NOT REPLICATED             │'
+
+def test_header_of_an_empty_numeric_column_is_right_aligned():
+    table = grid([dict(ROWS[1], w=None)])
+    assert table.render().split('\n')[1] == '│   id │ msg              │   w │ replicated_ts   │'
+
+def test_rows_are_kept_until_a_column_widens():
+    table = grid(ROWS[:2])
+    table.render()
+    blocks = list(table.blocks)
+    table.append(ROWS[2])
+    table.render()
+    assert table.blocks[:2] == blocks
+    table.append(dict(ROWS[0], id=11, msg="a message wider than every other one"))
+    assert table.blocks == []
+    assert table.render() == tabulate(ROWS + [dict(ROWS[0], id=11, msg="a message wider than every other one")], headers="keys", tablefmt="simple_grid")
+
+def test_truncate_narrows_the_columns():
+    table = grid(ROWS[:1])
+    expected = table.render()
+    table.append(dict(ROWS[1], msg="a message wider than every other one"))
+    table.truncate(1)
+    assert len(table) == 1
+    assert table.render() == expected
+
+def test_format_row():
+    assert format_row({"id": 1, "msg": "a", "w": 2, "replicated_ts": 0})["replicated_ts"] == "1970-01-01 00:00:00.000000"
+    assert format_row({"id": 1, "msg": "a", "w": 2, "replicated_ts": None})["replicated_ts"] == "NOT REPLICATED"
+
+def test_etags():
+    etag = make_etag("body")
+    assert etag == make_etag("body") != make_etag("other body")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"x", W/{etag}', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"x"', etag)
+
+def test_cached_view_renders_once_per_version():
+    view = CachedView()
+    renders = []
+    def render():
+        renders.append(1)
+        return f"body {len(renders)}"
+    assert view.get(1, render) == view.get(1, render)
+    assert view.get(2, render)[0] == "body 2"
+    assert len(renders) == 2
+
+def test_log_view_pages():
+    messages = [{"id": i, "msg": f"m{i}", "w": 1, "replicated_ts": None} for i in range(1, 8)]
+    read = lambda from_id, limit: messages[from_id - 1:from_id - 1 + limit]
+    final = lambda msg_dict: msg_dict["replicated_ts"] is not None
+    view = LogView(max_pages=2)
+    body, etag = view.get(1, 5, 1, 7, read, final)
+    assert body.startswith('The replication log:\n')
+    assert 'Showing messages 1-5 of 7' in body
+    assert view.get(1, 5, 1, 7, read, final) == (body, etag)
+    # the rows which are not final are read again once the generation changes
+    messages[0]["replicated_ts"] = 0
+    assert view.get(1, 5, 1, 7, read, final) == (body, etag)
+    view.touch()
+    body, etag = view.get(1, 5, 1, 7, read, final)
+    assert '1970-01-01 00:00:00.000000' in body
+    assert view.pages[(1, 5)].final_rows == 1
+    view.get(3, 5, 1, 7, read)
+    view.get(5, 5, 1, 7, read)
+    assert list(view.pages) == [(3, 5), (5, 5)]
+    assert LogView().get(1, 5, 1, 0, read)[0] == 'The replication log is empty\n'
@@ -0,0 +1,73 @@
+import pytest
+from wire import encode_batch, decode_batch, encode_acks, decode_acks, negotiate, capabilities, ENCODINGS, WireFormatError, FRAME_HEADER, BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE
+
+MESSAGES = [
+    {"id": 1, "msg": "first", "w": 3},
+    {"id": 2, "msg": "", "w": 1},
+    {"id": 2 ** 40, "msg": "ünïcödé 日本 " * 50, "w": 0},
+]
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_binary_round_trip(encoding):
+    data, headers = encode_batch(MESSAGES, 'binary', encoding)
+    assert headers['Content-Type'] == BINARY_CONTENT_TYPE
+    assert headers.get('Content-Encoding', 'identity') == encoding
+    assert decode_batch(headers['Content-Type'], headers.get('Content-Encoding'), data) == MESSAGES
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_small_batches_are_not_compressed(encoding):
+    data, headers = encode_batch(MESSAGES[:1], 'binary', encoding, min_bytes=4096)
+    assert 'Content-Encoding' not in headers
+    assert decode_batch(headers['Content-Type'], None, data) == MESSAGES[:1]
+
+def test_json_round_trip():
+    data, headers = encode_batch(MESSAGES, 'json', 'deflate')
+    assert headers == {'Content-Type': JSON_CONTENT_TYPE}
+    assert decode_batch(headers['Content-Type'], None, data) == MESSAGES
+    # a request without a content type is JSON
+    assert decode_batch(None, None, data) == MESSAGES
+
+def test_missing_w_is_sent_as_zero():
+    data, headers = encode_batch([{"id": 5, "msg": "x"}], 'binary')
+    assert decode_batch(headers['Content-Type'], None, data) == [{"id": 5, "msg": "x", "w": 0}]
+
+def test_truncated_frames_are_rejected():
+    data, headers = encode_batch(MESSAGES[:1], 'binary')
+    with pytest.raises(WireFormatError):
+        decode_batch(BINARY_CONTENT_TYPE, None, data[:FRAME_HEADER.size - 1])
+    with pytest.raises(WireFormatError):
+        decode_batch(BINARY_CONTENT_TYPE, None, data[:-1])
+
+def test_unsupported_content_is_rejected():
+    with pytest.raises(WireFormatError):
+        decode_batch('text/plain', None, b'')
+    with pytest.raises(WireFormatError):
+        decode_batch(BINARY_CONTENT_TYPE, 'br', b'')
+    with pytest.raises(WireFormatError):
+        decode_batch(BINARY_CONTENT_TYPE, 'deflate', b'not deflate')
+
+@pytest.mark.parametrize("body", [b'{"messages": [', b'\xff', b'{"acks": []}', b'[]'])
+def test_malformed_json_is_rejected(body):
+    with pytest.raises(WireFormatError):
+        decode_batch(JSON_CONTENT_TYPE, None, body)
+
+def test_invalid_utf8_is_rejected():
+    data = FRAME_HEADER.pack(1, 1, 2) + b'\xc3\x28'
+    with pytest.raises(WireFormatError):
+        decode_batch(BINARY_CONTENT_TYPE, None, data)
+
+@pytest.mark.parametrize("content_type", [BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE])
+def test_acks_round_trip(content_type):
+    acks = [1, 2, 2 ** 40]
+    body, ack_content_type = encode_acks(acks, content_type)
+    assert ack_content_type == content_type
+    assert decode_acks(ack_content_type, body) == acks
+
+def test_negotiate():
+    assert negotiate(capabilities(), 'binary', 'zlib') == ('binary', 'deflate')
+    assert negotiate(capabilities(), 'binary', 'none') == ('binary', 'identity')
+    assert negotiate(capabilities(), 'json', 'zstd') == ('json', 'identity')
+    # a Secondary which announces nothing gets JSON
+    assert negotiate({}, 'binary', 'zstd') == ('json', 'identity')
+    # zstd falls back to deflate when the Secondary has no zstandard
+    assert negotiate({'X-Replication-Formats': 'binary, json', 'X-Replication-Encodings': 'deflate, identity'}, 'binary', 'zstd') == ('binary', 'deflate')
@@ -0,0 +1,143 @@
+import json, threading, time
+import pytest
+import requests
+from storage import MemoryStore
+from fanout import FanOut
+from views import LogView
+
+class Log():
+    """
+    Partition with only what a write token stamps
+    """
+
+    # constructor
+    def __init__(self, name):
+        self.name = name
+        self.store = MemoryStore()
+        self.fanout = FanOut(0, 100)
+        self.view = LogView()
+
+    def append(self, count):
+        msg_dicts = [{"msg": str(i), "replicated_ts": None, "w": 3} for i in range(count)]
+        position = self.store.append_batch(msg_dicts)
+        self.fanout.publish([dict(msg_dict) for msg_dict in msg_dicts])
+        return (self, msg_dicts, position)
+
+def post(server, msg, w, **options):
+    response = requests.post(server, json=dict({"msg": msg, "w": w}, **options))
+    msg_id = int(response.text.split("msg_id = ")[1].split(",")[0])
+    return response, msg_id
+
+def ack(master, msg_id, *secondary_ids):
+    for secondary_id in secondary_ids:
+        master.logs["default-0"].workers[secondary_id].ack([msg_id])
+
+def read(server, msg_id):
+    return requests.get(f'{server}/log', params={"from_id": msg_id, "limit": 1}).json()["entries"][0]
+
+def test_token_completes_at_the_write_concern(master):
+    log = Log("a-0")
+    token = master.WriteToken([log.append(2)], 3)
+    assert token.status()["done"] is False
+    token.count_down()
+    assert token.replicated_ts is None
+    token.count_down()
+    status = token.status()
+    assert (status["replicas"], status["done"], status["logs"]) == (3, True, {"a-0": [1, 2]})
+    assert status["replicated_ts"] == token.replicated_ts is not None
+    assert [msg_dict["replicated_ts"] for msg_dict in log.store.read()] == [token.replicated_ts] * 2
+    # the subscribers which join later get the buffered messages with the timestamp
+    assert [msg_dict["replicated_ts"] for msg_dict in log.fanout.read(1, 10)] == [token.replicated_ts] * 2
+
+def test_token_with_w_1_is_done_at_once(master):
+    log = Log("a-0")
+    token = master.WriteToken([log.append(1)], 1)
+    assert token.status()["done"]
+    assert log.store.get(1)["replicated_ts"] == token.replicated_ts
+
+def test_group_latch_counts_a_write_across_partitions(master):
+    first, second = Log("a-0"), Log("a-1")
+    appended = [first.append(2), second.append(1)]
+    token = master.WriteToken(appended, 2)
+    # one latch per secondary for the 3 messages of both partitions
+    latch = master.GroupLatch(3, token)
+    latch.count_down()
+    latch.count_down()
+    assert token.replicas == 1
+    latch.count_down()
+    assert token.replicas == 2
+    latch.count_down()
+    assert token.replicas == 2
+    assert first.store.get(2)["replicated_ts"] == second.store.get(1)["replicated_ts"] == token.replicated_ts
+
+def test_token_wait(master):
+    token = master.WriteToken([Log("a-0").append(1)], 2)
+    assert not token.wait(2, 0.01)
+    threading.Timer(0.05, token.count_down).start()
+    assert token.wait(2, 5)
+
+def test_expired_tokens_are_dropped(master, monkeypatch):
+    monkeypatch.setattr(master, "server_conf", dict(master.server_conf, write_token_ttl_s=60))
+    log = Log("a-0")
+    old, new = master.WriteToken([log.append(1)], 2), master.WriteToken([log.append(1)], 2)
+    old.created -= 120
+    master.register_token(old)
+    master.register_token(new)
+    assert old.token not in master.write_tokens
+    assert master.write_tokens[new.token] is new
+
+def test_write_past_its_deadline_gets_a_token(master, server):
+    response, msg_id = post(server, "late", 3, timeout_ms=50)
+    assert response.status_code == 202
+    token = response.headers['X-Write-Token']
+    assert response.headers['Location'] == f'/writes/{token}'
+    status = requests.get(f'{server}/writes/{token}').json()
+    assert (status["replicas"], status["w"], status["done"]) == (1, 3, False)
+    assert status["logs"] == {"default-0": [msg_id, msg_id]}
+    assert read(server, msg_id)["replicated_ts"] is None
+
+def test_token_completed_later_stamps_the_message(master, server):
+    response, msg_id = post(server, "late", 2, timeout_ms=50)
+    token = response.headers['X-Write-Token']
+    ack(master, msg_id, 1)
+    status = requests.get(f'{server}/writes/{token}').json()
+    assert status["done"] and status["replicas"] == 2
+    assert read(server, msg_id)["replicated_ts"] == status["replicated_ts"] is not None
+
+def test_async_write(master, server):
+    response, msg_id = post(server, "async", 3, **{"async": True})
+    assert response.status_code == 202
+    assert "pending" in response.text
+
+def test_wait_ms_returns_once_the_replicas_have_the_write(master, server):
+    response, msg_id = post(server, "waited", 3, timeout_ms=0)
+    token = response.headers['X-Write-Token']
+    threading.Timer(0.1, ack, (master, msg_id, 1, 2)).start()
+    started = time.monotonic()
+    status = requests.get(f'{server}/writes/{token}', params={"wait_ms": 5000}).json()
+    assert status["done"] and status["replicas"] == 3
+    assert time.monotonic() - started < 4
+    # the deadline of the wait is not an error, the status says how far the write has got
+    response, msg_id = post(server, "waited", 3, timeout_ms=0)
+    status = requests.get(f'{server}/writes/{response.headers["X-Write-Token"]}', params={"wait_ms": 50, "replicas": 2}).json()
+    assert (status["replicas"], status["done"]) == (1, False)
+
+def test_status_stream(master, server):
+    response, msg_id = post(server, "streamed", 3, timeout_ms=0)
+    token = response.headers['X-Write-Token']
+    threading.Timer(0.1, ack, (master, msg_id, 1)).start()
+    threading.Timer(0.2, ack, (master, msg_id, 2)).start()
+    response = requests.get(f'{server}/writes/{token}', params={"stream": 1, "wait_ms": 5000}, stream=True)
+    assert response.headers['Content-Type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in response.iter_lines() if line]
+    # a line on every change until every replica has the write
+    assert [status["replicas"] for status in lines] == [1, 2, 3]
+    assert [status["done"] for status in lines] == [False, False, True]
+
+def test_unknown_or_expired_token(master, server, monkeypatch):
+    assert requests.get(f'{server}/writes/unknown').status_code == 404
+    response, msg_id = post(server, "expiring", 3, timeout_ms=0)
+    token = response.headers['X-Write-Token']
+    monkeypatch.setattr(master, "server_conf", dict(master.server_conf, write_token_ttl_s=0))
+    post(server, "next", 3, timeout_ms=0)
+    assert requests.get(f'{server}/writes/{token}').status_code == 404
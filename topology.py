@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import os, json, time, types, signal, logging, threading
+
+"""
+Cluster config
+config.json is read once into an immutable Topology: the sections become read-only mappings and lists
+become tuples, the hosts and the settings are validated before anything is started. ClusterConfig holds
+the current Topology, a reload reads the file again and swaps the Topology only when the new one is valid,
+then the listeners get the old and the new one to apply the difference. The file is reloaded on SIGHUP
+and when its modification time changes
+"""
+SERVER_MODES = ('threaded', 'asyncio')
+BACKLOG_POLICIES = ('spill', 'resync', 'reject')
+WIRE_FORMATS = ('binary', 'json')
+COMPRESSIONS = ('zstd', 'zlib', 'none')
+ROUTINGS = ('local', 'redirect', 'proxy')
+
+class ConfigError(Exception):
+    pass
+
+def freeze(value):
+    if isinstance(value, dict):
+        return types.MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def check_choice(conf, section, key, choices):
+    value = conf.get(section, {}).get(key)
+    if value is not None and value not in choices:
+        raise ConfigError(f'{section}.{key} must be one of {", ".join(choices)}, not {value!r}')
+
+class Topology():
+    """
+    Validated, read-only cluster config
+    """
+
+    # constructor
+    def __init__(self, conf):
+        self.validate(conf)
+        self.sections = freeze(conf)
+        self.hosts = self.sections["Hosts"]
+        self.master = next(host for host in self.hosts if host.get("type") == "master")
+        # the Secondaries the Master replicates to
+        self.secondaries = tuple(host for host in self.hosts if host.get("type") == "secondary" and host.get("active") == 1)
+
+    # raises KeyError for a missing section, as reading the file did
+    def section(self, key):
+        return self.sections[key]
+
+    # the keys of a section whose values differ in the other Topology, as Section.key
+    def changed(self, other, section, keys):
+        old = self.sections.get(section, {})
+        new = other.sections.get(section, {})
+        return [f'{section}.{key}' for key in keys if old.get(key) != new.get(key)]
+
+    # any Secondary by id, active or not, None when there is no such host
+    def secondary(self, secondary_id):
+        return next((host for host in self.hosts if host.get("type") == "secondary" and host.get("id") == secondary_id), None)
+
+    def validate(self, conf):
+        if not isinstance(conf, dict):
+            raise ConfigError("the config must be a JSON object")
+        hosts = conf.get("Hosts")
+        if not isinstance(hosts, list) or not hosts:
+            raise ConfigError("Hosts must be a non-empty list")
+        ids = set()
+        names = set()
+        for host in hosts:
+            if not isinstance(host, dict) or host.get("type") not in ("master", "secondary"):
+                raise ConfigError(f'every host needs a type, master or secondary: {host!r}')
+            port = host.get("port")
+            if not isinstance(port, int) or isinstance(port, bool) or not 0 < port < 65536:
+                raise ConfigError(f'{host.get("name")} has an invalid port {port!r}')
+            if host["type"] == "secondary":
+                if not isinstance(host.get("id"), int) or host["id"] in ids:
+                    raise ConfigError(f'{host.get("name")} needs a unique integer id, not {host.get("id")!r}')
+                ids.add(host["id"])
+                if not host.get("hostname"):
+                    raise ConfigError(f'{host.get("name")} has no hostname')
+            # the names label the metrics of the Secondaries
+            if host.get("name") in names:
+                raise ConfigError(f'host name {host.get("name")!r} is used twice')
+            names.add(host.get("name"))
+        if sum(host["type"] == "master" for host in hosts) != 1:
+            raise ConfigError("Hosts must contain exactly one master")
+        check_choice(conf, "Server", "mode", SERVER_MODES)
+        check_choice(conf, "Replication", "backlog_policy", BACKLOG_POLICIES)
+        check_choice(conf, "Replication", "wire_format", WIRE_FORMATS)
+        check_choice(conf, "Replication", "compression", COMPRESSIONS)
+        check_choice(conf, "Read", "routing", ROUTINGS)
+        heartbeat_conf = conf.get("Heartbeat", {})
+        if heartbeat_conf.get("phi_suspect", 3) >= heartbeat_conf.get("phi_unhealthy", 8):
+            raise ConfigError("Heartbeat.phi_suspect must be below Heartbeat.phi_unhealthy")
+        for topic, topic_conf in conf.get("Topics", {}).items():
+            partitions = topic_conf.get("partitions", 1)
+            if not isinstance(partitions, int) or partitions < 1:
+                raise ConfigError(f'topic {topic} needs a positive number of partitions, not {partitions!r}')
+
+
+class ClusterConfig():
+    """
+    Current Topology of the cluster, swapped on reload
+    """
+
+    # constructor
+    def __init__(self, path):
+        self.path = path
+        # reloads are applied one at a time
+        self.lock = threading.Lock()
+        self.mtime = self.stat()
+        self.topology = self.load()
+        self.listeners = []
+
+    def stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self):
+        with open(self.path) as json_file:
+            try:
+                conf = json.load(json_file)
+            except ValueError as e:
+                raise ConfigError(f'{self.path} is not valid JSON: {e}')
+        return Topology(conf)
+
+    def section(self, key):
+        return self.topology.section(key)
+
+    # listener(old, new) is called after every reload
+    def on_reload(self, listener):
+        self.listeners.append(listener)
+
+    # read the file again, an invalid config is logged and the current one is kept
+    def reload(self, reason):
+        with self.lock:
+            self.mtime = self.stat()
+            try:
+                topology = self.load()
+            except (OSError, ConfigError) as e:
+                logging.error(f'[Config] {reason}, keeping the current config: {e}')
+                return False
+            old, self.topology = self.topology, topology
+            logging.info(f'[Config] {reason}, the config has been reloaded')
+            for listener in self.listeners:
+                try:
+                    listener(old, topology)
+                except Exception as e:
+                    logging.error(f'[Config] The reloaded config could not be fully applied. Exception: {e}')
+            return True
+
+    # reload on SIGHUP and, unless interval_s is None, when the file changes
+    # must be called from the main thread, which is the only one receiving signals
+    def watch(self, interval_s=1):
+        if hasattr(signal, 'SIGHUP'):
+            # the reload takes locks, so it is not run inside the signal handler
+            signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=self.reload, args=("SIGHUP received",), name="Config reload", daemon=True).start())
+        if interval_s is not None:
+            threading.Thread(target=self.watch_loop, args=(interval_s,), name="Config watcher", daemon=True).start()
+
+    def watch_loop(self, interval_s):
+        while True:
+            time.sleep(interval_s)
+            if self.stat() != self.mtime:
+                self.reload(f'{os.path.basename(self.path)} has changed')
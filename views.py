@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+import hashlib, threading, collections
+from datetime import datetime
+try:
+    from wcwidth import wcswidth
+except ImportError:
+    wcswidth = None
+
+"""
+Cached read views
+The human readable views (the log table of GET / and the health table of the Master) are rendered once
+per version of the data behind them: the first and the last id of the log, the statuses of the Secondaries.
+Until the version changes the view is answered from the cache with an ETag, a client which sends the ETag
+back in If-None-Match gets 304 Not Modified. The table of a page of the log is kept row by row, new
+messages are formatted and laid out on their own and the page is laid out again only when a new row is
+wider than its column. On the Master a row which is not replicated yet is formatted again once it is.
+"""
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# columns of the log table, as formatted by format_row()
+LOG_HEADERS = ("id", "msg", "w", "replicated_ts")
+LOG_NUMERIC = ("id", "w")
+
+# the same width tabulate uses, wide characters count twice when wcwidth is installed
+def text_width(text):
+    if wcswidth is None:
+        return len(text)
+    width = wcswidth(text)
+    return width if width >= 0 else len(text)
+
+def format_row(msg_dict):
+    return {
+        "id": msg_dict.get("id"),
+        "msg": msg_dict.get("msg"),
+        "w": msg_dict.get("w"),
+        "replicated_ts": datetime.utcfromtimestamp(msg_dict.get("replicated_ts")).strftime(TIME_FORMAT) if msg_dict.get("replicated_ts") != None else "NOT REPLICATED"
+    }
+
+def make_etag(body):
+    return '"' + hashlib.blake2b(body.encode('utf-8'), digest_size=12).hexdigest() + '"'
+
+def etag_matches(if_none_match, etag):
+    """
+    If-None-Match holds * or a list of ETags, weak ones match as well
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+class GridTable():
+    """
+    Table in the simple_grid style of tabulate, built row by row.
+    The rendered rows are kept as long as the widths of the columns stay the same.
+    Unlike tabulate the alignment is fixed per column instead of inferred from the values: the numeric
+    columns are right-aligned, header included, the others are left-aligned and shown verbatim.
+    A message which looks like a number stays as sent ("1.50" is not shown as 1.5) and a w column
+    without values keeps its right-aligned header
+    """
+
+    # constructor
+    def __init__(self, headers, numeric=()):
+        self.headers = headers
+        self.numeric = [header in numeric for header in headers]
+        # cell lines of every row
+        self.rows = []
+        # rendered rows, the first len(self.blocks) rows are laid out for the current widths
+        self.blocks = []
+        self.header_widths = [text_width(header) + 2 for header in headers]
+        self.widths = list(self.header_widths)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def append(self, row):
+        cells = [('' if row[header] is None else str(row[header])).strip().split('\n') for header in self.headers]
+        self.rows.append(cells)
+        widths = [max(width, max(text_width(line) for line in lines)) for width, lines in zip(self.widths, cells)]
+        if widths != self.widths:
+            self.widths = widths
+            self.blocks = []
+
+    # keep the first count rows
+    def truncate(self, count):
+        if count >= len(self.rows):
+            return
+        del self.rows[count:]
+        del self.blocks[count:]
+        widths = list(self.header_widths)
+        for cells in self.rows:
+            widths = [max(width, max(text_width(line) for line in lines)) for width, lines in zip(widths, cells)]
+        if widths != self.widths:
+            self.widths = widths
+            self.blocks = []
+
+    def pad(self, text, width, numeric):
+        fill = ' ' * (width - text_width(text))
+        return fill + text if numeric else text + fill
+
+    def render_row(self, cells):
+        height = max(len(lines) for lines in cells)
+        return '\n'.join(
+                            '│ ' + ' │ '.join(self.pad(lines[i] if i < len(lines) else '', width, numeric) for lines, width, numeric in zip(cells, self.widths, self.numeric)) + ' │'
+                        for i in range(height)
+                        )
+
+    def border(self, left, middle, right):
+        return left + middle.join('─' * (width + 2) for width in self.widths) + right
+
+    def render(self):
+        for cells in self.rows[len(self.blocks):]:
+            self.blocks.append(self.render_row(cells))
+        separator = '\n' + self.border('├', '┼', '┤') + '\n'
+        header = self.render_row([[header] for header in self.headers])
+        return self.border('┌', '┬', '┐') + '\n' + header + separator + separator.join(self.blocks) + '\n' + self.border('└', '┴', '┘')
+
+
+class CachedView():
+    """
+    Last rendering of a view, render is called only when the version changes
+    """
+
+    # constructor
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.body = None
+        self.etag = None
+
+    # body and ETag of the version
+    def get(self, version, render):
+        with self.lock:
+            if version != self.version or self.body is None:
+                self.body = render()
+                self.etag = make_etag(self.body)
+                self.version = version
+            return self.body, self.etag
+
+
+class LogPage():
+    """
+    Table of one page of a log, the rows which can no longer change are kept between the versions
+    """
+
+    # constructor
+    def __init__(self, from_id, limit):
+        self.from_id = from_id
+        self.limit = limit
+        self.table = GridTable(LOG_HEADERS, LOG_NUMERIC)
+        # leading rows which are final, the others are read and formatted again
+        self.final_rows = 0
+        self.view = CachedView()
+
+    # read(from_id, limit) gives the messages, final(msg_dict) tells whether a message can no longer change
+    def update(self, last_id, read, final):
+        self.table.truncate(self.final_rows)
+        count = min(self.limit, last_id - self.from_id + 1) - self.final_rows
+        if count <= 0:
+            return
+        for msg_dict in read(self.from_id + self.final_rows, count):
+            if self.final_rows == len(self.table) and final(msg_dict):
+                self.final_rows += 1
+            self.table.append(format_row(msg_dict))
+
+    def render(self, first_id, last_id):
+        if not len(self.table):
+            return 'The replication log is empty\n'
+        response = 'The replication log:\n' + self.table.render()
+        to_id = self.from_id + len(self.table) - 1
+        if self.from_id > first_id or to_id < last_id:
+            response += f'\nShowing messages {self.from_id}-{to_id} of {last_id}, use ?from_id=N to see other messages'
+        return response + '\n'
+
+
+class LogView():
+    """
+    Cached table pages of one log, the most recently read ones are kept
+    """
+
+    # constructor
+    def __init__(self, max_pages=8):
+        self.lock = threading.Lock()
+        self.max_pages = max_pages
+        self.pages = collections.OrderedDict()
+        # bumped when messages change without a change of the ids, like the replicated_ts on the Master
+        self.generation = 0
+
+    def touch(self):
+        with self.lock:
+            self.generation += 1
+
+    # body and ETag of the page, rendered again only when the log has changed
+    def get(self, from_id, limit, first_id, last_id, read, final=lambda msg_dict: True):
+        with self.lock:
+            page = self.pages.pop((from_id, limit), None) or LogPage(from_id, limit)
+            self.pages[(from_id, limit)] = page
+            if len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+            version = (first_id, last_id, self.generation)
+
+        def render():
+            page.update(last_id, read, final)
+            return page.render(first_id, last_id)
+        return page.view.get(version, render)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import json, time, zlib, struct, threading, collections
+from array import array
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+"""
+Replication wire format
+A binary batch is a sequence of length-prefixed frames, one per message: id, w, the length of the
+message text and the UTF-8 text itself. Field names and the empty replicated_ts are not sent and no
+JSON is encoded or parsed. The body of a batch may be compressed with zstd (when the zstandard package
+is installed) or zlib. The Secondary lists what it accepts in the headers of GET /health and the Master
+picks the best common format, JSON stays the fallback for the Secondaries which do not list anything.
+Every request of the Master carries its last id, the answers of the Secondary carry its highest contiguous id,
+so both sides can tell how stale the Secondary is.
+"""
+JSON_CONTENT_TYPE = 'application/json'
+BINARY_CONTENT_TYPE = 'application/x-replog-batch'
+# id, w, length of the message text
+FRAME_HEADER = struct.Struct('<QII')
+FORMATS = ('binary', 'json')
+# in the order of preference
+ENCODINGS = (('zstd',) if zstandard is not None else ()) + ('deflate', 'identity')
+FORMATS_HEADER = 'X-Replication-Formats'
+ENCODINGS_HEADER = 'X-Replication-Encodings'
+MASTER_LAST_ID_HEADER = 'X-Master-Last-Id'
+CONTIGUOUS_ID_HEADER = 'X-Contiguous-Id'
+# the heartbeat covers every log, the ids are sent as a JSON object keyed by the log name
+MASTER_LAST_IDS_HEADER = 'X-Master-Last-Ids'
+CONTIGUOUS_IDS_HEADER = 'X-Contiguous-Ids'
+
+class WireFormatError(ValueError):
+    pass
+
+class Freshness():
+    """
+    Replication lag of a Secondary
+    The last id of the Master is recorded together with the time whenever it is sent to the Secondary.
+    Once the watermark of the Secondary has reached a recorded id, the Secondary has had every message the
+    Master had at that time, the lag is the time passed since then.
+    """
+
+    # constructor
+    def __init__(self, max_reports=10000):
+        self.lock = threading.Lock()
+        self.reports = collections.deque(maxlen=max_reports)
+        self.fresh_at = None
+
+    def report(self, master_last_id):
+        with self.lock:
+            self.reports.append((time.monotonic(), master_last_id))
+
+    # lag in ms for the watermark, None until the Secondary has caught up with any reported id
+    def lag_ms(self, watermark):
+        with self.lock:
+            while self.reports and self.reports[0][1] <= watermark:
+                self.fresh_at = self.reports.popleft()[0]
+            if self.fresh_at is None:
+                return None
+            return (time.monotonic() - self.fresh_at) * 1000
+
+def capabilities():
+    """
+    Headers of GET /health announcing the accepted formats
+    """
+    return {FORMATS_HEADER: ', '.join(FORMATS), ENCODINGS_HEADER: ', '.join(ENCODINGS)}
+
+def negotiate(headers, wire_format, compression):
+    """
+    Format and encoding for a Secondary, given the headers of its GET /health response
+    and the preferred ones from the Replication section of config.json
+    """
+    formats = [value.strip() for value in headers.get(FORMATS_HEADER, 'json').split(',')]
+    encodings = [value.strip() for value in headers.get(ENCODINGS_HEADER, 'identity').split(',')]
+    fmt = wire_format if wire_format in formats else 'json'
+    if compression == 'none' or fmt == 'json':
+        return fmt, 'identity'
+    # zstd falls back to zlib when one of the sides has no zstandard
+    for encoding in ('zstd', 'deflate') if compression == 'zstd' else ('deflate',):
+        if encoding in encodings and encoding in ENCODINGS:
+            return fmt, encoding
+    return fmt, 'identity'
+
+def encode_batch(messages, fmt, encoding='identity', min_bytes=0):
+    """
+    Body and headers of a replication request, batches smaller than min_bytes are not compressed
+    """
+    if fmt == 'json':
+        return json.dumps({"messages": messages}).encode('utf-8'), {'Content-Type': JSON_CONTENT_TYPE}
+    frames = []
+    for msg_dict in messages:
+        payload = msg_dict["msg"].encode('utf-8')
+        frames.append(FRAME_HEADER.pack(msg_dict["id"], msg_dict.get("w") or 0, len(payload)))
+        frames.append(payload)
+    data = b''.join(frames)
+    headers = {'Content-Type': BINARY_CONTENT_TYPE}
+    if encoding != 'identity' and len(data) >= min_bytes:
+        data = compress(data, encoding)
+        headers['Content-Encoding'] = encoding
+    return data, headers
+
+def decode_batch(content_type, content_encoding, body):
+    """
+    Messages of a replication request, raises WireFormatError
+    """
+    if content_encoding and content_encoding != 'identity':
+        body = decompress(body, content_encoding)
+    if not content_type or content_type.startswith(JSON_CONTENT_TYPE):
+        try:
+            body_json = json.loads(body)
+        except ValueError as e:
+            raise WireFormatError(f'Invalid JSON batch: {e}')
+        if not isinstance(body_json, dict) or "messages" not in body_json:
+            raise WireFormatError('A JSON batch is an object with a messages array')
+        return body_json["messages"]
+    if not content_type.startswith(BINARY_CONTENT_TYPE):
+        raise WireFormatError(f'Unsupported content type: {content_type}')
+    messages = []
+    offset = 0
+    view = memoryview(body)
+    while offset < len(body):
+        if offset + FRAME_HEADER.size > len(body):
+            raise WireFormatError(f'Truncated frame header at offset {offset}')
+        msg_id, w, length = FRAME_HEADER.unpack_from(body, offset)
+        offset += FRAME_HEADER.size
+        if offset + length > len(body):
+            raise WireFormatError(f'Truncated message {msg_id}')
+        try:
+            messages.append({"id": msg_id, "msg": str(view[offset:offset + length], 'utf-8'), "w": w})
+        except UnicodeDecodeError as e:
+            raise WireFormatError(f'Invalid UTF-8 in message {msg_id}: {e}')
+        offset += length
+    return messages
+
+def encode_acks(acks, content_type):
+    """
+    Acknowledged ids in the format of the request, the binary answer is an array of 64-bit ids
+    """
+    if content_type and content_type.startswith(BINARY_CONTENT_TYPE):
+        return array('Q', acks).tobytes(), BINARY_CONTENT_TYPE
+    return json.dumps({"acks": acks}).encode('utf-8'), JSON_CONTENT_TYPE
+
+def decode_acks(content_type, body):
+    if content_type and content_type.startswith(BINARY_CONTENT_TYPE):
+        acks = array('Q')
+        acks.frombytes(body)
+        return acks.tolist()
+    return json.loads(body).get("acks", [])
+
+def compress(data, encoding):
+    if encoding == 'zstd':
+        # compressors are not thread-safe, the senders do not share one
+        return zstandard.ZstdCompressor().compress(data)
+    if encoding == 'deflate':
+        return zlib.compress(data, 1)
+    raise WireFormatError(f'Unsupported content encoding: {encoding}')
+
+def decompress(data, encoding):
+    if encoding == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(data)
+        except zlib.error as e:
+            raise WireFormatError(f'Invalid deflate body: {e}')
+    raise WireFormatError(f'Unsupported content encoding: {encoding}')